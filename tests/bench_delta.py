@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections.abc import Callable
+from concurrent.futures import (
+    ALL_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from concurrent.futures import wait as futures_wait
+from contextlib import nullcontext, suppress
+from multiprocessing import get_context
+from pathlib import Path
+from stat import S_IMODE, S_ISLNK, S_ISREG
+
+import cbor2
+from xxhash import xxh3_64_intdigest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from umu.umu_bspatch import CustomPatcher, PatchFile
+from umu.umu_mkpatch import diff_trees
+
+# Subdirectories of the Proton-like trees, after the layout of a Proton build
+TREE_DIRS = (
+    "files/bin",
+    "files/lib/wine/i386-windows",
+    "files/lib/wine/i386-unix",
+    "files/lib/wine/x86_64-windows",
+    "files/lib/wine/x86_64-unix",
+    "files/lib/vkd3d",
+    "files/share/wine/fonts",
+    "files/share/default_pfx/drive_c/windows/system32",
+    "protonfixes/gamefixes-steam",
+    "protonfixes/gamefixes-umu",
+)
+
+# Weights and ranges of the sizes of the files of Proton-like trees, in bytes
+SIZE_CLASSES = (
+    (70, 256, 32 * 1024),
+    (25, 32 * 1024, 512 * 1024),
+    (5, 512 * 1024, 4 * 1024 * 1024),
+)
+
+
+def make_flat_trees(a: Path, b: Path, count: int, size: int, seed: int = 0) -> None:
+    """Create a flat tree of count files of size in a and its next version in b."""
+    rng = random.Random(seed)  # noqa: S311
+    a.mkdir(parents=True)
+    b.mkdir(parents=True)
+
+    for i in range(count):
+        name = f"{i:06d}.bin"
+        source = rng.randbytes(size)
+        # Change a small region of each file, like a typical build of a library
+        offset = rng.randrange(size)
+        target = source[:offset] + rng.randbytes(64) + source[offset + 64 :]
+        a.joinpath(name).write_bytes(source)
+        b.joinpath(name).write_bytes(target)
+
+
+def make_data(rng: random.Random, size: int) -> bytes:
+    """Return data of size that is about as compressible as a typical binary."""
+    noise = rng.randbytes(size // 2)
+    pattern = bytes(rng.randrange(16) for _ in range(64))
+    return (noise + pattern * (size // 128 + 1))[:size]
+
+
+def mutate_data(rng: random.Random, data: bytes) -> bytes:
+    """Return data with a few small regions replaced, inserted or removed."""
+    for _ in range(rng.randint(1, 4)):
+        offset = rng.randrange(len(data) + 1)
+        end = offset + rng.choice((0, 64, 64, 256))
+        data = data[:offset] + rng.randbytes(rng.choice((0, 64, 64, 512))) + data[end:]
+    return data
+
+
+def make_proton_trees(
+    a: Path, b: Path, count: int, max_size: int, seed: int = 0
+) -> None:
+    """Create a Proton-like tree of count files in a and its next version in b.
+
+    Between both trees, files are updated, added, deleted and change mode, links
+    are retargeted, added and deleted, and directories are added, deleted and
+    change mode.
+    """
+    rng = random.Random(seed)  # noqa: S311
+    weights = [weight for weight, *_ in SIZE_CLASSES]
+
+    for path in TREE_DIRS:
+        a.joinpath(path).mkdir(parents=True, exist_ok=True)
+    a.joinpath("files/share/obsolete").mkdir()
+
+    files = []
+    for i in range(count):
+        _, low, high = rng.choices(SIZE_CLASSES, weights)[0]
+        name = f"{rng.choice(TREE_DIRS)}/{i:06d}.dll"
+        file = a.joinpath(name)
+        file.write_bytes(make_data(rng, min(rng.randint(low, high), max_size)))
+        file.chmod(rng.choice((0o644, 0o644, 0o755)))
+        files.append(name)
+    for i in range(count // 64 + 1):
+        a.joinpath(f"files/share/obsolete/{i:06d}.dat").write_bytes(
+            make_data(rng, 1024)
+        )
+
+    links = []
+    for i in range(count // 16 + 1):
+        name = f"files/lib/wine/x86_64-unix/{i:06d}.so"
+        a.joinpath(name).symlink_to(Path(rng.choice(files)).name)
+        links.append(name)
+
+    shutil.copytree(a, b, symlinks=True)
+
+    rng.shuffle(files)
+    split = [count * percent // 100 for percent in (30, 35, 40)]
+    for name in files[: split[0]]:
+        file = b.joinpath(name)
+        file.write_bytes(mutate_data(rng, file.read_bytes()))
+    for name in files[split[0] : split[1]]:
+        file = b.joinpath(name)
+        file.chmod(S_IMODE(file.stat().st_mode) ^ 0o111)
+    for name in files[split[1] : split[2]]:
+        b.joinpath(name).unlink()
+    for i in range(count // 20 + 1):
+        _, low, high = rng.choices(SIZE_CLASSES, weights)[0]
+        b.joinpath(f"{rng.choice(TREE_DIRS)}/{i:06d}.new.dll").write_bytes(
+            make_data(rng, min(rng.randint(low, high), max_size))
+        )
+
+    for name in links[::4]:
+        b.joinpath(name).unlink()
+        b.joinpath(name).symlink_to(Path(rng.choice(files[split[2] :])).name)
+    for name in links[1::4]:
+        b.joinpath(name).unlink()
+    b.joinpath("files/lib/wine/x86_64-unix/new.so").symlink_to(Path(files[-1]).name)
+
+    shutil.rmtree(b.joinpath("files/share/obsolete"))
+    b.joinpath("files/share/new").mkdir()
+    for i in range(count // 64 + 1):
+        b.joinpath(f"files/share/new/{i:06d}.dat").write_bytes(make_data(rng, 2048))
+    b.joinpath("protonfixes/gamefixes-umu").chmod(0o750)
+
+
+def make_patch(a: Path, b: Path, thread_pool: ThreadPoolExecutor) -> Path:
+    """Create a patch file updating the tree a to the tree b, next to both."""
+    patch = a.parent.joinpath("patch.cbor")
+    patch.write_bytes(
+        cbor2.dumps(
+            {
+                "contents": [diff_trees(a, b, thread_pool)],
+                "signature": (b"", b""),
+                "public_key": (b"", b""),
+            }
+        )
+    )
+    return patch
+
+
+def snapshot(root: Path) -> dict[str, tuple[int, object]]:
+    """Return the mode and the digest or target of each file of root by its name."""
+    result = {}
+    for path, dirs, names in os.walk(root):
+        for name in dirs + names:
+            file = Path(path, name)
+            stats = file.lstat()
+            value = None
+            if S_ISREG(stats.st_mode):
+                value = xxh3_64_intdigest(file.read_bytes())
+            elif S_ISLNK(stats.st_mode):
+                value = str(file.readlink())
+            result[str(file.relative_to(root))] = (stats.st_mode, value)
+    return result
+
+
+def peak_rss() -> int:
+    """Return the peak resident set size of the benchmark since the last reset, in KiB."""
+    with suppress(OSError), Path("/proc/self/status").open() as file:
+        for line in file:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def reset_peak_rss() -> None:
+    """Reset the peak resident set size of the benchmark, if supported."""
+    # See https://man7.org/linux/man-pages/man5/proc_pid_clear_refs.5.html
+    with suppress(OSError), Path("/proc/self/clear_refs").open("w") as file:
+        file.write("5")
+
+
+def run_op(schedule: Callable[[], None], futures: list[Future]) -> tuple[float, int]:
+    """Run an operation of a patcher, returning its elapsed time and peak RSS."""
+    reset_peak_rss()
+    start = time.perf_counter()
+    schedule()
+    futures_wait(futures, return_when=ALL_COMPLETED)
+    for future in futures:
+        future.result()
+    return time.perf_counter() - start, peak_rss()
+
+
+def bench_tree(
+    patch: Path,
+    a: Path,
+    b: Path,
+    root: Path,
+    thread_pool: ThreadPoolExecutor,
+    process_pool: ProcessPoolExecutor | None,
+) -> tuple[list[dict], bool]:
+    """Apply the patch to a copy of a, returning the results of each operation.
+
+    Also returns whether the patched copy is identical to b.
+    """
+    results = []
+    shutil.rmtree(root, ignore_errors=True)
+    shutil.copytree(a, root, symlinks=True)
+
+    with PatchFile(patch) as cbor:
+        content = cbor.contents[0]
+        patcher = CustomPatcher(content, root, thread_pool, process_pool)
+        verify, add, update, delete = patcher.result()
+        # Applied in the order of an update
+        ops = (
+            ("verify", "manifest", patcher.verify_integrity, verify),
+            ("update", "update", patcher.update_binaries, update),
+            ("add", "add", patcher.add_binaries, add),
+            ("delete", "delete", patcher.delete_binaries, delete),
+        )
+        for op, section, schedule, futures in ops:
+            entries = [item for item, *_ in content[section].stubs()]
+            seconds, rss = run_op(schedule, futures)
+            size = sum(item.get("size", 0) for item in entries)
+            results.append(
+                {
+                    "op": op,
+                    "entries": len(entries),
+                    "bytes": size,
+                    "seconds": seconds,
+                    "entries_per_second": len(entries) / seconds,
+                    "mib_per_second": size / seconds / (1024 * 1024),
+                    "peak_rss_kib": rss,
+                }
+            )
+
+    return results, snapshot(root) == snapshot(b)
+
+
+def get_revision() -> str:
+    """Return the revision of the checkout being benchmarked."""
+    with suppress(OSError, subprocess.CalledProcessError):
+        return subprocess.run(
+            ("git", "describe", "--always", "--dirty"),  # noqa: S607
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    return ""
+
+
+def main():  # noqa: D103
+    parser = ArgumentParser(
+        description="Time each operation of CustomPatcher on synthetic trees"
+    )
+    parser.add_argument(
+        "--trees",
+        nargs="*",
+        default=["4096x4096", "1024x65536", "64x4194304"],
+        help="flat trees to patch as COUNTxSIZE (e.g., 4096x4096 for 4096 files of 4 KiB)",
+    )
+    parser.add_argument(
+        "--files",
+        type=int,
+        nargs="*",
+        default=[256, 1024],
+        help="number of files of each Proton-like tree to patch",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        default=4 * 1024 * 1024,
+        help="max size of each file of the Proton-like trees, in bytes",
+    )
+    parser.add_argument("--runs", type=int, default=3, help="runs per pool size")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[os.cpu_count() or 1],
+        help="pool sizes of the patcher",
+    )
+    parser.add_argument(
+        "--backend",
+        nargs="+",
+        choices=("thread", "process"),
+        default=["thread", "process"],
+        help="backends of the patcher",
+    )
+    parser.add_argument(
+        "--tmpdir", help="directory to generate the trees in (default: system temp)"
+    )
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the trees")
+    args = parser.parse_args()
+    results = []
+    ok = True
+
+    with (
+        tempfile.TemporaryDirectory(dir=args.tmpdir) as tmp,
+        ThreadPoolExecutor() as diff_pool,
+    ):
+        trees = []
+        for tree in args.trees:
+            count, size = (int(value) for value in tree.split("x"))
+            a = Path(tmp, tree, "UMU-Proton-0")
+            b = Path(tmp, tree, "UMU-Proton-1")
+            make_flat_trees(a, b, count, size, args.seed)
+            trees.append((tree, count, a, b))
+        for count in args.files:
+            tree = f"proton-{count}"
+            a = Path(tmp, tree, "UMU-Proton-0")
+            b = Path(tmp, tree, "UMU-Proton-1")
+            make_proton_trees(a, b, count, args.max_size, args.seed)
+            trees.append((tree, count, a, b))
+
+        for tree, count, a, b in trees:
+            patch = make_patch(a, b, diff_pool)
+            for backend in args.backend:
+                for workers in args.workers:
+                    with (
+                        ThreadPoolExecutor(max_workers=workers) as thread_pool,
+                        ProcessPoolExecutor(
+                            max_workers=workers, mp_context=get_context("forkserver")
+                        )
+                        if backend == "process"
+                        else nullcontext() as process_pool,
+                    ):
+                        for run in range(args.runs):
+                            ops, same = bench_tree(
+                                patch,
+                                a,
+                                b,
+                                Path(tmp, tree, "root"),
+                                thread_pool,
+                                process_pool,
+                            )
+                            ok = ok and same
+                            results.extend(
+                                {
+                                    "tree": tree,
+                                    "files": count,
+                                    "backend": backend,
+                                    "workers": workers,
+                                    "run": run,
+                                    **op,
+                                }
+                                for op in ops
+                            )
+
+    # Report the fastest backend to update each tree, marking the crossover point
+    fastest = {}
+    for result in results:
+        if result["op"] != "update":
+            continue
+        key = (result["tree"], result["workers"])
+        best = fastest.get(key)
+        if not best or result["seconds"] < best["seconds"]:
+            fastest[key] = result
+
+    report = json.dumps(
+        {
+            "revision": get_revision(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "ok": ok,
+            "results": results,
+            "fastest": [
+                {"tree": tree, "workers": workers, "backend": result["backend"]}
+                for (tree, workers), result in fastest.items()
+            ],
+        },
+        indent=2,
+    )
+    if args.output:
+        Path(args.output).write_text(report)
+    else:
+        print(report)
+
+    # The patched trees are expected to be identical to the generated ones
+    return int(not ok)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from umu.umu_runtime import verify_mtree
+
+
+def main():  # noqa: D103
+    parser = ArgumentParser(
+        description="Compare pv-verify with umu's mtree verifier on a runtime"
+    )
+    parser.add_argument(
+        "runtime",
+        help="path to an installed runtime (e.g., ~/.local/share/umu/steamrt3)",
+    )
+    parser.add_argument("--runs", type=int, default=3, help="runs per verifier")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 4, min(32, (os.cpu_count() or 1) + 4)],
+        help="thread pool sizes for umu's verifier",
+    )
+    args = parser.parse_args()
+
+    local = Path(args.runtime).expanduser()
+    platform = max(file for file in local.glob("*_platform_*") if file.is_dir())
+    files = platform.joinpath("files")
+    mtree = platform.joinpath("usr-mtree.txt.gz")
+    pv_verify = local.joinpath("pressure-vessel", "bin", "pv-verify")
+    results = []
+
+    if pv_verify.is_file():
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            ret = subprocess.run(
+                (pv_verify, "--quiet", "--minimized-runtime", files), check=False
+            ).returncode
+            results.append(
+                {
+                    "verifier": "pv-verify",
+                    "workers": 1,
+                    "ok": ret == 0,
+                    "seconds": time.perf_counter() - start,
+                }
+            )
+
+    for workers in args.workers:
+        with ThreadPoolExecutor(max_workers=workers) as thread_pool:
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                failed = verify_mtree(files, mtree, thread_pool, minimized=True)
+                results.append(
+                    {
+                        "verifier": "umu",
+                        "workers": workers,
+                        "ok": not failed,
+                        "seconds": time.perf_counter() - start,
+                        "failed": [
+                            f"{entry.name}: {reason}" for entry, reason in failed
+                        ],
+                    }
+                )
+
+    print(json.dumps({"runtime": platform.name, "results": results}, indent=2))
+
+    # Both verifiers are expected to agree
+    return int(len({result["ok"] for result in results}) != 1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
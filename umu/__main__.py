@@ -12,6 +12,7 @@ from argparse import ArgumentParser, Namespace, RawTextHelpFormatter
 from umu import __version__
 from umu.umu_consts import PROTON_VERBS
 from umu.umu_log import log
+from umu.umu_mkpatch import mkpatch
 from umu.umu_run import umu_run
 from umu.umu_util import is_winetricks_verb
 
@@ -68,6 +69,10 @@ def parse_args() -> Namespace | tuple[str, list[str]]:  # noqa: D103
 
 
 def main() -> int:  # noqa: D103
+    # Patch generator for compatibility tools. Does not run a game
+    if sys.argv[1:2] == ["mkpatch"]:
+        return mkpatch(sys.argv[2:])
+
     args: Namespace | tuple[str, list[str]] = parse_args()
 
     # Adjust logger for debugging when configured
@@ -1,18 +1,54 @@
+import json
 import os
-from concurrent.futures import Future, ThreadPoolExecutor
-from contextlib import suppress
+from collections.abc import Callable, Generator, Iterable, Iterator
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    FIRST_EXCEPTION,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from concurrent.futures import wait as futures_wait
+from contextlib import contextmanager, nullcontext, suppress
+from dataclasses import dataclass, field
 from enum import Enum
-from mmap import ACCESS_READ, ACCESS_WRITE, MADV_DONTNEED, mmap
+from functools import lru_cache, partial
+from hashlib import sha256, sha512
+from heapq import heapify, heappop, heappush
+from http import HTTPStatus
+from io import BufferedWriter
+from itertools import chain, count
+from mmap import ACCESS_READ, MADV_DONTNEED, mmap
+from multiprocessing import get_context
 from pathlib import Path
-from shutil import rmtree
-from typing import TypedDict
+from resource import RUSAGE_CHILDREN, RUSAGE_SELF, getrusage
+from shutil import copytree, rmtree
+from stat import S_IFREG, S_IMODE
+from tempfile import mkstemp
+from threading import Condition, Lock
+from time import perf_counter_ns
+from typing import Any, TypedDict
 
+from urllib3.poolmanager import PoolManager
+from urllib3.response import BaseHTTPResponse
+
+from umu.umu_consts import HTTPMethod
 from umu.umu_log import log
-from umu.umu_util import memfdfile
+from umu.umu_util import (
+    IOOrder,
+    exchange,
+    get_io_order,
+    get_layout_key,
+    link_file,
+    write_file_chunks,
+)
 
 with suppress(ModuleNotFoundError):
-    from pyzstd import DParameter, ZstdDict, decompress
-    from xxhash import xxh3_64_intdigest
+    from cbor2 import dumps, loads
+    from pyzstd import DParameter, EndlessZstdDecompressor, ZstdDict
+    from xxhash import xxh3_64, xxh3_64_intdigest
 
 
 class FileType(Enum):
@@ -28,6 +64,14 @@ class FileType(Enum):
     Socket = "socket"
 
 
+class PatchTask(Enum):
+    """Represent a task applying an entry of a patch file."""
+
+    Check = "check"
+    Write = "write"
+    Patch = "patch"
+
+
 class Entry(TypedDict):
     """Represents an entry within a patch section of a patch file."""
 
@@ -67,13 +111,13 @@ class ManifestEntry(TypedDict):
 class Content(TypedDict):
     """Represent a child of the root section, containing patch sections of a patch file."""
 
-    manifest: list[ManifestEntry]
+    manifest: Iterable[ManifestEntry]
     # List of binaries to add in target directory
-    add: list[Entry]
+    add: Iterable[Entry]
     # List of binaries to update in target directory
-    update: list[Entry]
+    update: Iterable[Entry]
     # List of binaries to delete in target directory
-    delete: list[Entry]
+    delete: Iterable[Entry]
     source: str
     target: str
 
@@ -94,6 +138,750 @@ ZSTD_WINDOW_LOG_MIN = 10
 
 ZSTD_WINDOW_LOG_MAX = 31
 
+# Max number of bytes decompressed at once when writing a file
+DECOMPRESS_WINDOW = 1024 * 1024
+
+# Max number of tasks holding patch data that may be submitted but not completed
+PATCH_PENDING_MAX = 16
+
+# Max number of tasks in flight within a task graph
+TASK_PENDING_MAX = max(PATCH_PENDING_MAX, 2 * (os.cpu_count() or 1))
+
+# Number of the slowest tasks of a task graph to report
+TASK_REPORT_MAX = 8
+
+# Default max number of bytes held in memory by the tasks decompressing files, in MiB
+DELTA_MEMORY_MAX = 1024
+
+# CBOR major types of the items within a patch file
+# See https://www.rfc-editor.org/rfc/rfc8949.html#section-3.1
+CBOR_BYTES = 2
+CBOR_TEXT = 3
+CBOR_ARRAY = 4
+CBOR_MAP = 5
+CBOR_TAG = 6
+CBOR_SIMPLE = 7
+
+# Argument of an indefinite-length item, or the 'break' stop code
+CBOR_INDEFINITE = -1
+
+# Max number of digests kept in a digest cache. Beyond this, the least recently
+# recorded digests are dropped
+DIGEST_CACHE_MAX = 1 << 17
+
+# Magic number of an indexed patch file. Followed by the length of its header as an
+# 8-byte big-endian integer, the header, then the payloads of its files. The header
+# is a CBOR map like a patch file, whose contents are an index: file entries hold
+# the offset (relative to the first payload), length and SHA-256 digest of their
+# payload instead of their data. Each payload is a file entry encoded in CBOR
+PATCH_MAGIC = b"UMUPATCH"
+
+# Offset of the header of an indexed patch file
+PATCH_HEADER_START = len(PATCH_MAGIC) + 8
+
+# Suffix of the name of an indexed patch file. Preferred to the CBOR patch file
+PATCH_INDEXED_SUFFIX = ".umupatch"
+
+# Number of bytes requested first from an indexed patch file, expected to include
+# its header
+PATCH_HEAD_SIZE = 256 * 1024
+
+# Max number of bytes between two payloads fetched within the same range request
+PATCH_RANGE_GAP = 64 * 1024
+
+# Max number of bytes of the payloads fetched within each range request
+PATCH_RANGE_MAX = 16 * 1024 * 1024
+
+# Identifies a patch file by its path, inode and modification time
+PatchRef = tuple[str, int, int]
+
+# Identifies the contents of a file by its device, inode, size, modification and
+# change time. Any modification or replacement of the file changes its key
+DigestKey = tuple[int, int, int, int, int]
+
+
+def _cbor_head(buf: mmap, pos: int) -> tuple[int, int, int]:
+    """Return the major type, argument and end offset of a CBOR item's head."""
+    major: int = buf[pos] >> 5
+    info: int = buf[pos] & 0x1F
+
+    if info < 24:  # noqa: PLR2004
+        return major, info, pos + 1
+
+    if info < 28:  # noqa: PLR2004
+        end: int = pos + 1 + (1 << (info - 24))
+        return major, int.from_bytes(buf[pos + 1 : end], "big"), end
+
+    if info == 31 and major not in {0, 1, CBOR_TAG}:  # noqa: PLR2004
+        return major, CBOR_INDEFINITE, pos + 1
+
+    err: str = f"Malformed CBOR item at offset {pos}"
+    raise ValueError(err)
+
+
+def _cbor_skip(buf: mmap, pos: int) -> int:
+    """Return the end offset of the CBOR item at an offset without decoding it."""
+    # Number of items left to skip within each enclosing container
+    stack: list[int] = []
+    remaining: int = 1
+
+    while remaining or stack:
+        if not remaining:
+            remaining = stack.pop()
+            continue
+        major, arg, pos = _cbor_head(buf, pos)
+        if major == CBOR_SIMPLE and arg == CBOR_INDEFINITE:
+            # End of an indefinite-length container
+            remaining = stack.pop()
+            continue
+        if remaining > 0:
+            remaining -= 1
+        if major in {CBOR_BYTES, CBOR_TEXT} and arg != CBOR_INDEFINITE:
+            pos += arg
+        elif major in {CBOR_BYTES, CBOR_TEXT, CBOR_ARRAY, CBOR_MAP}:
+            if arg == CBOR_INDEFINITE:
+                stack.append(remaining)
+                remaining = CBOR_INDEFINITE
+            elif arg:
+                stack.append(remaining)
+                remaining = arg * 2 if major == CBOR_MAP else arg
+        elif major == CBOR_TAG:
+            remaining += 1 if remaining >= 0 else 0
+
+    if pos > len(buf):
+        err: str = f"Truncated CBOR item, expected {pos} bytes, received {len(buf)}"
+        raise ValueError(err)
+
+    return pos
+
+
+def _cbor_items(
+    buf: mmap, pos: int, major: int
+) -> Generator[tuple[int, int], Any, None]:
+    """Yield the span of each item within the CBOR array or map at an offset."""
+    found, arg, pos = _cbor_head(buf, pos)
+    if found != major:
+        err: str = f"Expected CBOR major type {major}, received {found} at {pos}"
+        raise ValueError(err)
+
+    count: int = arg * 2 if major == CBOR_MAP else arg
+    while count:
+        if arg == CBOR_INDEFINITE and buf[pos] == 0xFF:  # noqa: PLR2004
+            break
+        end: int = _cbor_skip(buf, pos)
+        yield pos, end
+        pos = end
+        count -= 1
+
+
+def _cbor_spans(buf: mmap, pos: int) -> dict[str, tuple[int, int]]:
+    """Return the span of each value by key within the CBOR map at an offset."""
+    spans: dict[str, tuple[int, int]] = {}
+    key: str = ""
+
+    for i, (start, end) in enumerate(_cbor_items(buf, pos, CBOR_MAP)):
+        if i % 2:
+            spans[key] = (start, end)
+            continue
+        major, arg, head = _cbor_head(buf, start)
+        if major != CBOR_TEXT or arg == CBOR_INDEFINITE:
+            err: str = f"Expected a text key at offset {start}"
+            raise ValueError(err)
+        key = buf[head : head + arg].decode()
+
+    return spans
+
+
+class PatchSection:
+    """Represent a patch section of a patch file, decoding its entries on demand."""
+
+    def __init__(  # noqa: D107
+        self, buf: mmap, pos: int, ref: PatchRef, base: int | None = None
+    ) -> None:
+        self._buf = buf
+        self._pos = pos
+        self.ref = ref
+        # Offset of the payloads of an indexed patch file
+        self._base = base
+
+    def __iter__(self) -> Generator[Any, Any, None]:  # noqa: D105
+        for _, start, end in self.stubs():
+            yield loads(self._buf[start:end])
+
+    def stubs(self) -> Generator[tuple[Any, int, int], Any, None]:
+        """Yield each entry without the data of files, with the span of the entry.
+
+        Intended for entries applied in another process, which will decode the entry
+        from the patch file by its span. Within an indexed patch file, the span of a
+        file is the span of its payload.
+        """
+        for start, end in _cbor_items(self._buf, self._pos, CBOR_ARRAY):
+            spans: dict[str, tuple[int, int]] = _cbor_spans(self._buf, start)
+            data: tuple[int, int] | None = spans.pop("data", None)
+            payload: tuple[int, int, int] | None = None
+            if self._base is not None and "offset" in spans:
+                offset, length, _ = (
+                    loads(self._buf[slice(*spans.pop(key))])
+                    for key in ("offset", "length", "digest")
+                )
+                payload = (self._base + offset, self._base + offset + length)
+            item: dict[str, Any] = {
+                key: loads(self._buf[slice(*span)]) for key, span in spans.items()
+            }
+            if data and item.get("type") != FileType.File.value:
+                item["data"] = loads(self._buf[slice(*data)])
+            yield (item, *payload) if payload else (item, start, end)
+
+    def payloads(self) -> Generator[tuple[int, int, bytes], Any, None]:
+        """Yield the offset, length and digest of each payload of the section.
+
+        Only relevant for an indexed patch file. Offsets are within the patch file.
+        """
+        if self._base is None:
+            return
+        for start, _ in _cbor_items(self._buf, self._pos, CBOR_ARRAY):
+            spans: dict[str, tuple[int, int]] = _cbor_spans(self._buf, start)
+            if "offset" not in spans:
+                continue
+            offset, length, digest = (
+                loads(self._buf[slice(*spans[key])])
+                for key in ("offset", "length", "digest")
+            )
+            yield self._base + offset, length, digest
+
+
+class PatchFile:
+    """Represent a patch file on disk.
+
+    Only the structure of the patch file is read when opened, and the entries of
+    each patch section are decoded one at a time when iterated. As a result, memory
+    usage is bounded by the largest entry instead of the size of the patch file.
+
+    Both CBOR patch files and indexed patch files are supported. Within an indexed
+    patch file, only the header is read when opened.
+    """
+
+    def __init__(self, path: Path) -> None:  # noqa: D107
+        with path.open("rb") as file:
+            stats: os.stat_result = os.fstat(file.fileno())
+            self._buf = mmap(file.fileno(), length=0, access=ACCESS_READ)
+        self._ref: PatchRef = (str(path), stats.st_ino, stats.st_mtime_ns)
+        # Offset of the payloads, if an indexed patch file
+        self._base: int | None = None
+        try:
+            self._spans = self._read_header()
+        except (ValueError, IndexError):
+            self._buf.close()
+            raise
+
+    def _read_header(self) -> dict[str, tuple[int, int]]:
+        if self._buf[: len(PATCH_MAGIC)] != PATCH_MAGIC:
+            return _cbor_spans(self._buf, 0)
+
+        size: int = int.from_bytes(
+            self._buf[len(PATCH_MAGIC) : PATCH_HEADER_START], "big"
+        )
+        self._base = PATCH_HEADER_START + size
+        if self._base > len(self._buf):
+            err: str = (
+                f"Truncated patch header, expected {self._base} bytes, "
+                f"received {len(self._buf)}"
+            )
+            raise ValueError(err)
+
+        return _cbor_spans(self._buf, PATCH_HEADER_START)
+
+    def __enter__(self) -> "PatchFile":  # noqa: D105
+        return self
+
+    def __exit__(self, *args: object) -> None:  # noqa: D105
+        self.close()
+
+    def close(self) -> None:
+        """Unmap the patch file."""
+        self._buf.close()
+
+    @property
+    def is_indexed(self) -> bool:
+        """Return whether the patch file is an indexed patch file."""
+        return self._base is not None
+
+    @property
+    def public_key(self) -> tuple[str, str]:
+        """Return the public key of the patch file."""
+        start, end = self._spans["public_key"]
+        return loads(self._buf[start:end])
+
+    @property
+    def signature(self) -> tuple[bytes, bytes]:
+        """Return the digital signature of the patch file's contents."""
+        start, end = self._spans["signature"]
+        return loads(self._buf[start:end])
+
+    @property
+    def raw_contents(self) -> bytes:
+        """Return the contents of the patch file as encoded."""
+        start, end = self._spans["contents"]
+        return self._buf[start:end]
+
+    @property
+    def canonical_contents(self) -> bytes:
+        """Return the contents of the patch file in canonical encoding.
+
+        Expensive, requiring the contents to be decoded in memory. Intended to be used
+        when the patch file's contents were not encoded canonically.
+        """
+        return dumps(loads(self.raw_contents), canonical=True)
+
+    @property
+    def contents(self) -> list[Content]:
+        """Return the contents of the patch file, decoding each patch section lazily."""
+        contents: list[Content] = []
+        start, _ = self._spans["contents"]
+
+        for pos, _ in _cbor_items(self._buf, start, CBOR_ARRAY):
+            spans: dict[str, tuple[int, int]] = _cbor_spans(self._buf, pos)
+            contents.append(
+                {
+                    "manifest": PatchSection(
+                        self._buf, spans["manifest"][0], self._ref
+                    ),
+                    "add": PatchSection(
+                        self._buf, spans["add"][0], self._ref, self._base
+                    ),
+                    "update": PatchSection(
+                        self._buf, spans["update"][0], self._ref, self._base
+                    ),
+                    "delete": PatchSection(self._buf, spans["delete"][0], self._ref),
+                    "source": loads(self._buf[slice(*spans["source"])]),
+                    "target": loads(self._buf[slice(*spans["target"])]),
+                }
+            )
+
+        return contents
+
+    def verify_payloads(self) -> bool:
+        """Verify the digest of each payload against the header.
+
+        Always true for a CBOR patch file.
+        """
+        with memoryview(self._buf) as buf:
+            for offset, length, digest in self.payloads():
+                with buf[offset : offset + length] as payload:
+                    if sha256(payload).digest() != digest:
+                        log.error("Digest mismatched for payload at offset %s", offset)
+                        return False
+        return True
+
+    def payloads(self) -> list[tuple[int, int, bytes]]:
+        """Return the offset, length and digest of each payload, ordered by offset.
+
+        Empty for a CBOR patch file, whose data is within its contents.
+        """
+        return sorted(
+            payload
+            for content in self.contents
+            for section in (content["add"], content["update"])
+            if isinstance(section, PatchSection)
+            for payload in section.payloads()
+        )
+
+
+@lru_cache(maxsize=4)
+def _map_patch(ref: PatchRef) -> mmap:
+    path, *_ = ref
+    with Path(path).open("rb") as file:
+        return mmap(file.fileno(), length=0, access=ACCESS_READ)
+
+
+def _apply_entry(task: PatchTask, root: Path, item: Any) -> tuple[DigestKey, int]:  # noqa: ANN401
+    if task == PatchTask.Check:
+        return CustomPatcher._check_binaries(root, item)
+    if task == PatchTask.Write:
+        return CustomPatcher._write_proton_file(root.joinpath(item["name"]), item)
+    return CustomPatcher._patch_proton_file(root.joinpath(item["name"]), item)
+
+
+def _apply_patch_entry(
+    task: PatchTask, root: Path, ref: PatchRef, start: int, end: int
+) -> tuple[DigestKey, int]:
+    """Decode an entry from a patch file by its span, then apply it.
+
+    Intended to be called within a process pool, where only the arguments are
+    pickled. Each worker maps the patch file once and decodes its entries on demand.
+    """
+    return _apply_entry(task, root, loads(_map_patch(ref)[start:end]))
+
+
+def _digest_key(stats: os.stat_result) -> DigestKey:
+    return (
+        stats.st_dev,
+        stats.st_ino,
+        stats.st_size,
+        stats.st_mtime_ns,
+        stats.st_ctime_ns,
+    )
+
+
+class DigestCache:
+    """Persistent cache of the xxh3 digest of files, keyed by their metadata.
+
+    A digest is only returned while the file's device, inode, size, modification
+    and change time are unchanged since the digest was recorded. Intended to skip
+    reading the files of a compatibility tool that were not changed since they
+    were last verified or written by the patcher.
+    """
+
+    def __init__(self, path: Path) -> None:  # noqa: D107
+        self._path = path
+        self._lock = Lock()
+        self._changed = False
+        # Digests by device and inode, in the order they were recorded
+        self._digests: dict[str, list[int]] = {}
+        try:
+            with self._path.open(encoding="utf-8") as file:
+                digests: dict[str, list[int]] = json.load(file)
+            if not isinstance(digests, dict):
+                err: str = f"Expected an object, received {type(digests)}"
+                raise ValueError(err)
+            self._digests = digests
+        except (OSError, ValueError) as e:
+            log.debug("Unable to read digest cache '%s': %s", self._path, e)
+
+    def __enter__(self) -> "DigestCache":  # noqa: D105
+        return self
+
+    def __exit__(self, *_: object) -> None:  # noqa: D105
+        self.save()
+
+    def get(self, key: DigestKey) -> int | None:
+        """Return the digest of a file, if its metadata matches the key."""
+        dev, ino, *stats = key
+        with self._lock:
+            digest: list[int] | None = self._digests.get(f"{dev}:{ino}")
+        if digest is None or digest[:-1] != stats:
+            return None
+        return digest[-1]
+
+    def set(self, key: DigestKey, xxhash: int) -> None:
+        """Record the digest of a file by its metadata."""
+        dev, ino, *stats = key
+        with self._lock:
+            self._digests.pop(f"{dev}:{ino}", None)
+            self._digests[f"{dev}:{ino}"] = [*stats, xxhash]
+            while len(self._digests) > DIGEST_CACHE_MAX:
+                del self._digests[next(iter(self._digests))]
+            self._changed = True
+
+    def record(self, future: Future) -> None:
+        """Record the digest of a file from a completed task that checked or wrote it."""
+        if future.cancelled() or future.exception():
+            return
+        self.set(*future.result())
+
+    def link(self, src: str, dest: str) -> str:
+        """Link a file, keeping its digest.
+
+        Linking changes the file's change time. Intended to be used as the copy
+        function of shutil.copytree.
+        """
+        xxhash: int | None = self.get(_digest_key(Path(src).stat()))
+        link_file(src, dest)
+        if xxhash is not None:
+            self.set(_digest_key(Path(dest).stat()), xxhash)
+        return dest
+
+    @contextmanager
+    def keep(self, root: Path) -> Generator[None, Any, None]:
+        """Keep the digests of the files within root while removing links to them.
+
+        Removing a link to a file changes its change time, like linking it. On exit,
+        the digest of each file is recorded again if it was cached on entry and its
+        device, inode, size and modification time are unchanged.
+        """
+        digests: dict[Path, tuple[DigestKey, int]] = {}
+
+        for path, _, names in os.walk(root):
+            for name in names:
+                file: Path = Path(path, name)
+                with suppress(OSError):
+                    key: DigestKey = _digest_key(file.lstat())
+                    xxhash: int | None = self.get(key)
+                    if xxhash is not None:
+                        digests[file] = (key, xxhash)
+
+        yield
+
+        for file, (key, xxhash) in digests.items():
+            with suppress(OSError):
+                new: DigestKey = _digest_key(file.lstat())
+                if new[:-1] == key[:-1]:
+                    self.set(new, xxhash)
+
+    def save(self) -> None:
+        """Write the cache to disk, if any digest was recorded."""
+        if not self._changed:
+            return
+        tmp: Path | None = None
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            # Concurrent sessions each write their own file, then the last one wins
+            fd, name = mkstemp(prefix=f".{self._path.name}.", dir=self._path.parent)
+            tmp = Path(name)
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(self._digests, file)
+            tmp.replace(self._path)
+            self._changed = False
+        except OSError as e:
+            log.exception(e)
+            if tmp:
+                tmp.unlink(missing_ok=True)
+
+
+class ByteBudget:
+    """Semaphore admitting tasks by the number of bytes they hold in memory.
+
+    A task needing more than the budget is admitted once no other task holds any
+    bytes, so it runs alone.
+    """
+
+    def __init__(self, limit: int) -> None:  # noqa: D107
+        self._limit = limit
+        self._used = 0
+        self._peak = 0
+        self._cond = Condition()
+
+    @property
+    def peak(self) -> int:
+        """Return the max number of bytes held at once."""
+        return self._peak
+
+    def acquire(self, size: int, *, blocking: bool = True) -> bool:
+        """Hold a number of bytes, returning whether they were admitted."""
+        size = min(size, self._limit)
+        with self._cond:
+            if blocking:
+                self._cond.wait_for(lambda: self._used + size <= self._limit)
+            elif self._used + size > self._limit:
+                return False
+            self._used += size
+            self._peak = max(self._peak, self._used)
+        return True
+
+    def release(self, size: int) -> None:
+        """Release a number of bytes held by a task."""
+        with self._cond:
+            self._used -= min(size, self._limit)
+            self._cond.notify_all()
+
+
+def delta_memory_budget() -> ByteBudget | None:
+    """Return the budget of memory for decompressing files, if not disabled by the user."""
+    value: str = os.environ.get("UMU_DELTA_MEMORY", str(DELTA_MEMORY_MAX))
+    size: int = DELTA_MEMORY_MAX
+
+    try:
+        size = int(value)
+        if size < 0:
+            raise ValueError(value)
+    except ValueError:
+        log.warning("UMU_DELTA_MEMORY is invalid: %s", value)
+        size = DELTA_MEMORY_MAX
+
+    if size == 0:  # Disables the budget
+        return None
+
+    return ByteBudget(size * 1024 * 1024)
+
+
+def _peak_rss() -> int:
+    # Max resident set size of umu and its process pool workers, in KiB
+    return getrusage(RUSAGE_SELF).ru_maxrss + getrusage(RUSAGE_CHILDREN).ru_maxrss
+
+
+def _apply_entries(entries: list[tuple[Any, Callable[[Any], None]]]) -> None:
+    for item, fn in entries:
+        fn(item)
+
+
+def _run_task(fn: Callable[..., Any], *args: Any) -> tuple[int, Any]:  # noqa: ANN401
+    start: int = perf_counter_ns()
+    result: Any = fn(*args)
+    return perf_counter_ns() - start, result
+
+
+@dataclass(eq=False)
+class Task:
+    """Represent a task within a task graph."""
+
+    name: str
+    fn: Callable[..., Any]
+    args: tuple[Any, ...]
+    # Estimated cost of the task (e.g., the size of the file it writes)
+    cost: int
+    executor: Executor
+    # Number of bytes the task holds in memory
+    memory: int = 0
+    # Called with the result of the task, once completed
+    callback: Callable[[Any], None] | None = None
+    # Tasks that depend on this task
+    dependents: list["Task"] = field(default_factory=list)
+    # Number of dependencies that have not completed
+    waiting: int = 0
+    # Time to run the task, in nanoseconds
+    elapsed: int = 0
+    # File the task reads, by whose location on disk an ordered graph runs it
+    path: Path | None = None
+
+
+class TaskGraph:
+    """Run tasks once their dependencies have completed, most costly first.
+
+    Running the most costly tasks first avoids leaving a large file to be written
+    last by a single worker, while the others idle. The number of tasks in flight
+    is bounded, so that costly tasks that become ready later are not queued behind
+    tasks that were submitted earlier.
+
+    When an I/O order is passed, tasks reading a file are instead run by the
+    location of the file on disk once ready, so that rotational storage is read
+    in a single sweep rather than seeking between files.
+
+    When a byte budget is passed, a task is only submitted once the bytes it holds
+    in memory are admitted. After the first failed task, no other task is submitted.
+    """
+
+    def __init__(  # noqa: D107
+        self,
+        thread_pool: ThreadPoolExecutor,
+        pending_max: int = TASK_PENDING_MAX,
+        budget: ByteBudget | None = None,
+        order: IOOrder = IOOrder.Off,
+    ) -> None:
+        self._thread_pool = thread_pool
+        self._pending_max = pending_max
+        self._budget = budget
+        self._order = order
+        self._tasks: list[Task] = []
+
+    @property
+    def order(self) -> IOOrder:
+        """Return the order in which tasks reading files are run."""
+        return self._order
+
+    def add(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        *args: Any,  # noqa: ANN401
+        cost: int = 0,
+        deps: Iterable[Task] = (),
+        executor: Executor | None = None,
+        callback: Callable[[Any], None] | None = None,
+        memory: int = 0,
+        path: Path | None = None,
+    ) -> Task:
+        """Add a task that runs after its dependencies, in the thread pool by default.
+
+        When submitted to a process pool, fn and args must be picklable. When the
+        task reads a file, pass its path to order the task by its location on disk.
+        """
+        task: Task = Task(
+            name, fn, args, cost, executor or self._thread_pool, memory, callback
+        )
+        task.path = path
+        for dep in deps:
+            dep.dependents.append(task)
+            task.waiting += 1
+        self._tasks.append(task)
+        return task
+
+    def run(self) -> bool:
+        """Run the tasks, returning whether all of them completed."""
+        order: Iterator[int] = count()
+        ready: list[tuple[int, int, Task]] = [
+            (self._key(task), next(order), task)
+            for task in self._tasks
+            if not task.waiting
+        ]
+        running: dict[Future, Task] = {}
+        failed: bool = False
+        start: int = perf_counter_ns()
+
+        heapify(ready)
+        try:
+            while running or (ready and not failed):
+                while ready and not failed and len(running) < self._pending_max:
+                    # Wait for running tasks to release memory before admitting the
+                    # next task, so that it is not passed over by smaller tasks
+                    if self._budget and not self._budget.acquire(
+                        ready[0][2].memory, blocking=False
+                    ):
+                        break
+                    _, _, task = heappop(ready)
+                    future: Future = task.executor.submit(
+                        _run_task, task.fn, *task.args
+                    )
+                    running[future] = task
+                done, _ = futures_wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    if self._budget:
+                        self._budget.release(task.memory)
+                    if future.cancelled():
+                        continue
+                    try:
+                        task.elapsed, result = future.result()
+                    except Exception as e:
+                        # Any error of a task (e.g., from zstd or a broken process
+                        # pool) fails the graph, so the caller can fall back
+                        log.exception(e)
+                        failed = True
+                        for pending in running:
+                            pending.cancel()
+                        continue
+                    if task.callback:
+                        task.callback(result)
+                    for dependent in task.dependents:
+                        dependent.waiting -= 1
+                        if not dependent.waiting:
+                            heappush(
+                                ready, (self._key(dependent), next(order), dependent)
+                            )
+        finally:
+            futures_wait(running, return_when=ALL_COMPLETED)
+
+        self._report(perf_counter_ns() - start)
+
+        return not failed and all(not task.waiting for task in self._tasks)
+
+    def _key(self, task: Task) -> int:
+        # Key of a ready task within the heap. Files are located once their task is
+        # ready, as a task may read a file created by its dependencies
+        if self._order == IOOrder.Off or not task.path:
+            return -task.cost
+        return get_layout_key(task.path, self._order)
+
+    @property
+    def timings(self) -> list[tuple[str, int]]:
+        """Return the name and time to run each task, in nanoseconds."""
+        return [(task.name, task.elapsed) for task in self._tasks]
+
+    def _report(self, elapsed: int) -> None:
+        # Summarize the time spent in each kind of task, and the slowest tasks
+        kinds: dict[str, list[int]] = {}
+        for task in self._tasks:
+            kinds.setdefault(task.name.split(":", 1)[0], []).append(task.elapsed)
+        log.debug("Ran %s tasks in %s ns", len(self._tasks), elapsed)
+        for kind, timings in kinds.items():
+            log.debug("%s: %s tasks in %s ns", kind, len(timings), sum(timings))
+        for task in sorted(self._tasks, key=lambda task: -task.elapsed)[
+            :TASK_REPORT_MAX
+        ]:
+            log.debug("%s: %s ns", task.name, task.elapsed)
+        if self._budget:
+            log.debug("Peak memory admitted: %s bytes", self._budget.peak)
+        log.debug("Peak RSS: %s KiB", _peak_rss())
+
 
 class CustomPatcher:
     """Class for updating the contents within a compatibility tool directory.
@@ -105,6 +893,12 @@ class CustomPatcher:
     and where 'a' is already present on the system, will update all the contents within
     'a' to recreate 'b'. The patch file format will drive behavior and will contain all
     the necessary data and metadata to create 'b'.
+
+    When a process pool is passed and the contents are from a patch file, files are
+    checked, written and patched within the process pool instead. When a digest
+    cache is passed, files are only read when their digest is not in the cache and
+    the digests of the files checked and written are recorded. When a byte budget
+    is passed, files are only written once their size is admitted by the budget.
     """
 
     def __init__(  # noqa: D107
@@ -112,17 +906,27 @@ class CustomPatcher:
         content: Content,
         compat_tool: Path,
         thread_pool: ThreadPoolExecutor,
+        process_pool: ProcessPoolExecutor | None = None,
+        cache: DigestCache | None = None,
+        budget: ByteBudget | None = None,
     ) -> None:
         self._arc_contents: Content = content
-        self._arc_manifest: list[ManifestEntry] = self._arc_contents["manifest"]
+        self._arc_manifest: Iterable[ManifestEntry] = self._arc_contents["manifest"]
         self._compat_tool = compat_tool
         self._thread_pool = thread_pool
+        self._process_pool = process_pool
+        self._cache = cache
+        self._budget = budget
         # Collection where each task creates a new file within an existing compatibility tool
         self._add: list[Future] = []
         # Collection where each task updates an existing file
         self._update: list[Future] = []
         # Collection where each task verifies an existing file
         self._verify: list[Future] = []
+        # Collection where each task deletes an obsolete directory
+        self._delete: list[Future] = []
+        # Tasks holding patch data that may have not completed
+        self._pending: set[Future] = set()
 
     def add_binaries(self) -> None:
         """Add binaries within a compatibility tool.
@@ -134,25 +938,12 @@ class CustomPatcher:
         and directories will be created.
         """
         # Create new files, if there are any items
-        for item in self._arc_contents["add"]:
-            build_file: Path = self._compat_tool.joinpath(item["name"])
+        for item, span in self._entries(self._arc_contents["add"]):
             if item["type"] == FileType.File.value:
                 # Decompress the zstd data and write the file
-                self._add.append(
-                    self._thread_pool.submit(self._write_proton_file, build_file, item)
-                )
-                continue
-            if item["type"] == FileType.Link.value:
-                build_file.symlink_to(item["data"])
+                self._add.append(self._submit(PatchTask.Write, item, span))
                 continue
-            if item["type"] == FileType.Dir.value:
-                build_file.mkdir(mode=item["mode"], exist_ok=True, parents=True)
-                continue
-            log.warning(
-                "Found file '%s' with type '%s', skipping its inclusion",
-                item["name"],
-                item["type"],
-            )
+            self._add_entry(item)
 
     def update_binaries(self) -> None:
         """Update binaries within a compatibility tool.
@@ -163,28 +954,12 @@ class CustomPatcher:
         Will apply a binary patch for files that need to be updated. Directories will
         have its permissions changed. Links will be deleted.
         """
-        for item in self._arc_contents["update"]:
-            build_file: Path = self._compat_tool.joinpath(item["name"])
+        for item, span in self._entries(self._arc_contents["update"]):
             if item["type"] == FileType.File.value:
                 # For files, apply a binary patch
-                self._update.append(
-                    self._thread_pool.submit(self._patch_proton_file, build_file, item)
-                )
-                continue
-            if item["type"] == FileType.Dir.value:
-                # For directories, change permissions
-                build_file.chmod(item["mode"], follow_symlinks=False)
-                continue
-            if item["type"] == FileType.Link.value:
-                # For links, replace the links
-                build_file.unlink()
-                build_file.symlink_to(item["data"])
+                self._update.append(self._submit(PatchTask.Patch, item, span))
                 continue
-            log.warning(
-                "Found file '%s' with type '%s', skipping its update",
-                item["name"],
-                item["type"],
-            )
+            self._update_entry(item)
 
     def delete_binaries(self) -> None:
         """Delete obsolete binaries within a compatibility tool.
@@ -196,35 +971,278 @@ class CustomPatcher:
         everything else.
         """
         for item in self._arc_contents["delete"]:
-            if (
-                item["type"] == FileType.File.value
-                or item["type"] == FileType.Link.value
-            ):
-                self._compat_tool.joinpath(item["name"]).unlink(missing_ok=True)
-                continue
             if item["type"] == FileType.Dir.value:
-                self._thread_pool.submit(
-                    rmtree, str(self._compat_tool.joinpath(item["name"]))
-                )
+                self._delete.append(self._thread_pool.submit(self._delete_entry, item))
                 continue
-            log.warning(
-                "Found file '%s' with type '%s', skipping its update",
-                item["name"],
-                item["type"],
-            )
+            self._delete_entry(item)
+
+    def schedule_integrity(
+        self, graph: "TaskGraph", deps: Iterable["Task"] = ()
+    ) -> list["Task"]:
+        """Schedule verifying the compatibility tool within a task graph.
+
+        Returns the scheduled tasks. Files whose digests are cached are skipped.
+        """
+        return [
+            self._schedule(graph, PatchTask.Check, item, span, deps)
+            for item, span in self._stubs(self._arc_manifest)
+            if not self._is_cached(item)
+        ]
+
+    def schedule_binaries(
+        self, graph: "TaskGraph", deps: Iterable["Task"] = ()
+    ) -> list["Task"]:
+        """Schedule updating, adding and deleting binaries within a task graph.
+
+        Links and directories are updated and added by a single task, which the
+        tasks writing files and deleting binaries depend on. Returns the scheduled
+        tasks.
+        """
+        entries: list[tuple[Any, Callable[[Any], None]]] = []
+        files: list[tuple[PatchTask, Any, tuple[PatchRef, int, int] | None]] = []
+
+        for item, span in self._stubs(self._arc_contents["update"]):
+            if item["type"] == FileType.File.value:
+                files.append((PatchTask.Patch, item, span))
+                continue
+            entries.append((item, self._update_entry))
+
+        for item, span in self._stubs(self._arc_contents["add"]):
+            if item["type"] == FileType.File.value:
+                files.append((PatchTask.Write, item, span))
+                continue
+            entries.append((item, self._add_entry))
 
-    def verify_integrity(self) -> None:
-        """Verify the expected mode, size, file and digest of the compatibility tool."""
-        for item in self._arc_manifest:
-            self._verify.append(
-                self._thread_pool.submit(self._check_binaries, self._compat_tool, item)
+        prepare: Task = graph.add(
+            f"prepare: {self._compat_tool}", _apply_entries, entries, deps=deps
+        )
+        tasks: list[Task] = [prepare]
+        tasks.extend(
+            self._schedule(graph, task, item, span, (prepare,))
+            for task, item, span in files
+        )
+        tasks.extend(
+            graph.add(
+                f"delete: {item['name']}", self._delete_entry, item, deps=(prepare,)
             )
+            for item in self._arc_contents["delete"]
+        )
+
+        return tasks
+
+    def verify_integrity(self, order: IOOrder = IOOrder.Off) -> None:
+        """Verify the expected mode, size, file and digest of the compatibility tool.
+
+        When an I/O order is passed, files are submitted by their location on disk.
+        """
+        entries: Iterable[tuple[Any, tuple[PatchRef, int, int] | None]] = self._entries(
+            self._arc_manifest
+        )
+        key: Callable[[str], int] | None = self._get_layout_key(order)
+        if key:
+            entries = sorted(entries, key=lambda entry: key(entry[0]["name"]))
+        for item, span in entries:
+            if self._is_cached(item):
+                future: Future = Future()
+                future.set_result(None)
+                self._verify.append(future)
+                continue
+            self._verify.append(self._submit(PatchTask.Check, item, span))
 
-    def result(self) -> tuple[list[Future], list[Future], list[Future]]:
+    def result(
+        self,
+    ) -> tuple[list[Future], list[Future], list[Future], list[Future]]:
         """Return all the currently submitted tasks."""
-        return (self._verify, self._add, self._update)
+        return (self._verify, self._add, self._update, self._delete)
+
+    def _entries(
+        self, section: Iterable[Any]
+    ) -> Generator[tuple[Any, tuple[PatchRef, int, int] | None], Any, None]:
+        # Leave decoding the data of files to the process pool
+        if self._process_pool and isinstance(section, PatchSection):
+            for item, start, end in section.stubs():
+                yield item, (section.ref, start, end)
+            return
+        for item in section:
+            yield item, None
+
+    def _add_entry(self, item: Entry) -> None:
+        build_file: Path = self._compat_tool.joinpath(item["name"])
+        if item["type"] == FileType.Link.value:
+            build_file.symlink_to(item["data"])
+            return
+        if item["type"] == FileType.Dir.value:
+            build_file.mkdir(mode=item["mode"], exist_ok=True, parents=True)
+            return
+        log.warning(
+            "Found file '%s' with type '%s', skipping its inclusion",
+            item["name"],
+            item["type"],
+        )
+
+    def _update_entry(self, item: Entry) -> None:
+        build_file: Path = self._compat_tool.joinpath(item["name"])
+        if item["type"] == FileType.Dir.value:
+            # For directories, change permissions
+            build_file.chmod(item["mode"], follow_symlinks=False)
+            return
+        if item["type"] == FileType.Link.value:
+            # For links, replace the links
+            build_file.unlink()
+            build_file.symlink_to(item["data"])
+            return
+        log.warning(
+            "Found file '%s' with type '%s', skipping its update",
+            item["name"],
+            item["type"],
+        )
+
+    def _delete_entry(self, item: Entry) -> None:
+        build_file: Path = self._compat_tool.joinpath(item["name"])
+        if item["type"] in {FileType.File.value, FileType.Link.value}:
+            build_file.unlink(missing_ok=True)
+            return
+        if item["type"] == FileType.Dir.value:
+            rmtree(str(build_file))
+            return
+        log.warning(
+            "Found file '%s' with type '%s', skipping its update",
+            item["name"],
+            item["type"],
+        )
+
+    def _stubs(
+        self, section: Iterable[Any]
+    ) -> Generator[tuple[Any, tuple[PatchRef, int, int] | None], Any, None]:
+        # Defer decoding the data of files to the task applying them
+        if isinstance(section, PatchSection):
+            for item, start, end in section.stubs():
+                yield item, (section.ref, start, end)
+            return
+        for item in section:
+            yield item, None
+
+    def _get_layout_key(self, order: IOOrder) -> Callable[[str], int] | None:
+        # Key of each file by its name, to read files by their location on disk
+        if order == IOOrder.Off:
+            return None
+        return lambda name: get_layout_key(self._compat_tool.joinpath(name), order)
+
+    def _schedule(
+        self,
+        graph: "TaskGraph",
+        task: PatchTask,
+        item: Any,  # noqa: ANN401
+        span: tuple[PatchRef, int, int] | None,
+        deps: Iterable["Task"],
+    ) -> "Task":
+        name: str = f"{task.value}: {item['name']}"
+        # Decompressing a file holds up to its size in memory, within the window of
+        # the decompressor
+        memory: int = 0 if task == PatchTask.Check else item["size"]
+        callback: Callable[[Any], None] | None = (
+            (lambda result: self._cache.set(*result)) if self._cache else None
+        )
+        # New files are written from the patch file alone
+        path: Path | None = (
+            None
+            if task == PatchTask.Write
+            else self._compat_tool.joinpath(item["name"])
+        )
+        if span:
+            return graph.add(
+                name,
+                _apply_patch_entry,
+                task,
+                self._compat_tool,
+                *span,
+                cost=item["size"],
+                deps=deps,
+                executor=self._process_pool,
+                callback=callback,
+                memory=memory,
+                path=path,
+            )
+        return graph.add(
+            name,
+            _apply_entry,
+            task,
+            self._compat_tool,
+            item,
+            cost=item["size"],
+            deps=deps,
+            callback=callback,
+            memory=memory,
+            path=path,
+        )
+
+    def _is_cached(self, item: ManifestEntry) -> bool:
+        # Whether the file is unchanged since its expected digest was recorded
+        if not self._cache:
+            return False
+        try:
+            stats: os.stat_result = self._compat_tool.joinpath(item["name"]).stat()
+        except OSError:
+            return False
+        return (
+            item["size"] == stats.st_size
+            and item["mode"] == stats.st_mode
+            and self._cache.get(_digest_key(stats)) == item["xxhash"]
+        )
 
-    def _check_binaries(self, proton: Path, item: ManifestEntry) -> ManifestEntry:
+    def _submit(
+        self,
+        task: PatchTask,
+        item: Any,  # noqa: ANN401
+        span: tuple[PatchRef, int, int] | None,
+    ) -> Future:
+        future: Future
+
+        release: Callable[[Future], None] | None = self._admit(task, item)
+
+        if self._process_pool and span:
+            future = self._process_pool.submit(
+                _apply_patch_entry, task, self._compat_tool, *span
+            )
+        elif task == PatchTask.Check:
+            future = self._thread_pool.submit(
+                _apply_entry, task, self._compat_tool, item
+            )
+        else:
+            future = self._submit_pending(task, item)
+
+        if release:
+            future.add_done_callback(release)
+
+        if self._cache:
+            future.add_done_callback(self._cache.record)
+
+        return future
+
+    def _admit(self, task: PatchTask, item: Any) -> Callable[[Future], None] | None:  # noqa: ANN401
+        # Hold the size of the file while it is decompressed, returning the callback
+        # that releases it
+        budget: ByteBudget | None = self._budget
+        size: int = item["size"]
+        if task == PatchTask.Check or not budget:
+            return None
+        budget.acquire(size)
+        return lambda _: budget.release(size)
+
+    def _submit_pending(self, task: PatchTask, item: Any) -> Future:  # noqa: ANN401
+        # Wait for a task to complete before submitting another, bounding the patch
+        # data held in memory when entries are decoded faster than they are applied
+        if len(self._pending) >= PATCH_PENDING_MAX:
+            _, pending = futures_wait(self._pending, return_when=FIRST_COMPLETED)
+            self._pending = set(pending)
+        future: Future = self._thread_pool.submit(
+            _apply_entry, task, self._compat_tool, item
+        )
+        self._pending.add(future)
+        return future
+
+    @staticmethod
+    def _check_binaries(proton: Path, item: ManifestEntry) -> tuple[DigestKey, int]:
         rpath: Path = proton.joinpath(item["name"])
 
         try:
@@ -252,113 +1270,535 @@ class CustomPatcher:
             log.debug("Aborting partial update, file not found: %s", rpath)
             raise
 
-        return item
+        return _digest_key(stats), xxhash
 
-    def _patch_proton_file(self, path: Path, item: Entry) -> None:
+    @staticmethod
+    def _patch_proton_file(path: Path, item: Entry) -> tuple[DigestKey, int]:
         bdiff: bytes = item["data"]
         digest: int = item["xxhash"]
         mode: int = item["mode"]
         size: int = item["size"]
+        xxhash: int
 
         if (item["type"] == FileType.File.value) and path.is_symlink():
-            build_file: Path = self._compat_tool.joinpath(item["name"])
             path.unlink(missing_ok=True)
-            self._write_proton_file(build_file, item)
-            return
-
-        try:
-            # Since some wine binaries are missing the writable bit and
-            # we're memory mapping files. Before applying a binary patch,
-            # ensure the file is writable
-            os.chmod(path, 0o700, follow_symlinks=False)  # noqa: PTH101
-
-            # With our patch file, apply the delta in place
-            with path.open("rb+") as fp:
-                stats: os.stat_result = os.stat(fp.fileno())  # noqa: PTH116
-                xxhash: int = 0
+            return CustomPatcher._write_proton_file(path, item)
 
-                # If less than the window log, write the data
-                # The patcher inserts the raw, decompressed data in this case
-                if max(stats.st_size, size).bit_length() < ZSTD_WINDOW_LOG_MIN:
-                    fp.write(bdiff)
-                    fp.truncate(size)
-                    os.lseek(fp.fileno(), 0, os.SEEK_SET)
+        # Apply the delta to a new file, leaving the file untouched. Within a staged
+        # build, the file may be linked to the file of the installed build
+        with path.open("rb") as fp, _replace_file(path, mode) as file:
+            stats: os.stat_result = os.stat(fp.fileno())  # noqa: PTH116
 
-                    xxhash = xxh3_64_intdigest(fp.read())
-                    if xxhash != digest:
-                        err: str = (
-                            f"Expected xxhash {digest}, received {xxhash} for file "
-                            f"'{path}' truncating from size {stats.st_size} -> {size}"
-                        )
-                        raise ValueError(err)
-
-                    os.fchmod(fp.fileno(), mode)
-                    return
-
-                # Apply our patch to the file in-place
-                with mmap(fp.fileno(), length=0, access=ACCESS_WRITE) as mm:
+            # If less than the window log, write the data
+            # The patcher inserts the raw, decompressed data in this case
+            if max(stats.st_size, size).bit_length() < ZSTD_WINDOW_LOG_MIN:
+                file.write(bdiff[:size])
+                xxhash = xxh3_64_intdigest(bdiff[:size])
+            else:
+                with mmap(fp.fileno(), length=0, access=ACCESS_READ) as mm:
                     # Prepare the zst dictionary and opt
                     zst_dict = ZstdDict(mm, is_raw=True)
                     zst_opt = {DParameter.windowLogMax: ZSTD_WINDOW_LOG_MAX}
+                    xxhash = _decompress_file(file, bdiff, zst_dict.as_prefix, zst_opt)
+                    mm.madvise(MADV_DONTNEED, 0, stats.st_size)
 
-                    # If file will become large, increase
-                    if stats.st_size < size:
-                        mm.resize(size)
+            if xxhash != digest:
+                err: str = (
+                    f"Expected xxhash {digest}, received {xxhash} for file "
+                    f"'{path}' truncating from size {stats.st_size} -> {size}"
+                )
+                raise ValueError(err)
 
-                    # Patch the region
-                    mm[:size] = decompress(
-                        bdiff, zstd_dict=zst_dict.as_prefix, option=zst_opt
-                    )
+        return _digest_key(os.stat(path)), xxhash  # noqa: PTH116
 
-                    # If file will become small, decrease
-                    if size < stats.st_size:
-                        mm.resize(size)
+    @staticmethod
+    def _write_proton_file(path: Path, item: Entry) -> tuple[DigestKey, int]:
+        data: bytes = item["data"]
+        digest: int = item["xxhash"]
+        mode: int = item["mode"]
+
+        with _replace_file(path, mode) as file:
+            xxhash: int = _decompress_file(file, data)
+
+            if xxhash != digest:
+                err: str = (
+                    f"Expected xxhash {digest}, received {xxhash} for fd "
+                    f"{file.fileno()} from source {path}"
+                )
+                raise ValueError(err)
+
+        return _digest_key(os.stat(path)), xxhash  # noqa: PTH116
+
+
+@contextmanager
+def _replace_file(path: Path, mode: int) -> Generator[BufferedWriter, Any, None]:
+    # Yield a new file, then rename it over the path when no error was raised. The
+    # inode at the path, if any, is never modified
+    fd, tmp = mkstemp(prefix=f".{path.name}.", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            yield file
+            os.fchmod(file.fileno(), mode)
+        os.replace(tmp, path)  # noqa: PTH105
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _decompress_file(
+    file: BufferedWriter,
+    data: bytes,
+    zstd_dict: Any = None,  # noqa: ANN401
+    option: dict[Any, int] | None = None,
+) -> int:
+    # Decompress the data to the file in windows while hashing it, returning its
+    # xxhash. Unlike decompress(), never holds the decompressed file in memory
+    decompressor = EndlessZstdDecompressor(zstd_dict, option)
+    hasher = xxh3_64()
+    chunk: bytes = decompressor.decompress(data, DECOMPRESS_WINDOW)
+
+    while True:
+        file.write(chunk)
+        hasher.update(chunk)
+        if decompressor.needs_input:
+            break
+        chunk = decompressor.decompress(b"", DECOMPRESS_WINDOW)
+
+    if not decompressor.at_frame_edge:
+        err: str = f"Compressed data ended before the end of file '{file.name}'"
+        raise ValueError(err)
+
+    return hasher.intdigest()
+
+
+def is_valid_patch(cbor: PatchFile) -> bool:
+    """Authenticate the public key and the signature of the contents of a patch."""
+    # Ignore. umu_delta is relevant for sys packages when using *-Latest tokens
+    from .umu_delta import valid_key, valid_signature  # noqa: PLC0415
+
+    # Validate the integrity of the embedded public key. Use RustCrypto's SHA2
+    # implementation to keep the security boundary consistent
+    public_key, _ = cbor.public_key
+    if not valid_key(public_key):
+        # OWC maintainer forgot to add digest to whitelist, a different public key
+        # was accidentally used or patch was created by a 3rd party
+        log.error("Digest mismatched for public key '%s', skipping", cbor.public_key)
+        return False
+
+    # With the public key, verify the signature and data. The contents are signed
+    # in canonical encoding, which is expected to be how they were encoded
+    signature, _ = cbor.signature
+    is_valid: bool = valid_signature(public_key, cbor.raw_contents, signature)
+    if not is_valid:
+        log.debug("Verifying the contents in canonical encoding")
+        is_valid = valid_signature(public_key, cbor.canonical_contents, signature)
+    if not is_valid:
+        log.error("Digital signature verification failed, skipping")
+        return False
+
+    return True
+
+
+def find_patch_asset(assets: Iterable[dict[str, Any]], prefix: str) -> str:
+    """Return the download URL of the patch file within the assets of a release.
+
+    Indexed patch files are preferred to CBOR patch files. Returns an empty string
+    if no asset with the prefix is a patch file.
+    """
+    names: dict[str, str] = {
+        asset["name"]: asset["browser_download_url"]
+        for asset in assets
+        if asset["name"].startswith(prefix)
+    }
+
+    for suffix in (PATCH_INDEXED_SUFFIX, "cbor"):
+        for name, durl in names.items():
+            if name.endswith(suffix):
+                return durl
+
+    return ""
+
+
+def download_patch(
+    http_pool: PoolManager,
+    durl: str,
+    headers: dict[str, str],
+    patch: Path,
+    *,
+    thread_pool: ThreadPoolExecutor | None = None,
+    select: Callable[[PatchFile], bool] | None = None,
+) -> Path | None:
+    """Spool a patch to disk, so its entries can be decoded one at a time.
+
+    Of an indexed patch file, the header is fetched first. select is then called
+    with the patch file to decide whether its payloads are fetched, which are
+    fetched by range within the thread pool and verified against the digests of
+    the header. A patch file whose payloads are not fetched can only be inspected.
+    """
+    resp: BaseHTTPResponse = http_pool.request(
+        HTTPMethod.GET.value,
+        durl,
+        headers={**headers, "Range": f"bytes=0-{PATCH_HEAD_SIZE - 1}"},
+        preload_content=False,
+    )
+
+    # The server ignored the range, or the patch is smaller than the range
+    if resp.status == HTTPStatus.OK:
+        hashsum = write_file_chunks(patch, resp, sha512())
+        resp.release_conn()
+        log.debug("Patch '%s' (SHA512): %s", patch, hashsum.hexdigest())
+        return patch if _verify_payloads(patch) else None
+
+    if resp.status != HTTPStatus.PARTIAL_CONTENT:
+        resp.release_conn()
+        return None
+
+    head: bytes = resp.read()
+    size: int = int(resp.headers.get("Content-Range", "").rpartition("/")[2] or 0)
+    resp.release_conn()
+    patch.write_bytes(head)
+
+    if len(head) >= size:
+        return patch if _verify_payloads(patch) else None
+
+    if not head.startswith(PATCH_MAGIC):
+        # A CBOR patch file, which is fetched in full
+        return (
+            patch if _fetch_range(http_pool, durl, headers, patch, len(head)) else None
+        )
+
+    # Fetch the rest of the header, then reserve the payloads as a hole
+    end: int = PATCH_HEADER_START + int.from_bytes(
+        head[len(PATCH_MAGIC) : PATCH_HEADER_START], "big"
+    )
+    if end > len(head) and not _fetch_range(
+        http_pool, durl, headers, patch, len(head), end
+    ):
+        return None
+    os.truncate(patch, max(size, end))
+
+    with PatchFile(patch) as cbor:
+        if select and not select(cbor):
+            log.debug("Skipping the payloads of patch '%s'", patch)
+            return patch
+        payloads: list[tuple[int, int, bytes]] = cbor.payloads()
+
+    ranges: list[list[tuple[int, int, bytes]]] = _get_ranges(payloads)
+    log.debug("Fetching %s payloads of patch '%s'", len(payloads), patch)
+    if thread_pool:
+        futures: list[Future[bool]] = [
+            thread_pool.submit(_fetch_payloads, http_pool, durl, headers, patch, batch)
+            for batch in ranges
+        ]
+        # Wait for every range, so no payload is written once returned
+        futures_wait(futures)
+        is_fetched: bool = all(future.result() for future in futures)
+    else:
+        is_fetched = all(
+            _fetch_payloads(http_pool, durl, headers, patch, batch) for batch in ranges
+        )
+
+    return patch if is_fetched else None
+
+
+def _get_ranges(
+    payloads: list[tuple[int, int, bytes]],
+) -> list[list[tuple[int, int, bytes]]]:
+    # Group the payloads, ordered by offset, into the payloads of each range request
+    ranges: list[list[tuple[int, int, bytes]]] = []
+
+    for payload in payloads:
+        offset, length, _ = payload
+        if ranges:
+            first, *_ = ranges[-1][0]
+            last, size, _ = ranges[-1][-1]
+            if (
+                offset - (last + size) <= PATCH_RANGE_GAP
+                and offset + length - first <= PATCH_RANGE_MAX
+            ):
+                ranges[-1].append(payload)
+                continue
+        ranges.append([payload])
+
+    return ranges
+
+
+def _fetch_range(
+    http_pool: PoolManager,
+    durl: str,
+    headers: dict[str, str],
+    patch: Path,
+    start: int,
+    end: int | None = None,
+) -> bool:
+    # Append the bytes of the patch file from start, up to end if passed
+    resp: BaseHTTPResponse = http_pool.request(
+        HTTPMethod.GET.value,
+        durl,
+        headers={**headers, "Range": f"bytes={start}-{'' if end is None else end - 1}"},
+        preload_content=False,
+    )
+    if resp.status != HTTPStatus.PARTIAL_CONTENT:
+        resp.release_conn()
+        return False
+
+    write_file_chunks(patch, resp, sha512())
+    resp.release_conn()
+
+    return end is None or patch.stat().st_size == end
+
+
+def _fetch_payloads(
+    http_pool: PoolManager,
+    durl: str,
+    headers: dict[str, str],
+    patch: Path,
+    payloads: list[tuple[int, int, bytes]],
+) -> bool:
+    # Fetch the payloads within a single range, writing each to its offset once
+    # its digest is verified
+    start, *_ = payloads[0]
+    last, size, _ = payloads[-1]
+    resp: BaseHTTPResponse = http_pool.request(
+        HTTPMethod.GET.value,
+        durl,
+        headers={**headers, "Range": f"bytes={start}-{last + size - 1}"},
+    )
+    if resp.status != HTTPStatus.PARTIAL_CONTENT:
+        log.error("Failed to fetch range %s-%s of '%s'", start, last + size, durl)
+        return False
+
+    with memoryview(resp.data) as data, patch.open("r+b") as file:
+        for offset, length, digest in payloads:
+            payload: memoryview = data[offset - start : offset - start + length]
+            if sha256(payload).digest() != digest:
+                log.error("Digest mismatched for payload at offset %s", offset)
+                return False
+            os.pwrite(file.fileno(), payload, offset)
+
+    return True
+
+
+def _verify_payloads(patch: Path) -> bool:
+    # Verify the payloads of an indexed patch file fetched in full
+    with patch.open("rb") as file:
+        if file.read(len(PATCH_MAGIC)) != PATCH_MAGIC:
+            return True
+
+    with PatchFile(patch) as cbor:
+        return cbor.verify_payloads()
+
+
+@contextmanager
+def delta_process_pool() -> Generator[ProcessPoolExecutor | None, Any, None]:
+    """Yield the process pool to apply patches within, if enabled by the user."""
+    # Applying many small files contends on the GIL in the thread pool. Opt-in, as
+    # starting the workers only pays off for large updates
+    if os.environ.get("UMU_DELTA_BACKEND") != "process":
+        yield None
+        return
+
+    log.debug("Applying delta updates within a process pool")
+    with ProcessPoolExecutor(mp_context=get_context("forkserver")) as process_pool:
+        yield process_pool
+
+
+def fold_manifest(manifest: dict[str, ManifestEntry], content: Content) -> None:
+    """Update the manifest of a build to describe the build once a content is applied."""
+    for item in get_entries(content["delete"]):
+        manifest.pop(item["name"], None)
+        if item["type"] == FileType.Dir.value:
+            prefix: str = f"{item['name']}/"
+            for name in [name for name in manifest if name.startswith(prefix)]:
+                del manifest[name]
 
-                    # Ignore. Passing an mmap is valid
-                    xxhash = xxh3_64_intdigest(mm)  # type: ignore
+    for item in chain(get_entries(content["update"]), get_entries(content["add"])):
+        if item["type"] != FileType.File.value:
+            manifest.pop(item["name"], None)
+            continue
+        manifest[item["name"]] = {
+            "name": item["name"],
+            "mode": S_IFREG | S_IMODE(item["mode"]),
+            "xxhash": item["xxhash"],
+            "size": item["size"],
+            "time": item["time"],
+        }
 
-                    if xxhash != digest:
-                        err: str = (
-                            f"Expected xxhash {digest}, received {xxhash} for "
-                            f"file '{path}' truncating from size {stats.st_size} -> {size}"
-                        )
-                        raise ValueError(err)
 
-                    mm.madvise(MADV_DONTNEED, 0, size)
+def get_entries(section: Iterable[Any]) -> Iterable[Any]:
+    """Return the entries of a section without the data of its files, if possible.
 
-                # Update the file's metadata
-                os.fchmod(fp.fileno(), mode)
-        except BaseException as e:
+    Avoids decoding the data of files when only their metadata is needed.
+    """
+    if isinstance(section, PatchSection):
+        return (item for item, *_ in section.stubs())
+    return section
+
+
+def wait_patcher(patcher: CustomPatcher) -> bool:
+    """Wait for the tasks of a patcher, returning whether all of them succeeded."""
+    futures: list[Future] = list(chain.from_iterable(patcher.result()))
+
+    # Stop at the first failed task. On success, every task is done
+    _, not_done = futures_wait(futures, return_when=FIRST_EXCEPTION)
+    for future in not_done:
+        future.cancel()
+    futures_wait(not_done, return_when=ALL_COMPLETED)
+
+    for future in futures:
+        if future.cancelled():
+            continue
+        try:
+            future.result()
+        except (OSError, ValueError) as e:
             log.exception(e)
-            log.warning("File '%s' may be corrupt and has mode bits 0o700", path)
-            raise
+            return False
+
+    return True
 
-    def _write_proton_file(self, path: Path, item: Entry) -> None:
-        data: bytes = item["data"]
-        digest: int = item["xxhash"]
-        mode: int = item["mode"]
-        size: int = item["size"]
 
-        with memfdfile(path.name) as fp:
-            xxhash: int = 0
+def apply_delta_chain(
+    path: Path,
+    patches: list[PatchFile],
+    get_root: Callable[[Path, Content], Path | None],
+    thread_pool: ThreadPoolExecutor,
+    process_pool: ProcessPoolExecutor | None = None,
+    *,
+    verify: Callable[[Path], bool] | None = None,
+    cache: DigestCache | None = None,
+    budget: ByteBudget | None = None,
+    target: Path | None = None,
+) -> bool:
+    """Apply consecutive patches to a compatibility tool, oldest first.
 
-            fp.truncate(size)
+    The patches are applied to a copy of the tool, which is only exchanged with
+    the tool after being verified. get_root returns the directory, within a copy
+    of the tool, that a content of a patch applies to. When passed, verify is
+    called with the patched copy as the final check before the exchange and cache
+    is used to skip reading the files whose digests are known, and budget bounds
+    the memory held by the files being written. When target is passed, the patched
+    copy is moved to target instead, leaving the tool untouched. Removing a build
+    that shares files with target changes their change time, so callers removing
+    one are expected to keep the digests of target with DigestCache.keep.
+    """
+    staging: Path = path.parent.joinpath(f".{path.name}.staging")
+    # Expected files of each patched directory, by its name after the update
+    manifests: dict[str, dict[str, ManifestEntry]] = {}
+    # Directories of the tool that the first patch applies to
+    roots: list[Path] = []
+    # Files are read by their location on disk on rotational storage
+    order: IOOrder = get_io_order(path)
+    graph: TaskGraph = TaskGraph(thread_pool, budget=budget, order=order)
+    checks: list[Task] = []
 
-            # Decompress our data and write to our file
-            with mmap(fp.fileno(), length=0, access=ACCESS_WRITE) as mm:
-                mm[:] = decompress(data)
-                # Ignore. Passing an mmap is valid
-                xxhash = xxh3_64_intdigest(mm)  # type: ignore
+    # Verify the identity of the build. At this point the patch files are
+    # authenticated. Note, this will skip the update if the user had tinkered with
+    # their build. We do this so we can ensure the result of each binary patch
+    # isn't garbage
+    for content in patches[0].contents:
+        root: Path | None = get_root(path, content)
+        if not root:
+            log.error("Could not find subdirectory '%s', skipping", content["source"])
+            return False
+        patcher: CustomPatcher = CustomPatcher(
+            content, root, thread_pool, process_pool, cache
+        )
+        checks.extend(patcher.schedule_integrity(graph))
+        manifests[content["source"]] = {
+            item["name"]: item for item in get_entries(content["manifest"])
+        }
+        roots.append(staging.joinpath(root.relative_to(path)))
 
-                if xxhash != digest:
-                    err: str = (
-                        f"Expected xxhash {digest}, received {xxhash} for fd "
-                        f"{fp.fileno()} from source {path}"
+    # Patch a tree of links to the files of the build. Patched files are written as
+    # new files, so the build is left intact and usable while it is being updated
+    if staging.exists():
+        rmtree(staging)
+    deps: list[Task] = [
+        graph.add(
+            f"link: {path}",
+            partial(
+                copytree,
+                symlinks=True,
+                copy_function=cache.link if cache else link_file,
+            ),
+            path,
+            staging,
+            deps=checks,
+        )
+    ]
+
+    try:
+        for cbor in patches:
+            tasks: list[Task] = []
+            renames: list[tuple[Path, Path]] = []
+            for content in cbor.contents:
+                # The roots of the first patch are resolved before the tool is linked
+                root = roots.pop(0) if roots else get_root(staging, content)
+                if not root:
+                    log.error(
+                        "Could not find subdirectory '%s', skipping", content["source"]
                     )
-                    raise ValueError(err)
+                    return False
+                log.info("Updating %s to %s...", content["source"], content["target"])
+                patcher = CustomPatcher(content, root, thread_pool, process_pool, cache)
+                tasks.extend(patcher.schedule_binaries(graph, deps))
+                manifest: dict[str, ManifestEntry] = manifests.pop(
+                    content["source"], {}
+                )
+                fold_manifest(manifest, content)
+                manifests[content["target"]] = manifest
+                if root != staging:
+                    renames.append((root, root.parent / content["target"]))
+
+            # Rename versioned subdirectories once every file is written or deleted
+            for orig, new in renames:
+                graph.add(f"rename: {orig}", orig.rename, new, deps=tasks)
+            if not graph.run():
+                return False
+            graph = TaskGraph(thread_pool, budget=budget, order=order)
+            deps = []
+
+        # With the files expected after applying every patch, verify the result
+        for name, manifest in manifests.items():
+            content = {
+                "manifest": list(manifest.values()),
+                "add": [],
+                "update": [],
+                "delete": [],
+                "source": name,
+                "target": name,
+            }
+            root = get_root(staging, content)
+            if not root:
+                log.error("Could not find subdirectory '%s', skipping", name)
+                return False
+            patcher = CustomPatcher(content, root, thread_pool, cache=cache)
+            patcher.schedule_integrity(graph)
+
+        if not graph.run():
+            log.error("Patched build failed verification, skipping")
+            return False
+
+        if verify and not verify(staging):
+            log.error("Patched build failed verification, skipping")
+            return False
 
-                with path.open("wb") as file:
-                    os.sendfile(file.fileno(), fp.fileno(), 0, size)
-                    os.fchmod(file.fileno(), mode)
+        if target:
+            log.debug("Moving: %s -> %s", staging, target)
+            staging.rename(target)
+        else:
+            log.debug("Exchanging: %s <-> %s", staging, path)
+            exchange(staging, path)
+            # The previous build shares the unchanged files of the tool
+            with cache.keep(path) if cache else nullcontext():
+                log.debug("Removing: %s", staging)
+                rmtree(staging, ignore_errors=True)
+    finally:
+        if staging.exists():
+            log.debug("Removing: %s", staging)
+            rmtree(staging, ignore_errors=True)
+        # Entries applied within this process mapped the patch files. Unmap them,
+        # as they keep the deleted files allocated until umu-run exits
+        _map_patch.cache_clear()
 
-                mm.madvise(MADV_DONTNEED, 0, size)
+    return True
@@ -37,7 +37,11 @@ class GamescopeAtom(Enum):
 
 
 class FileLock(Enum):
-    """Files placed with an exclusive lock via flock(2)."""
+    """Files placed with a lock via flock(2).
+
+    Runtime and Compat are suffixes of the lock of each runtime and compatibility
+    tool, see get_lock_path.
+    """
 
     Runtime = "umu.lock"  # UMU_RUNTIME lock
     Compat = "compatibilitytools.d.lock"  # PROTONPATH lock
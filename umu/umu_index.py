@@ -0,0 +1,178 @@
+import json
+import os
+from pathlib import Path
+from re import split as resplit
+from tempfile import mkstemp
+from threading import Lock
+from time import time_ns
+from typing import Any, TypedDict
+
+from umu import vdf
+from umu.umu_log import log
+
+# Index of the compatibility tools within UMU_LOCAL
+COMPAT_INDEX = "compatibilitytools.json"
+
+# Directories modified this recently are rescanned when next read, as entries
+# created within the same tick of the file system's clock would not change its mtime
+INDEX_RACY_NS = 2 * 1_000_000_000
+
+
+class ToolEntry(TypedDict):
+    """Represent an installed compatibility tool within the index."""
+
+    name: str
+    # Natural sort key of the name (e.g., GE-Proton9-10 after GE-Proton9-9)
+    version: list[Any]
+    # compatmanager_layer_name of its toolmanifest.vdf, or None without one
+    layer: str | None
+    # require_tool_appid of its toolmanifest.vdf
+    appid: str | None
+    mtime: int
+
+
+def version_key(name: str) -> list[Any]:
+    """Return the natural sort key of the name of a compatibility tool."""
+    return [
+        int(text) if text.isdigit() else text.lower()
+        for text in resplit(r"(\d+)", name)
+    ]
+
+
+def _read_tool(path: Path) -> ToolEntry:
+    # Entry of a compatibility tool by its directory and toolmanifest.vdf
+    entry: ToolEntry = {
+        "name": path.name,
+        "version": version_key(path.name),
+        "layer": None,
+        "appid": None,
+        "mtime": path.stat().st_mtime_ns,
+    }
+
+    try:
+        with path.joinpath("toolmanifest.vdf").open(encoding="utf-8") as file:
+            manifest: dict[str, Any] = vdf.load(file)["manifest"]
+        entry["layer"] = str(manifest.get("compatmanager_layer_name") or "")
+        appid: Any = manifest.get("require_tool_appid")
+        entry["appid"] = str(appid) if appid else None
+    except (OSError, UnicodeDecodeError, SyntaxError, KeyError, TypeError) as e:
+        log.debug("Unable to read manifest of '%s': %s", path, e)
+
+    return entry
+
+
+class CompatIndex:
+    """Persistent index of the compatibility tools within compat directories.
+
+    Each directory is revalidated by a single stat, and is only scanned again when
+    its mtime changed (e.g., a tool was installed, replaced or removed). As a result,
+    finding the latest tool or the runtime a tool requires does not read the tools.
+    """
+
+    def __init__(self, path: Path, dirs: tuple[Path, ...]) -> None:  # noqa: D107
+        self._path = path
+        self._dirs: dict[str, Path] = {
+            str(compat.absolute()): compat for compat in dirs
+        }
+        self._lock = Lock()
+        self._changed = False
+        # Tools of each directory by name, and the mtime of the directory
+        self._index: dict[str, dict[str, Any]] = {}
+        try:
+            with self._path.open(encoding="utf-8") as file:
+                index: dict[str, dict[str, Any]] = json.load(file)
+            if not isinstance(index, dict):
+                err: str = f"Expected an object, received {type(index)}"
+                raise ValueError(err)
+            self._index = {key: index[key] for key in self._dirs if key in index}
+        except (OSError, ValueError) as e:
+            log.debug("Unable to read index '%s': %s", self._path, e)
+
+    def __enter__(self) -> "CompatIndex":  # noqa: D105
+        return self
+
+    def __exit__(self, *_: object) -> None:  # noqa: D105
+        self.save()
+
+    def tools(self, compat: Path) -> dict[str, ToolEntry]:
+        """Return the tools within a compat directory by name.
+
+        Returns an empty dict when the directory is not indexed or does not exist.
+        """
+        key: str = str(compat.absolute())
+
+        if key not in self._dirs:
+            return {}
+
+        try:
+            mtime: int = compat.stat().st_mtime_ns
+        except OSError:
+            return {}
+
+        with self._lock:
+            cached: dict[str, Any] | None = self._index.get(key)
+            if cached and cached.get("mtime") == mtime:
+                return cached["tools"]
+
+        log.debug("Indexing compatibility tools in '%s'", compat)
+        tools: dict[str, ToolEntry] = {}
+        for path in compat.iterdir():
+            # Hidden directories hold the versions of UMU-Latest and GE-Latest
+            if path.name.startswith(".") or not path.is_dir():
+                continue
+            try:
+                tools[path.name] = _read_tool(path)
+            except OSError:
+                continue
+
+        with self._lock:
+            self._index[key] = {"mtime": self._get_mtime(mtime), "tools": tools}
+            self._changed = True
+
+        return tools
+
+    def get(self, path: Path) -> ToolEntry | None:
+        """Return the entry of a tool by its path, if within an indexed directory."""
+        return self.tools(path.parent).get(path.name)
+
+    def latest(self, compat: Path, prefix: str) -> ToolEntry | None:
+        """Return the latest tool within a compat directory whose name has a prefix."""
+        return max(
+            (
+                tool
+                for name, tool in self.tools(compat).items()
+                if name.startswith(prefix)
+            ),
+            key=lambda tool: tool["version"],
+            default=None,
+        )
+
+    def update(self, compat: Path) -> None:
+        """Index a compat directory again, once a tool was installed or removed."""
+        with self._lock:
+            self._index.pop(str(compat.absolute()), None)
+        self.tools(compat)
+
+    def save(self) -> None:
+        """Write the index to disk, if it changed."""
+        if not self._changed:
+            return
+        tmp: Path | None = None
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            # Concurrent sessions each write their own file, then the last one wins
+            fd, name = mkstemp(prefix=f".{self._path.name}.", dir=self._path.parent)
+            tmp = Path(name)
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(self._index, file)
+            tmp.replace(self._path)
+            self._changed = False
+        except OSError as e:
+            log.exception(e)
+            if tmp:
+                tmp.unlink(missing_ok=True)
+
+    @staticmethod
+    def _get_mtime(mtime: int) -> int | None:
+        # The mtime to record for a directory. Too recent mtimes are not trusted
+        return None if time_ns() - mtime < INDEX_RACY_NS else mtime
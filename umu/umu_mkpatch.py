@@ -0,0 +1,384 @@
+import os
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import suppress
+from hashlib import sha256
+from pathlib import Path
+from shutil import which
+from stat import S_ISDIR, S_ISLNK, S_ISREG
+from subprocess import PIPE, run  # nosec B404
+from typing import Any
+
+from umu.umu_bspatch import (
+    PATCH_MAGIC,
+    ZSTD_WINDOW_LOG_MAX,
+    ZSTD_WINDOW_LOG_MIN,
+    Content,
+    ContentContainer,
+    Entry,
+    FileType,
+    ManifestEntry,
+)
+from umu.umu_log import log
+from umu.umu_util import IOOrder, get_io_order, get_layout_key
+
+with suppress(ModuleNotFoundError):
+    from cbor2 import dumps
+    from pyzstd import CParameter, ZstdDict, compress
+    from xxhash import xxh3_64_intdigest
+
+# Namespace of the digital signatures of patch files
+# See https://cvsweb.openbsd.org/src/usr.bin/ssh/PROTOCOL.sshsig?annotate=HEAD
+SIGNATURE_NAMESPACE = "umu.openwinecomponents.org"
+
+# Default compression level of the data of files
+ZSTD_LEVEL = 9
+
+# Formats of patch files, by their version
+# 1: CBOR patch file, decoded in full
+# 2: Indexed patch file, whose payloads can be fetched by range
+PATCH_FORMATS = (1, 2)
+
+
+def _scan_tree(root: Path) -> dict[str, os.stat_result]:
+    # Stats of each file, link and directory of root by its name, parents first
+    stats: dict[str, os.stat_result] = {}
+    for path, dirs, names in os.walk(root):
+        for name in dirs + names:
+            file: Path = Path(path, name)
+            stats[str(file.relative_to(root))] = file.lstat()
+    return dict(sorted(stats.items()))
+
+
+def _get_type(stats: os.stat_result) -> FileType | None:
+    if S_ISREG(stats.st_mode):
+        return FileType.File
+    if S_ISDIR(stats.st_mode):
+        return FileType.Dir
+    if S_ISLNK(stats.st_mode):
+        return FileType.Link
+    return None
+
+
+def _make_manifest_entry(root: Path, name: str, stats: os.stat_result) -> ManifestEntry:
+    return {
+        "name": name,
+        "mode": stats.st_mode,
+        "xxhash": xxh3_64_intdigest(root.joinpath(name).read_bytes()),
+        "size": stats.st_size,
+        "time": stats.st_mtime,
+    }
+
+
+def _make_entry(
+    root: Path,
+    name: str,
+    stats: os.stat_result,
+    source: Path | None = None,
+    level: int = ZSTD_LEVEL,
+) -> Entry:
+    # Entry adding or updating a file of root. When a source is passed, files are
+    # stored as a delta against it
+    file: Path = root.joinpath(name)
+    filetype: FileType | None = _get_type(stats)
+    entry: dict[str, Any] = {
+        "name": name,
+        "data": b"",
+        "mode": stats.st_mode,
+        "type": filetype.value if filetype else "",
+        "xxhash": 0,
+        "time": stats.st_mtime,
+        "size": 0,
+    }
+
+    if filetype == FileType.Link:
+        entry["data"] = str(file.readlink())
+    elif filetype == FileType.File:
+        data: bytes = file.read_bytes()
+        entry["data"] = _compress_file(data, source, level)
+        entry["xxhash"] = xxh3_64_intdigest(data)
+        entry["size"] = len(data)
+
+    return entry  # type: ignore
+
+
+def _compress_file(data: bytes, source: Path | None, level: int) -> bytes:
+    if source is None or source.is_symlink():
+        return compress(data, level)
+
+    prefix: bytes = source.read_bytes()
+
+    # If less than the window log, store the data
+    # The patcher expects the raw, decompressed data in this case
+    if max(len(prefix), len(data)).bit_length() < ZSTD_WINDOW_LOG_MIN:
+        return data
+
+    # The window must include the source to reference it, like zstd --patch-from
+    window_log: int = min(
+        max(len(prefix) + len(data), 1).bit_length(), ZSTD_WINDOW_LOG_MAX
+    )
+    option: dict[CParameter, int] = {
+        CParameter.compressionLevel: level,
+        CParameter.windowLog: max(window_log, ZSTD_WINDOW_LOG_MIN),
+        CParameter.enableLongDistanceMatching: 1,
+    }
+    return compress(data, option, zstd_dict=ZstdDict(prefix, is_raw=True).as_prefix)
+
+
+def _is_changed(source: Path, target: Path, old: os.stat_result) -> bool:
+    new: os.stat_result = target.lstat()
+    if old.st_mode != new.st_mode:
+        return True
+    if S_ISLNK(new.st_mode):
+        return source.readlink() != target.readlink()
+    if S_ISREG(new.st_mode):
+        return old.st_size != new.st_size or source.read_bytes() != target.read_bytes()
+    return False
+
+
+def diff_trees(
+    source: Path,
+    target: Path,
+    thread_pool: ThreadPoolExecutor,
+    level: int = ZSTD_LEVEL,
+) -> Content:
+    """Return the content of a patch updating the source tree to the target tree.
+
+    Files are hashed and compressed in parallel within the thread pool. Changed
+    files are stored as zstd deltas using the source file as a prefix dictionary,
+    and new files are stored compressed. Source files are hashed by their location
+    on disk on rotational storage, see get_io_order.
+    """
+    old: dict[str, os.stat_result] = _scan_tree(source)
+    new: dict[str, os.stat_result] = _scan_tree(target)
+    manifest: dict[str, Future] = {}
+    add: list[Future] = []
+    update: list[Future] = []
+    delete: list[Entry] = []
+    order: IOOrder = get_io_order(source)
+    files: list[str] = [name for name, stats in old.items() if S_ISREG(stats.st_mode)]
+
+    if order != IOOrder.Off:
+        files.sort(key=lambda name: get_layout_key(source.joinpath(name), order))
+
+    for name in files:
+        manifest[name] = thread_pool.submit(
+            _make_manifest_entry, source, name, old[name]
+        )
+
+    for name, stats in old.items():
+        if name in new:
+            continue
+        # Deleting a directory deletes its contents
+        if any(name.startswith(f"{item['name']}/") for item in delete):
+            continue
+        delete.append(_make_entry(source, name, stats))
+
+    for name, stats in new.items():
+        filetype: FileType | None = _get_type(stats)
+        if not filetype:
+            log.warning("Found file '%s' with unsupported type, skipping", name)
+            continue
+
+        if name not in old:
+            add.append(
+                thread_pool.submit(_make_entry, target, name, stats, None, level)
+            )
+            continue
+
+        if not _is_changed(source.joinpath(name), target.joinpath(name), old[name]):
+            continue
+
+        # The patcher can replace files and links with each other, but directories
+        # can only change their permissions
+        if FileType.Dir in {filetype, _get_type(old[name])} and (
+            filetype != _get_type(old[name])
+        ):
+            err: str = f"Cannot change the type of directory '{name}'"
+            raise ValueError(err)
+
+        update.append(
+            thread_pool.submit(
+                _make_entry, target, name, stats, source.joinpath(name), level
+            )
+        )
+
+    return {
+        "manifest": [manifest[name].result() for name in old if name in manifest],
+        "add": [future.result() for future in add],
+        "update": [future.result() for future in update],
+        "delete": delete,
+        "source": source.name,
+        "target": target.name,
+    }
+
+
+def sign_contents(contents: bytes, key: Path) -> tuple[bytes, bytes]:
+    """Sign the encoded contents of a patch file with an OpenSSH private key."""
+    ssh_keygen: str | None = which("ssh-keygen")
+
+    if not ssh_keygen:
+        err: str = "ssh-keygen was not found in system"
+        raise FileNotFoundError(err)
+
+    # See https://man.openbsd.org/ssh-keygen#Y~4
+    signature: bytes = run(  # nosec B603
+        (ssh_keygen, "-Y", "sign", "-n", SIGNATURE_NAMESPACE, "-f", str(key)),
+        input=contents,
+        stdout=PIPE,
+        check=True,
+    ).stdout
+
+    # Signatures are made over the SHA-512 digest of the contents
+    return signature, b"sha512"
+
+
+def index_contents(contents: list[Content]) -> tuple[list[Content], list[bytes]]:
+    """Return the index of the contents of an indexed patch file and its payloads.
+
+    Each file entry is encoded as a payload, and replaced within the index by the
+    offset, length and SHA-256 digest of its payload. Offsets are relative to the
+    first payload.
+    """
+    index: list[Content] = []
+    payloads: list[bytes] = []
+    offset: int = 0
+
+    for content in contents:
+        sections: dict[str, list[Any]] = {"add": [], "update": []}
+        for name, entries in sections.items():
+            for entry in content[name]:  # type: ignore
+                if entry["type"] != FileType.File.value:
+                    entries.append(entry)
+                    continue
+                payload: bytes = dumps(entry, canonical=True)
+                stub: dict[str, Any] = {
+                    key: value for key, value in entry.items() if key != "data"
+                }
+                stub["offset"] = offset
+                stub["length"] = len(payload)
+                stub["digest"] = sha256(payload).digest()
+                entries.append(stub)
+                payloads.append(payload)
+                offset += len(payload)
+        index.append({**content, **sections})  # type: ignore
+
+    return index, payloads
+
+
+def pack_patch(container: ContentContainer, payloads: list[bytes]) -> bytes:
+    """Return an indexed patch file from its header and payloads."""
+    header: bytes = dumps(container, canonical=True)
+    return b"".join((PATCH_MAGIC, len(header).to_bytes(8, "big"), header, *payloads))
+
+
+def make_patch(
+    sources: list[tuple[Path, Path]],
+    key: Path,
+    thread_pool: ThreadPoolExecutor,
+    level: int = ZSTD_LEVEL,
+    version: int = 1,
+) -> bytes:
+    """Return a signed patch file updating each source tree to its target tree.
+
+    The contents are encoded canonically, which is how they are signed. Of an
+    indexed patch file, the index is signed, which includes the digest of each
+    payload.
+    """
+    contents: list[Content] = [
+        diff_trees(source, target, thread_pool, level) for source, target in sources
+    ]
+    payloads: list[bytes] = []
+    public_key: str = key.with_name(f"{key.name}.pub").read_text().strip()
+    key_type, *_ = public_key.split(maxsplit=1)
+
+    if version == 2:  # noqa: PLR2004
+        contents, payloads = index_contents(contents)
+
+    container: ContentContainer = {
+        "contents": contents,
+        "signature": sign_contents(dumps(contents, canonical=True), key),
+        # Only the key is authenticated by its digest. The key type is informative
+        "public_key": (public_key, key_type.encode()),
+    }
+
+    if version == 2:  # noqa: PLR2004
+        return pack_patch(container, payloads)
+
+    return dumps(container, canonical=True)
+
+
+def parse_args(argv: list[str]) -> Namespace:  # noqa: D103
+    parser: ArgumentParser = ArgumentParser(
+        prog="umu-run mkpatch",
+        description="Create a patch file updating compatibility tools",
+        epilog=(
+            "Each source and target are directories of a compatibility tool\n"
+            "(e.g., UMU-Proton-9.0-3 UMU-Proton-9.0-4)"
+        ),
+    )
+    parser.add_argument(
+        "dirs",
+        nargs="+",
+        metavar="SOURCE TARGET",
+        help="directories of a compatibility tool to diff, as pairs",
+    )
+    parser.add_argument(
+        "-k", "--key", required=True, help="path to an OpenSSH Ed25519 private key"
+    )
+    parser.add_argument(
+        "-o", "--output", required=True, help="path to write the patch file to"
+    )
+    parser.add_argument(
+        "-l",
+        "--level",
+        type=int,
+        default=ZSTD_LEVEL,
+        help=f"zstd compression level (default: {ZSTD_LEVEL})",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=int,
+        choices=PATCH_FORMATS,
+        default=1,
+        help="format of the patch file, 2 to index it (default: 1)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of files to compress at once",
+    )
+    args: Namespace = parser.parse_args(argv)
+
+    if len(args.dirs) % 2:
+        parser.error("expected a target directory for each source directory")
+
+    return args
+
+
+def mkpatch(argv: list[str]) -> int:
+    """Create a signed patch file from the command line arguments."""
+    args: Namespace = parse_args(argv)
+    sources: list[tuple[Path, Path]] = [
+        (Path(source), Path(target))
+        for source, target in zip(args.dirs[::2], args.dirs[1::2], strict=True)
+    ]
+    output: Path = Path(args.output)
+
+    for path in (path for pair in sources for path in pair):
+        if not path.is_dir():
+            log.error("Directory '%s' does not exist", path)
+            return 1
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as thread_pool:
+        patch: bytes = make_patch(
+            sources, Path(args.key), thread_pool, args.level, args.format
+        )
+
+    output.write_bytes(patch)
+    log.info("Created patch file '%s' (%s bytes)", output, len(patch))
+
+    return 0
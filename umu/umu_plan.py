@@ -0,0 +1,211 @@
+import json
+import os
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from tempfile import mkstemp
+from threading import Lock
+from time import perf_counter_ns
+
+from umu.umu_log import log
+
+
+class Resource(Enum):
+    """Represent a resource whose throughput bounds the time of a route."""
+
+    # Bytes received from the network
+    Network = "network"
+    # Bytes of a gzip archive decompressed and extracted
+    Gzip = "gzip"
+    # Bytes of an xz archive decompressed and extracted
+    Xz = "xz"
+    # Bytes of a compatibility tool verified and patched
+    Patch = "patch"
+
+
+# Throughput of each resource in bytes per second, until measured on this machine
+THROUGHPUT_DEFAULT = {
+    Resource.Network: 4 * 1024 * 1024,
+    Resource.Gzip: 64 * 1024 * 1024,
+    Resource.Xz: 24 * 1024 * 1024,
+    Resource.Patch: 256 * 1024 * 1024,
+}
+
+# Weight of a new measurement within the moving average of a throughput
+THROUGHPUT_WEIGHT = 0.3
+
+# Min number of bytes of a measurement. Smaller transfers are dominated by latency
+THROUGHPUT_SAMPLE_MIN = 1024 * 1024
+
+# Expected ratio of the size of an extracted archive to the archive
+ARCHIVE_RATIO = 3
+
+
+class Throughput:
+    """Persistent moving average of the throughput of each resource on this machine.
+
+    Measured while updating compatibility tools, and used to estimate the time of
+    each route of a plan.
+    """
+
+    def __init__(self, path: Path) -> None:  # noqa: D107
+        self._path = path
+        self._lock = Lock()
+        self._changed = False
+        # Bytes per second by the value of each resource
+        self._rates: dict[str, float] = {}
+        try:
+            with self._path.open(encoding="utf-8") as file:
+                rates: dict[str, float] = json.load(file)
+            if not isinstance(rates, dict):
+                err: str = f"Expected an object, received {type(rates)}"
+                raise ValueError(err)
+            self._rates = rates
+        except (OSError, ValueError) as e:
+            log.debug("Unable to read throughput '%s': %s", self._path, e)
+
+    def __enter__(self) -> "Throughput":  # noqa: D105
+        return self
+
+    def __exit__(self, *_: object) -> None:  # noqa: D105
+        self.save()
+
+    def get(self, resource: Resource) -> float:
+        """Return the throughput of a resource in bytes per second."""
+        with self._lock:
+            rate: float | None = self._rates.get(resource.value)
+        if not isinstance(rate, (int, float)) or rate <= 0:
+            return THROUGHPUT_DEFAULT[resource]
+        return rate
+
+    def record(self, resource: Resource, size: int, elapsed: int) -> None:
+        """Record the bytes processed by a resource within a number of nanoseconds."""
+        if size < THROUGHPUT_SAMPLE_MIN or elapsed <= 0:
+            return
+        rate: float = size * 1e9 / elapsed
+        with self._lock:
+            prev: float | None = self._rates.get(resource.value)
+            if isinstance(prev, (int, float)) and prev > 0:
+                rate = prev + THROUGHPUT_WEIGHT * (rate - prev)
+            self._rates[resource.value] = rate
+            self._changed = True
+        log.debug("Throughput of %s: %.1f MiB/s", resource.value, rate / (1 << 20))
+
+    def save(self) -> None:
+        """Write the throughput to disk, if any was recorded."""
+        if not self._changed:
+            return
+        tmp: Path | None = None
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            # Concurrent sessions each write their own file, then the last one wins
+            fd, name = mkstemp(prefix=f".{self._path.name}.", dir=self._path.parent)
+            tmp = Path(name)
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(self._rates, file)
+            tmp.replace(self._path)
+            self._changed = False
+        except OSError as e:
+            log.exception(e)
+            if tmp:
+                tmp.unlink(missing_ok=True)
+
+
+@dataclass
+class Route:
+    """Represent a way to acquire a compatibility tool, and the work it requires."""
+
+    name: str
+    # Acquires the tool, returning whether it succeeded
+    fn: Callable[[], bool]
+    # Bytes processed by each resource
+    work: dict[Resource, int] = field(default_factory=dict)
+    # Bytes of free space required within the file system of path
+    space: int = 0
+    path: Path | None = None
+
+    def estimate(self, throughput: Throughput) -> float:
+        """Return the expected time of the route in seconds."""
+        return sum(
+            size / throughput.get(resource) for resource, size in self.work.items()
+        )
+
+
+def free_space(path: Path) -> int:
+    """Return the bytes available to the user within the file system of path.
+
+    The nearest existing parent is used when path does not exist.
+    """
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    stats: os.statvfs_result = os.statvfs(path)
+    return stats.f_bavail * stats.f_frsize
+
+
+def get_tree_size(path: Path) -> int:
+    """Return the bytes of the files within a directory, without following links."""
+    size: int = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size  # noqa: PTH118
+            except OSError:
+                continue
+    return size
+
+
+def plan_routes(routes: list[Route], throughput: Throughput) -> list[Route]:
+    """Return the routes that fit within the free space, fastest first.
+
+    The reasoning of the plan is logged. The free space is checked by statvfs(3).
+    """
+    plan: list[tuple[float, Route]] = []
+
+    for route in routes:
+        estimate: float = route.estimate(throughput)
+        work: str = ", ".join(
+            f"{resource.value} {size / (1 << 20):.1f} MiB"
+            for resource, size in route.work.items()
+        )
+        if route.path and route.space:
+            available: int = free_space(route.path)
+            if available < route.space:
+                log.warning(
+                    "Route '%s' requires %.1f MiB within '%s', but %.1f MiB is free",
+                    route.name,
+                    route.space / (1 << 20),
+                    route.path,
+                    available / (1 << 20),
+                )
+                continue
+        log.debug("Route '%s': %.1fs expected (%s)", route.name, estimate, work)
+        plan.append((estimate, route))
+
+    plan.sort(key=lambda item: item[0])
+
+    return [route for _, route in plan]
+
+
+def run_routes(routes: list[Route], throughput: Throughput) -> Route | None:
+    """Run the routes of a plan until one succeeds, returning it.
+
+    The expected and actual time of each route are logged.
+    """
+    for route in plan_routes(routes, throughput):
+        estimate: float = route.estimate(throughput)
+        log.info("Acquiring via %s (expected %.1fs)...", route.name, estimate)
+        start: int = perf_counter_ns()
+        is_done: bool = route.fn()
+        elapsed: float = (perf_counter_ns() - start) / 1e9
+        if is_done:
+            log.info(
+                "Acquired via %s in %.1fs (expected %.1fs)",
+                route.name,
+                elapsed,
+                estimate,
+            )
+            return route
+        log.warning("Route '%s' failed after %.1fs", route.name, elapsed)
+
+    return None
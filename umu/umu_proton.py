@@ -4,17 +4,19 @@ import platform
 import shutil
 import time
 import urllib.parse
-from concurrent.futures import ALL_COMPLETED, FIRST_EXCEPTION, ThreadPoolExecutor
-from concurrent.futures import wait as futures_wait
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
 from enum import Enum
+from functools import partial
 from hashlib import sha512
 from http import HTTPStatus
 from importlib.util import find_spec
-from itertools import chain
 from pathlib import Path
-from re import split as resplit
-from shutil import move, rmtree
+from secrets import token_hex
+from shutil import move
 from tempfile import TemporaryDirectory, mkdtemp
+from time import perf_counter_ns
 from typing import Any
 
 from urllib3.exceptions import HTTPError
@@ -22,7 +24,19 @@ from urllib3.poolmanager import PoolManager
 from urllib3.response import BaseHTTPResponse
 
 from umu import vdf
-from umu.umu_bspatch import Content, ContentContainer, CustomPatcher
+from umu.umu_bspatch import (
+    Content,
+    DigestCache,
+    FileType,
+    PatchFile,
+    apply_delta_chain,
+    delta_memory_budget,
+    delta_process_pool,
+    download_patch,
+    find_patch_asset,
+    get_entries,
+    is_valid_patch,
+)
 from umu.umu_consts import (
     STEAM_COMPAT,
     UMU_CACHE,
@@ -31,13 +45,26 @@ from umu.umu_consts import (
     FileLock,
     HTTPMethod,
 )
+from umu.umu_index import COMPAT_INDEX, CompatIndex, ToolEntry
 from umu.umu_log import log
+from umu.umu_plan import (
+    ARCHIVE_RATIO,
+    Resource,
+    Route,
+    Throughput,
+    free_space,
+    get_tree_size,
+    run_routes,
+)
 from umu.umu_runtime import RUNTIME_NAMES, RUNTIME_VERSIONS
 from umu.umu_util import (
     extract_tarfile,
     file_digest,
+    get_lock_path,
     get_tempdir,
+    prune_trees,
     run_zenity,
+    swap_current,
     unix_flock,
     write_file_chunks,
 )
@@ -48,6 +75,16 @@ SessionPools = tuple[ThreadPoolExecutor, PoolManager]
 # First element is a subdir in /tmp which is to download, while second in $XDG_CACHE_HOME
 SessionCaches = tuple[Path, Path]
 
+# Max number of patches to apply to update from an older build. Beyond this, it is
+# expected to be cheaper to download the latest build
+DELTA_CHAIN_MAX = 4
+
+# Digests of the files of the compatibility tools in UMU_COMPAT, kept by the patcher
+DIGEST_CACHE = "compatibilitytools.xxh3.json"
+
+# Throughput measured while acquiring compatibility tools, kept by the planner
+THROUGHPUT_CACHE = "throughput.json"
+
 
 class ProtonVersion(Enum):
     """Represent valid version keywords for Proton."""
@@ -65,6 +102,15 @@ class ProtonVersion(Enum):
     UMUHost = "umu-host"
 
 
+# Codenames whose builds are downloaded from the same archive share the lock of
+# the archive, its resume file and their installs. Other codenames have their own
+# lock, so the set of locks is fixed
+COMPAT_LOCKS = {
+    ProtonVersion.UMULatest.value: ProtonVersion.UMUProton.value,
+    ProtonVersion.GELatest.value: ProtonVersion.GEProton.value,
+}
+
+
 def get_umu_proton(env: dict[str, str], session_pools: SessionPools) -> dict[str, str]:
     """Attempt to use the latest Proton when configured.
 
@@ -81,27 +127,40 @@ def get_umu_proton(env: dict[str, str], session_pools: SessionPools) -> dict[str
     # First element is the digest asset, second is the Proton asset. Each asset
     # will contain the asset's name and the URL that hosts it.
     assets: tuple[tuple[str, str], tuple[str, str]] | tuple[()] = ()
-    patch: bytes = b""
+    # Every archive of the latest release for the host, by name, URL and size
+    archives: list[tuple[str, str, int]] = []
+    patch_asset: dict[str, Any] | None = None
 
     STEAM_COMPAT.mkdir(exist_ok=True, parents=True)
     UMU_CACHE.mkdir(parents=True, exist_ok=True)
 
-    try:
-        log.debug("Sending request to 'api.github.com'...")
-        assets = _fetch_releases(session_pools)
-        # TODO: Refactor this function later. It's basically the same as _fetch_releases
-        patch = _fetch_patch(session_pools)
-    except HTTPError:
-        log.debug("Network is unreachable")
+    with (
+        TemporaryDirectory(dir=UMU_CACHE) as tmpcache,
+        Throughput(UMU_CACHE.joinpath(THROUGHPUT_CACHE)) as throughput,
+    ):
+        try:
+            log.debug("Sending request to 'api.github.com'...")
+            assets = _fetch_releases(session_pools, archives)
+            patch_asset = _find_patch_asset(session_pools)
+        except HTTPError:
+            log.debug("Network is unreachable")
 
-    with TemporaryDirectory(dir=UMU_CACHE) as tmpcache:
         tmpdirs: SessionCaches = (get_tempdir(), Path(tmpcache))
         compatdirs = (UMU_COMPAT, STEAM_COMPAT)
         if _get_umu_runtime_tool(env, os.environ.get("PROTONPATH", "")) is env:
             return env
-        if _get_delta(env, UMU_COMPAT, patch, assets, session_pools) is env:
+        if _get_installed(env, UMU_COMPAT, assets) is env:
             return env
-        if _get_latest(env, compatdirs, tmpdirs, assets, session_pools) is env:
+        # Acquire the latest build by the route expected to be the fastest
+        routes: list[Route] = _get_routes(
+            env,
+            compatdirs,
+            tmpdirs,
+            (assets, archives, patch_asset),
+            session_pools,
+            throughput,
+        )
+        if run_routes(routes, throughput):
             return env
         if _get_from_compat(env, compatdirs) is env:
             return env
@@ -186,7 +245,33 @@ def _get_umu_runtime_tool(env: dict[str, str], name: str) -> dict[str, str] | No
     return env
 
 
-def _fetch_patch(session_pools: SessionPools) -> bytes:
+def _fetch_patch(
+    session_pools: SessionPools, cache: Path, asset: dict[str, Any] | None = None
+) -> Path | None:
+    thread_pool, http_pool = session_pools
+    headers: dict[str, str] = {
+        "Accept": "application/vnd.github+json",
+        "X-GitHub-Api-Version": "2022-11-28",
+        "User-Agent": "",
+    }
+
+    if asset is None:
+        asset = _find_patch_asset(session_pools)
+
+    if not asset:
+        return None
+
+    return download_patch(
+        http_pool,
+        asset["browser_download_url"],
+        headers,
+        cache.joinpath(f"{os.environ['PROTONPATH']}.cbor"),
+        thread_pool=thread_pool,
+    )
+
+
+def _find_patch_asset(session_pools: SessionPools) -> dict[str, Any] | None:
+    # Return the asset of the latest patch file for the codename, if any
     resp: BaseHTTPResponse
     _, http_pool = session_pools
     url: str = "https://api.github.com"
@@ -203,32 +288,73 @@ def _fetch_patch(session_pools: SessionPools) -> bytes:
         ProtonVersion.GELatest.value,
         ProtonVersion.UMULatest.value,
     }:
-        return b""
+        return None
 
     # Skip if the opt dependencies are not installed
     if not find_spec("cbor2") and not find_spec("xxhash"):
-        return b""
+        return None
 
     resp = http_pool.request(HTTPMethod.GET.value, f"{url}{repo}", headers=headers)
     if resp.status != HTTPStatus.OK:
-        return b""
+        return None
 
-    releases = resp.json()["assets"]
-    for release in releases:
-        if not release["name"].endswith("cbor"):
-            continue
-        if release["name"].startswith(os.environ["PROTONPATH"]):
-            durl = release["browser_download_url"]
-            break
+    assets: list[dict[str, Any]] = resp.json()["assets"]
+    durl = find_patch_asset(assets, os.environ["PROTONPATH"])
 
     if not durl:
-        return b""
+        return None
 
-    resp = http_pool.request(HTTPMethod.GET.value, durl, headers=headers)
-    if resp.status != HTTPStatus.OK:
-        return b""
+    return next(asset for asset in assets if asset["browser_download_url"] == durl)
+
+
+def _get_chain_size(
+    session_pools: SessionPools, patch_asset: dict[str, Any], proton: Path
+) -> int:
+    # Return the bytes of the patches expected to update the installed build to the
+    # latest build. These are the patches published since the build was installed,
+    # which are found by walking the releases like _fetch_patch_chain
+    resp: BaseHTTPResponse
+    _, http_pool = session_pools
+    url: str = "https://api.github.com"
+    repo: str = (
+        "/repos/Open-Wine-Components/umu-mkpatch/releases"
+        f"?per_page={DELTA_CHAIN_MAX + 1}"
+    )
+    headers: dict[str, str] = {
+        "Accept": "application/vnd.github+json",
+        "X-GitHub-Api-Version": "2022-11-28",
+        "User-Agent": "",
+    }
+    # The latest patch is applied regardless
+    size: int = patch_asset.get("size", 0)
+    sizes: list[int] = []
 
-    return resp.data  # type: ignore
+    try:
+        # The change time is when the build was installed or patched. Unlike its
+        # modification time, it is not set from the patch
+        installed: float = proton.joinpath("compatibilitytool.vdf").stat().st_ctime
+        resp = http_pool.request(HTTPMethod.GET.value, f"{url}{repo}", headers=headers)
+        if resp.status != HTTPStatus.OK:
+            return size
+        for release in resp.json():
+            durl: str = find_patch_asset(release["assets"], proton.name)
+            if not durl:
+                continue
+            published: datetime = datetime.strptime(
+                release["published_at"], "%Y-%m-%dT%H:%M:%S%z"
+            )
+            if published.timestamp() <= installed:
+                break
+            sizes.extend(
+                asset.get("size", 0)
+                for asset in release["assets"]
+                if asset["browser_download_url"] == durl
+            )
+    except (HTTPError, OSError, ValueError, KeyError, TypeError) as e:
+        log.debug("Unable to find the patches of '%s': %s", proton.name, e)
+        return size
+
+    return max(sum(sizes), size)
 
 
 def _umu_scout_update(
@@ -254,9 +380,14 @@ def _umu_scout_update(
 
 
 def _fetch_releases(
-    session_pools: SessionPools,
+    session_pools: SessionPools, archives: list[tuple[str, str, int]] | None = None
 ) -> tuple[tuple[str, str], tuple[str, str]] | tuple[()]:
-    """Fetch the latest releases from the Github API."""
+    """Fetch the latest releases from the Github API.
+
+    When passed a list of archives, it will be extended with the name, URL and size
+    of every Proton archive of the release for the host (e.g., both a .tar.gz and
+    a .tar.xz archive), so the fastest one can be planned.
+    """
     resp: BaseHTTPResponse
     digest_asset: tuple[str, str]
     proton_asset: tuple[str, str]
@@ -327,6 +458,15 @@ def _fetch_releases(
         log.debug("'%s' returned: %s", url, assets)
         return ()
 
+    if archives is not None:
+        archives.extend(
+            (asset["name"], asset["browser_download_url"], asset.get("size", 0))
+            for asset in assets
+            if not any(marker in asset["name"] for marker in foreign_markers)
+            and asset["name"].endswith(("tar.gz", "tar.xz"))
+            and asset["name"].startswith(("UMU-Proton", "GE-Proton", "umu-scout"))
+        )
+
     return digest_asset, proton_asset
 
 
@@ -466,28 +606,22 @@ def _get_from_compat(
 
     When an error occurs in the process of using the latest Proton build either
     from a digest mismatch, request failure or unreachable network, the latest
-    existing Proton build of that same version will be used
+    existing Proton build of that same version will be used. The builds are
+    found by the index of the compat directories, see CompatIndex.
     """
     version: str = os.environ.get("PROTONPATH", ProtonVersion.UMUProton.value)
 
-    for compat in compats:
-        try:
-            latest: Path = max(
-                filter(
-                    lambda proton: proton.name.startswith(version), compat.glob("*")
-                ),
-                key=lambda proton: [
-                    int(text) if text.isdigit() else text.lower()
-                    for text in resplit(r"(\d+)", proton.name)
-                ],
-            )
+    with CompatIndex(UMU_LOCAL.joinpath(COMPAT_INDEX), compats) as index:
+        for compat in compats:
+            tool: ToolEntry | None = index.latest(compat, version)
+            if not tool:
+                continue
+            latest: Path = compat.joinpath(tool["name"])
             log.info("%s found in '%s'", latest.name, compat)
             log.info("Using %s", latest.name)
             os.environ["PROTONPATH"] = str(latest)
             env["PROTONPATH"] = os.environ["PROTONPATH"]
             return env
-        except ValueError:
-            continue
 
     return None
 
@@ -498,12 +632,16 @@ def _get_latest(
     session_caches: SessionCaches,
     assets: tuple[tuple[str, str], tuple[str, str]] | tuple[()],
     session_pools: SessionPools,
+    *,
+    throughput: Throughput | None = None,
+    replace: bool = False,
 ) -> dict[str, str] | None:
     """Download the latest Proton for new installs.
 
     Either GE-Proton or UMU-Proton will be downloaded if they do not exist.
     Depending on the codename, the installation path for those builds will
-    be different.
+    be different. When replace is set, an outdated UMU-Latest or GE-Latest
+    build is replaced by the latest build.
 
     When the digests mismatched or when the download is interrupted,
     an existing build in either $HOME/.local/share/Steam/compatibilitytool.d
@@ -518,7 +656,7 @@ def _get_latest(
     proton: str
     # Name of the Proton version, which is either UMU-Proton or GE-Proton
     version: str = ProtonVersion.UMUProton.value
-    lock: str = f"{UMU_LOCAL}/{FileLock.Compat.value}"
+    lock: str
     latest_candidates: set[str]
 
     if not assets:
@@ -543,19 +681,36 @@ def _get_latest(
         env["PROTONPATH"] = os.environ["PROTONPATH"]
         return env
 
-    # Use the latest UMU/GE-Proton
+    # Use the latest UMU/GE-Proton. Installs of other tools are not blocked
+    lock = get_lock_path(UMU_LOCAL, FileLock.Compat, COMPAT_LOCKS.get(version, version))
     try:
-        log.debug("Acquiring file lock '%s'...", lock)
         with unix_flock(lock):
             # Once acquiring the lock check if Proton hasn't been installed
             if steam_compat.joinpath(proton).is_dir():
                 raise FileExistsError
-            if version != "umu-scout" and umu_compat.joinpath(version).is_dir():
+            if (
+                version != "umu-scout"
+                and umu_compat.joinpath(version).is_dir()
+                and (not replace or _is_updated(umu_compat.joinpath(version), proton))
+            ):
                 raise FileExistsError
+            # A resumed download does not measure the network
+            is_resumed: bool = UMU_CACHE.joinpath(f"{tarball}.parts").is_file()
+            start: int = perf_counter_ns()
             # Download the archive to a temporary directory
             _fetch_proton(env, session_caches, assets, session_pools)
+            fetched: int = perf_counter_ns()
             # Extract the archive then move the directory
             _install_proton(tarball, session_caches, compat_tools)
+            if throughput:
+                size: int = session_caches[1].joinpath(tarball).stat().st_size
+                if not is_resumed:
+                    throughput.record(Resource.Network, size, fetched - start)
+                throughput.record(
+                    Resource.Xz if tarball.endswith("xz") else Resource.Gzip,
+                    size,
+                    perf_counter_ns() - fetched,
+                )
     except (ValueError, KeyboardInterrupt, HTTPError) as e:
         log.exception(e)
         return None
@@ -623,30 +778,54 @@ def _install_proton(
     name = ".".join(tarball.split(".")[:-2])
     folder = cache.joinpath(name)
     if os.environ.get("PROTONPATH") in latest_candidates:
-        log.info("%s -> %s", folder, umu_compat)
-        target = umu_compat / os.environ["PROTONPATH"]
+        # Each build is installed within its own directory, and the codename is
+        # swapped to point to it. Sessions running a previous build are unaffected
+        pointer: Path = umu_compat / os.environ["PROTONPATH"]
+        versions: Path = umu_compat / f".{pointer.name}.versions"
+        log.info("%s -> %s", folder, versions)
+        target: Path = versions / name
+        versions.mkdir(parents=True, exist_ok=True)
         if target.exists():
-            rmtree(target)
+            log.debug("Moving: %s -> %s", target, versions)
+            target.rename(versions / f"{name}.{token_hex(4)}")
         move(folder, target)
+        with DigestCache(UMU_CACHE.joinpath(DIGEST_CACHE)) as cache:
+            _use_build(pointer, versions, target, cache)
+        compat: Path = umu_compat
     else:
         log.info("%s -> %s", folder, steam_compat)
         move(folder, steam_compat)
+        compat = steam_compat
+
+    with CompatIndex(UMU_LOCAL.joinpath(COMPAT_INDEX), compat_tools) as index:
+        index.update(compat)
+
+
+def _use_build(pointer: Path, versions: Path, build: Path, cache: DigestCache) -> None:
+    # Point the codename to a build, then remove the previous builds no session
+    # holds. Their links to the files shared with the build change the change time
+    # of those files, so the cached digests of the build are recorded again after
+    swap_current(pointer, build)
+    with cache.keep(build):
+        prune_trees(versions, keep=build)
 
 
 def _get_delta(
     env: dict[str, str],
     umu_compat: Path,
-    patch: bytes,
+    patch: Path | None,
     assets: tuple[tuple[str, str], tuple[str, str]] | tuple[()],
     session_pools: SessionPools,
+    *,
+    throughput: Throughput | None = None,
 ) -> dict[str, str] | None:
     thread_pool, _ = session_pools
     version: str = (
         "GE-Latest" if os.environ.get("PROTONPATH") == "GE-Latest" else "UMU-Latest"
     )
     proton: Path = umu_compat.joinpath(version)
-    lock: str = f"{UMU_LOCAL}/{FileLock.Compat.value}"
-    cbor: ContentContainer
+    lock: str = get_lock_path(UMU_LOCAL, FileLock.Compat, COMPAT_LOCKS[version])
+    cbor: PatchFile
 
     if not assets:
         return None
@@ -659,27 +838,34 @@ def _get_delta(
         return None
 
     if not patch:
-        log.debug("Received empty byte string for patch, skipping")
+        log.debug("Received no patch, skipping")
         return None
 
-    # Ignore. cbor2 is an optional dep
-    from cbor2 import CBORDecodeError, dumps, loads  # noqa: PLC0415
-
-    # Ignore. umu_delta is relevant for sys packages when using *-Latest tokens
-    from .umu_delta import valid_key, valid_signature  # noqa: PLC0415
+    # Launches of an up to date build only read it, so they share the lock
+    with unix_flock(lock, shared=True):
+        if _is_updated(proton, assets[1][0].removesuffix(".tar.gz")):
+            log.info("%s is up to date", version)
+            os.environ["PROTONPATH"] = str(proton)
+            env["PROTONPATH"] = os.environ["PROTONPATH"]
+            return env
 
+    # Only read the structure of the patch. Its entries are decoded when applied
     try:
-        cbor = loads(patch)
-    except CBORDecodeError as e:
+        cbor = PatchFile(patch)
+    except (OSError, ValueError, IndexError) as e:
         log.exception(e)
         return None
 
-    log.debug("Acquiring lock '%s'", lock)
-    with unix_flock(lock):
+    with (
+        cbor,
+        unix_flock(lock),
+        delta_process_pool() as process_pool,
+        DigestCache(UMU_CACHE.joinpath(DIGEST_CACHE)) as cache,
+        ExitStack() as stack,
+    ):
         tarball, _ = assets[1]
         build: str = tarball.removesuffix(".tar.gz")
         buildid: Path = umu_compat.joinpath(version, "compatibilitytool.vdf")
-        log.debug("Acquired lock '%s'", lock)
 
         # Check if we're up to date by doing a simple file check
         # Avoids the cost of creating threads and memory-mapped IO
@@ -693,6 +879,8 @@ def _get_delta(
                     os.environ["PROTONPATH"] = str(umu_compat.joinpath(version))
                     env["PROTONPATH"] = os.environ["PROTONPATH"]
                     return env
+                file.seek(0)
+                installed: str = file.read()
         except (UnicodeDecodeError, FileNotFoundError):
             # Case when the VDF file DNE/or has non-utf-8 chars
             log.error(
@@ -700,51 +888,79 @@ def _get_delta(
             )
             return None
 
-        # Validate the integrity of the embedded public key. Use RustCrypto's SHA2
-        # implementation to keep the security boundary consistent
-        public_key, _ = cbor["public_key"]
-        if not valid_key(public_key):
-            # OWC maintainer forgot to add digest to whitelist, a different public key
-            # was accidentally used or patch was created by a 3rd party
+        if not is_valid_patch(cbor):
+            return None
+
+        source, target = _get_patch_build(cbor)
+        if target != build:
             log.error(
-                "Digest mismatched for public key '%s', skipping", cbor["public_key"]
+                "Patch target '%s' is not the latest '%s', skipping", target, build
             )
             return None
 
-        # With the public key, verify the signature and data
-        signature, _ = cbor["signature"]
-        if not valid_signature(
-            public_key, dumps(cbor["contents"], canonical=True), signature
-        ):
-            log.error("Digital signature verification failed, skipping")
+        # Patches are created between consecutive builds. When builds were skipped,
+        # find the patches from the installed build to the latest build
+        patches: list[PatchFile] = [cbor]
+        if source not in installed:
+            log.info("%s is not the previous build, searching for patches...", version)
+            patches = [
+                stack.enter_context(older)
+                for older in _fetch_patch_chain(
+                    session_pools, patch.parent, installed, source
+                )
+            ]
+            if not patches:
+                log.info("Could not find patches from the installed build, skipping")
+                return None
+            patches.append(cbor)
+
+        # Files are written next to the build before replacing it
+        size: int = sum(
+            item["size"]
+            for older in patches
+            for content in older.contents
+            for section in (content["add"], content["update"])
+            for item in get_entries(section)
+            if item["type"] == FileType.File.value
+        )
+        if size > free_space(umu_compat):
+            log.error(
+                "Updating %s requires %s bytes, but %s bytes are free, skipping",
+                version,
+                size,
+                free_space(umu_compat),
+            )
             return None
 
-        patchers: list[CustomPatcher | None] = []
-        renames: list[tuple[Path, Path]] = []
-
-        # Apply the patch
-        for content in cbor["contents"]:
-            src: str = content["source"]
-            if src.startswith((ProtonVersion.GEProton.value, ProtonVersion.UMUProton.value)):
-                patchers.append(_apply_delta(proton, content, thread_pool))
-                continue
-            subdir: Path | None = next(umu_compat.joinpath(version).rglob(src), None)
-            if not subdir:
-                log.error("Could not find subdirectory '%s', skipping", subdir)
-                continue
-            patchers.append(_apply_delta(subdir, content, thread_pool))
-            renames.append((subdir, subdir.parent / content["target"]))
+        # The build is patched into its own directory next to the installed build,
+        # which is left intact for the sessions running it
+        versions: Path = umu_compat.joinpath(f".{version}.versions")
+        dest: Path = versions.joinpath(build)
+        versions.mkdir(parents=True, exist_ok=True)
+        if dest.exists():
+            log.debug("Moving: %s -> %s", dest, versions)
+            dest.rename(versions.joinpath(f"{build}.{token_hex(4)}"))
 
-        # Wait for results and rename versioned subdirectories
         start: float = time.time_ns()
-        for patcher in filter(None, patchers):
-            _, *futures = patcher.result()
-            futures_wait(list(chain.from_iterable(futures)), return_when=ALL_COMPLETED)
-
-        for rename in renames:
-            orig, new = rename
-            orig.rename(new)
+        if not apply_delta_chain(
+            proton.resolve(),
+            patches,
+            _get_content_root,
+            thread_pool,
+            process_pool,
+            cache=cache,
+            budget=delta_memory_budget(),
+            target=dest,
+        ):
+            return None
+        _use_build(proton, versions, dest, cache)
         log.debug("Update time (ns): %s", time.time_ns() - start)
+        if throughput:
+            throughput.record(
+                Resource.Patch, get_tree_size(proton), time.time_ns() - start
+            )
+        with CompatIndex(UMU_LOCAL.joinpath(COMPAT_INDEX), (umu_compat,)) as index:
+            index.update(umu_compat)
 
     # At this point, the update was successful. Assuming no bugs, this
     # statement is expected to be incorrect if the user tampered with the build
@@ -755,36 +971,259 @@ def _get_delta(
     return env
 
 
-def _apply_delta(
-    path: Path,
-    content: Content,
-    thread_pool: ThreadPoolExecutor,
-) -> CustomPatcher | None:
-    patcher: CustomPatcher = CustomPatcher(content, path, thread_pool)
+def _is_updated(path: Path, build: str) -> bool:
+    # Whether the compatibility tool at path is the build, by its VDF file
+    try:
+        with path.joinpath("compatibilitytool.vdf").open(encoding="utf-8") as file:
+            return any(build in line for line in file)
+    except (UnicodeDecodeError, OSError):
+        return False
 
-    # Verify the identity of the build. At this point the patch file is authenticated.
-    # Note, this will skip the update if the user had tinkered with their build. We do
-    # this so we can ensure the result of each binary patch isn't garbage
-    patcher.verify_integrity()
 
-    # Handle tasks that failed metadata validation. On success, skip waiting for results
-    futures, *_ = patcher.result()
-    done, not_done = futures_wait(futures, return_when=FIRST_EXCEPTION)
-    for future in done:
-        try:
-            future.result()
-        except (FileNotFoundError, ValueError) as e:
-            log.exception(e)
-            for future in not_done:
-                future.cancel()
-            return None
+def _get_installed(
+    env: dict[str, str],
+    umu_compat: Path,
+    assets: tuple[tuple[str, str], tuple[str, str]] | tuple[()],
+) -> dict[str, str] | None:
+    # Use UMU-Latest or GE-Latest when it is the latest build, before planning
+    # how to acquire it
+    codename: str = os.environ.get("PROTONPATH", "")
 
-    futures_wait(not_done, return_when=ALL_COMPLETED)
+    if not assets or codename not in {
+        ProtonVersion.GELatest.value,
+        ProtonVersion.UMULatest.value,
+    }:
+        return None
 
-    # Patch the current build, upgrading proton to the latest
-    log.info("%s is OK, applying partial update...", os.environ["PROTONPATH"])
-    patcher.update_binaries()
-    patcher.add_binaries()
-    patcher.delete_binaries()
+    tarball, _ = assets[1]
+    # remove any combination of .abc.xy suffix (realistically .tar.gz|xz)
+    build: str = ".".join(tarball.split(".")[:-2])
+    if not _is_updated(umu_compat.joinpath(codename), build):
+        return None
+
+    log.info("%s is up to date", codename)
+    os.environ["PROTONPATH"] = str(umu_compat.joinpath(codename))
+    env["PROTONPATH"] = os.environ["PROTONPATH"]
+
+    return env
+
+
+def _get_routes(
+    env: dict[str, str],
+    compat_tools: tuple[Path, Path],
+    session_caches: SessionCaches,
+    release: tuple[
+        tuple[tuple[str, str], tuple[str, str]] | tuple[()],
+        list[tuple[str, str, int]],
+        dict[str, Any] | None,
+    ],
+    session_pools: SessionPools,
+    throughput: Throughput,
+) -> list[Route]:
+    # Routes acquiring the latest build, by the bytes each one is expected to
+    # download, decompress and patch
+    umu_compat, _ = compat_tools
+    _, cache = session_caches
+    assets, archives, patch_asset = release
+    codename: str = os.environ.get("PROTONPATH", "")
+    routes: list[Route] = []
+    installed: int = 0
+
+    if not assets:
+        return routes
 
-    return patcher
+    if codename in {ProtonVersion.GELatest.value, ProtonVersion.UMULatest.value}:
+        installed = get_tree_size(umu_compat.joinpath(codename))
+
+    # Patching downloads every patch of the chain from the installed build, reads
+    # every file of the build, and writes the changed files
+    if patch_asset and installed:
+        size: int = _get_chain_size(
+            session_pools, patch_asset, umu_compat.joinpath(codename)
+        )
+        routes.append(
+            Route(
+                "delta",
+                partial(
+                    _acquire_delta,
+                    env,
+                    umu_compat,
+                    (assets, patch_asset),
+                    session_pools,
+                    (cache, throughput),
+                ),
+                {
+                    Resource.Network: size,
+                    Resource.Patch: installed,
+                },
+                size,
+                cache,
+            )
+        )
+
+    digest, _ = assets
+    for name, url, size in archives or [(*assets[1], 0)]:
+        cached: Path = UMU_CACHE.joinpath(f"{name}.parts")
+        remaining: int = max(
+            size - (cached.stat().st_size if cached.is_file() else 0), 0
+        )
+        routes.append(
+            Route(
+                f"{'cache' if cached.is_file() else 'archive'}: {name}",
+                partial(
+                    _acquire_archive,
+                    env,
+                    compat_tools,
+                    session_caches,
+                    (digest, (name, url)),
+                    session_pools,
+                    throughput,
+                ),
+                {
+                    Resource.Network: remaining,
+                    Resource.Xz if name.endswith("xz") else Resource.Gzip: size,
+                },
+                # The archive is extracted within the cache
+                remaining + (installed or size * ARCHIVE_RATIO),
+                cache,
+            )
+        )
+
+    return routes
+
+
+def _acquire_delta(
+    env: dict[str, str],
+    umu_compat: Path,
+    release: tuple[tuple[tuple[str, str], tuple[str, str]], dict[str, Any]],
+    session_pools: SessionPools,
+    session: tuple[Path, Throughput],
+) -> bool:
+    assets, patch_asset = release
+    cache, throughput = session
+
+    try:
+        start: int = perf_counter_ns()
+        patch: Path | None = _fetch_patch(session_pools, cache, patch_asset)
+    except HTTPError:
+        log.debug("Network is unreachable")
+        return False
+
+    if patch:
+        throughput.record(
+            Resource.Network, patch.stat().st_size, perf_counter_ns() - start
+        )
+
+    return (
+        _get_delta(env, umu_compat, patch, assets, session_pools, throughput=throughput)
+        is env
+    )
+
+
+def _acquire_archive(
+    env: dict[str, str],
+    compat_tools: tuple[Path, Path],
+    session_caches: SessionCaches,
+    assets: tuple[tuple[str, str], tuple[str, str]],
+    session_pools: SessionPools,
+    throughput: Throughput,
+) -> bool:
+    return (
+        _get_latest(
+            env,
+            compat_tools,
+            session_caches,
+            assets,
+            session_pools,
+            throughput=throughput,
+            replace=True,
+        )
+        is env
+    )
+
+
+def _get_patch_build(cbor: PatchFile) -> tuple[str, str]:
+    # Return the source and target build of Proton within a patch
+    for content in cbor.contents:
+        if content["source"].startswith(
+            (ProtonVersion.GEProton.value, ProtonVersion.UMUProton.value)
+        ):
+            return content["source"], content["target"]
+
+    err: str = "Patch does not contain a Proton build"
+    raise ValueError(err)
+
+
+def _fetch_patch_chain(
+    session_pools: SessionPools, cache: Path, installed: str, source: str
+) -> list[PatchFile]:
+    resp: BaseHTTPResponse
+    thread_pool, http_pool = session_pools
+    url: str = "https://api.github.com"
+    repo: str = (
+        "/repos/Open-Wine-Components/umu-mkpatch/releases"
+        f"?per_page={DELTA_CHAIN_MAX + 1}"
+    )
+    headers: dict[str, str] = {
+        "Accept": "application/vnd.github+json",
+        "X-GitHub-Api-Version": "2022-11-28",
+        "User-Agent": "",
+    }
+    patches: list[PatchFile] = []
+    codename: str = os.environ["PROTONPATH"]
+
+    # Walk the releases backwards from the latest, linking each patch's target to the
+    # source of the next patch until reaching the installed build
+    try:
+        resp = http_pool.request(HTTPMethod.GET.value, f"{url}{repo}", headers=headers)
+        if resp.status != HTTPStatus.OK:
+            return []
+
+        for release in resp.json():
+            durl: str = find_patch_asset(release["assets"], codename)
+            if not durl:
+                continue
+            path: Path = cache.joinpath(f"{codename}.{release['id']}.cbor")
+            # Of an indexed patch file, only fetch the payloads of a patch to the
+            # build being searched for
+            if not download_patch(
+                http_pool,
+                durl,
+                headers,
+                path,
+                thread_pool=thread_pool,
+                select=lambda cbor, source=source: _get_patch_build(cbor)[1] == source,
+            ):
+                break
+            older: PatchFile = PatchFile(path)
+            patches.insert(0, older)
+            prev, target = _get_patch_build(older)
+            if target != source:
+                # The latest patch, or a patch from an unrelated build
+                patches.pop(0).close()
+                continue
+            if not is_valid_patch(older):
+                break
+            log.debug("Found patch: %s -> %s", prev, target)
+            source = prev
+            if prev in installed:
+                return patches
+            if len(patches) == DELTA_CHAIN_MAX:
+                break
+    except (HTTPError, OSError, ValueError, IndexError, KeyError) as e:
+        log.exception(e)
+
+    for older in patches:
+        older.close()
+
+    return []
+
+
+def _get_content_root(path: Path, content: Content) -> Path | None:
+    # Proton's contents are relative to the build. Otherwise, relative to a versioned
+    # subdirectory within the build (e.g., protonfixes)
+    if content["source"].startswith(
+        (ProtonVersion.GEProton.value, ProtonVersion.UMUProton.value)
+    ):
+        return path
+    return next(path.rglob(content["source"]), None)
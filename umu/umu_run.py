@@ -10,7 +10,7 @@ from argparse import Namespace
 from array import array
 from collections.abc import Generator, MutableMapping
 from concurrent.futures import Future, ThreadPoolExecutor
-from contextlib import suppress
+from contextlib import ExitStack, suppress
 from ctypes import CDLL, c_int, c_ulong
 from errno import ENETUNREACH
 from pathlib import Path
@@ -37,10 +37,12 @@ from umu.umu_consts import (
     PR_SET_CHILD_SUBREAPER,
     PROTON_VERBS,
     STEAM_COMPAT,
+    UMU_COMPAT,
     UMU_LOCAL,
     FileLock,
     GamescopeAtom,
 )
+from umu.umu_index import COMPAT_INDEX, CompatIndex, ToolEntry
 from umu.umu_log import log
 from umu.umu_plugins import set_env_toml
 from umu.umu_proton import ProtonVersion, get_umu_proton
@@ -51,6 +53,7 @@ from umu.umu_runtime import (
     UmuRuntime,
     check_runtime,
     create_shim,
+    repair_runtime,
     setup_umu,
 )
 from umu.umu_util import (
@@ -58,6 +61,7 @@ from umu.umu_util import (
     get_library_paths,
     has_runtime_installed,
     has_umu_setup,
+    hold_tree,
     is_installed_verb,
     unix_flock,
     write_install_marker,
@@ -796,6 +800,15 @@ def resolve_runtime() -> UmuRuntime:
         if os.environ.get("PROTONPATH") and path.is_dir():
             os.environ["PROTONPATH"] = str(path)
 
+    # Tools installed within the compat directories are resolved by their index
+    with CompatIndex(
+        UMU_LOCAL.joinpath(COMPAT_INDEX), (UMU_COMPAT, STEAM_COMPAT)
+    ) as index:
+        tool: ToolEntry | None = index.get(path)
+    if tool and tool["layer"] is not None:
+        appid: str = tool["appid"] or "host"
+        return RUNTIME_VERSIONS[appid]
+
     toolmanifest = path.joinpath("toolmanifest.vdf")
     if toolmanifest.is_file():
         layer = CompatLayer(toolmanifest.parent, Path())
@@ -881,8 +894,10 @@ def umu_run(args: Namespace | tuple[str, list[str]]) -> int:
     def _check_offline_runtime(_rt: UmuRuntime) -> bool:
         if _rt.name == "host" or not _rt.path:
             return True
-        if not has_umu_setup(_rt.path, _rt.machine) and check_runtime(
-            _rt.path, _rt.as_tuple()
+        if (
+            not has_umu_setup(_rt.path, _rt.machine)
+            and check_runtime(_rt.path, _rt.as_tuple())
+            and repair_runtime(_rt.path, _rt.as_tuple())
         ):
             return False
         write_install_marker(_rt.path)
@@ -929,7 +944,7 @@ def umu_run(args: Namespace | tuple[str, list[str]]) -> int:
             retries=Retry(total=retries, redirect=True),
         )
     thread_pool = ThreadPoolExecutor()
-    with thread_pool, http_pool:
+    with thread_pool, http_pool, ExitStack() as stack:
         session_pools: tuple[ThreadPoolExecutor, PoolManager] = (thread_pool, http_pool)
 
         # Setup the launcher and runtime files
@@ -1018,6 +1033,13 @@ def umu_run(args: Namespace | tuple[str, list[str]]) -> int:
             create_shim(UMU_LOCAL / "umu-shim")
 
         protonpath: Path = Path(env["PROTONPATH"]).expanduser().resolve(strict=True)
+
+        # Hold the resolved compatibility tool and runtime until the command exits,
+        # so updates from other sessions retire their versions only once unused
+        stack.enter_context(hold_tree(protonpath))
+        if runtime_variant:
+            stack.enter_context(hold_tree(UMU_LOCAL / runtime_variant))
+
         layer = CompatLayer(protonpath, UMU_LOCAL.joinpath("umu-shim"))
 
         # Prepare the prefix
@@ -1040,15 +1062,18 @@ def umu_run(args: Namespace | tuple[str, list[str]]) -> int:
             log.debug("%s=%s", key, val)
             os.environ[key] = val
 
-    # Exit if the winetricks verb is already installed to avoid reapplying it
-    if env["EXE"].endswith("winetricks") and is_installed_verb(
-        opts, Path(env["WINEPREFIX"])
-    ):
-        sys.exit(1)
+        holds: ExitStack = stack.pop_all()
+
+    with holds:
+        # Exit if the winetricks verb is already installed to avoid reapplying it
+        if env["EXE"].endswith("winetricks") and is_installed_verb(
+            opts, Path(env["WINEPREFIX"])
+        ):
+            sys.exit(1)
 
-    # Build the command
-    command: tuple[str, ...] = build_command(env, layer, opts)
-    log.debug("%s", command)
+        # Build the command
+        command: tuple[str, ...] = build_command(env, layer, opts)
+        log.debug("%s", command)
 
-    # Run the command
-    return run_command(command)
+        # Run the command
+        return run_command(command)
@@ -1,40 +1,109 @@
+import json
 import os
 import platform
 import shlex
-from collections.abc import Callable
-from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Callable, Generator, Iterable
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+)
+from concurrent.futures import wait as futures_wait
 from dataclasses import dataclass
+from fnmatch import fnmatch
+from gzip import open as gzip_open
 from hashlib import sha256
 from http import HTTPStatus
+from importlib.util import find_spec
 from pathlib import Path
-from shutil import move
+from re import sub as resub
+from secrets import token_hex
+from shutil import move, rmtree
+from stat import S_IMODE, S_ISDIR, S_ISLNK, S_ISREG
 from subprocess import run  # nosec B404
+from tarfile import TarInfo
 from tempfile import TemporaryDirectory, mkdtemp
+from typing import Any
 
 from urllib3.exceptions import HTTPError, ProtocolError, ReadTimeoutError
 from urllib3.poolmanager import PoolManager
 from urllib3.response import BaseHTTPResponse
 
 from umu import vdf
+from umu.umu_bspatch import (
+    Content,
+    FileType,
+    PatchFile,
+    apply_delta_chain,
+    delta_memory_budget,
+    delta_process_pool,
+    download_patch,
+    find_patch_asset,
+    is_valid_patch,
+)
 from umu.umu_consts import UMU_CACHE, UMU_LOCAL, FileLock, HTTPMethod
 from umu.umu_log import log
 from umu.umu_util import (
+    InstallJournal,
+    InstallStep,
+    IOOrder,
     exchange,
     extract_tarfile,
+    extract_tarmembers,
     file_digest,
+    get_io_order,
+    get_layout_key,
+    get_lock_path,
     get_tempdir,
     has_runtime_installed,
+    read_install_marker,
+    retire_tree,
     run_zenity,
+    syncfs,
     unix_flock,
     write_file_chunks,
     write_install_marker,
 )
 
+# Metadata of the runtime's files after its last successful validation
+VERIFY_STAMP = ".verified.json"
+
+# Number of mtree entries verified within a task
+MTREE_BATCH_SIZE = 256
+
+# Files of at least this size will be hashed within their own task
+MTREE_BATCH_BYTES = 1024 * 1024
+
+# Maximum number of tasks in flight when verifying an mtree
+MTREE_PENDING_MAX = 64
+
+# Number of the most recent releases searched for a patch to the runtime
+RUNTIME_PATCH_RELEASES = 8
+
+# Seconds a launch waits for another process updating the runtime, before using
+# the installed runtime
+RUNTIME_LOCK_TIMEOUT = 30
+
 RuntimeVersion = tuple[str, str, str]
 
 SessionPools = tuple[ThreadPoolExecutor, PoolManager]
 
 
+@dataclass
+class MtreeEntry:
+    """Holds an entry of the runtime's mtree."""
+
+    # Path relative to the root of the mtree
+    name: str
+    type: str
+    mode: int | None = None
+    size: int | None = None
+    sha256: str | None = None
+    # Target of a symbolic link
+    link: str | None = None
+
+
 def create_shim(file_path: Path):
     """Create a shell script shim at the specified file path.
 
@@ -65,12 +134,9 @@ def create_shim(file_path: Path):
     file_path.chmod(0o700)
 
 
-def _install_umu(
-    local: Path,
-    runtime_ver: RuntimeVersion,
-    version: str,
-    session_pools: SessionPools
-) -> None:
+def _download_umu(
+    runtime_ver: RuntimeVersion, version: str, session_pools: SessionPools
+) -> Path:
     resp: BaseHTTPResponse
     UMU_CACHE.mkdir(parents=True, exist_ok=True)
     tmp: Path = get_tempdir()
@@ -80,10 +146,7 @@ def _install_umu(
     host: str = "repo.steampowered.com"
     base_url: str = f"https://{host}/{variant.removesuffix('-arm64')}/images/{version}/"
 
-    if codename.removeprefix("steamrt").removesuffix("-arm64").isdigit():
-        archive = f"SteamLinuxRuntime_{codename.removeprefix('steamrt')}.tar.xz"
-    else:
-        archive = f"SteamLinuxRuntime_{codename}.tar.xz"
+    archive: str = _runtime_archive(codename)
     parts = tmp.joinpath(f"{archive}.parts")
 
     log.debug("Using endpoint '%s' for requests", base_url)
@@ -237,26 +300,483 @@ def _install_umu(
             parts.parent / parts.name.removesuffix(f".{buildid}.parts")
         )
 
-    local.mkdir(parents=True, exist_ok=True)
+    return parts
+
+
+def _install_umu(
+    local: Path,
+    runtime_ver: RuntimeVersion,
+    version: str,
+    session_pools: SessionPools
+) -> None:
+    codename, variant, _ = runtime_ver
+    archive: str = _runtime_archive(codename)
+    steamrt: str = archive.removesuffix(".tar.xz")
+    # Keep the install's state next to the runtime, on the same file system, so
+    # an interrupted install can be resumed from its last completed step
+    staging: Path = local.parent.joinpath(f".{local.name}.staging")
+    journal: InstallJournal = InstallJournal(
+        local.parent.joinpath(f".{local.name}.journal")
+    )
+    state: dict[str, str] = journal.read()
+    step: InstallStep | None = InstallStep(state["step"]) if state else None
+    members: list[TarInfo] = []
+
+    if state.get("version") != version or not staging.is_dir():
+        if staging.exists():
+            log.debug("Removing: %s", staging)
+            rmtree(staging)
+        journal.clear()
+        step = None
+    else:
+        log.info("Resuming %s (%s) install from step: %s", variant, version, step)
+
+    if step is None:
+        parts: Path = _download_umu(runtime_ver, version, session_pools)
+        staging.mkdir(parents=True)
+        log.debug("Moving: %s -> %s", parts, staging)
+        move(parts, staging)
+        state = journal.record(
+            InstallStep.Staged, version=version, generation=token_hex(8)
+        )
+        step = InstallStep.Staged
+
+    if step == InstallStep.Staged:
+        # Discard the partially extracted runtime, if any
+        if staging.joinpath(steamrt).exists():
+            rmtree(staging.joinpath(steamrt))
+        extract_tarfile(staging.joinpath(archive), staging, members=members)
+        journal.record(InstallStep.Extracted)
+        step = InstallStep.Extracted
+
+    if step == InstallStep.Extracted:
+        # Validate before committing, leaving the existing runtime untouched
+        # when the new one is unusable
+        if not staging.joinpath(steamrt, "umu").is_symlink():
+            log.debug("Linking: umu -> _v2-entry-point")
+            staging.joinpath(steamrt, "umu").symlink_to("_v2-entry-point")
+        if check_runtime(staging.joinpath(steamrt), runtime_ver):
+            log.debug("Removing: %s", staging)
+            rmtree(staging)
+            journal.clear()
+            return
+        # The marker identifies the install once its runtime is in place
+        write_install_marker(staging.joinpath(steamrt), state["generation"])
+        # Make the new runtime durable with a single barrier before committing
+        syncfs(staging)
+        journal.record(InstallStep.Verified)
+        step = InstallStep.Verified
+
+    if step == InstallStep.Verified:
+        # The exchange may have been done before the install was interrupted
+        if read_install_marker(local) != state["generation"]:
+            local.mkdir(parents=True, exist_ok=True)
+            log.debug("Exchanging: %s <-> %s", staging.joinpath(steamrt), local)
+            exchange(staging.joinpath(steamrt), local)
+        journal.record(InstallStep.Committed)
+
+    # Sessions may still run the previous runtime, so retire it rather than
+    # removing it with the staging directory
+    if staging.joinpath(steamrt).is_dir():
+        retire_tree(
+            staging.joinpath(steamrt), local.parent.joinpath(f".{local.name}.retired")
+        )
+
+    # Without members, the archive was extracted before being interrupted
+    if members:
+        _cache_runtime(staging.joinpath(archive), steamrt, members)
+
+    log.debug("Removing: %s", staging)
+    rmtree(staging)
+    journal.clear()
+
+
+def _runtime_archive(codename: str) -> str:
+    """Return the name of the runtime's archive (e.g., SteamLinuxRuntime_sniper.tar.xz)."""
+    if codename.removeprefix("steamrt").removesuffix("-arm64").isdigit():
+        return f"SteamLinuxRuntime_{codename.removeprefix('steamrt')}.tar.xz"
+    return f"SteamLinuxRuntime_{codename}.tar.xz"
+
+
+def _cache_runtime(archive: Path, root: str, members: list[TarInfo]) -> None:
+    """Keep a verified runtime archive and an index of its members in the cache.
+
+    The index maps each member's name, relative to the archive's root directory,
+    to the offset of its header so that individual subtrees can be restored from
+    the archive without downloading or extracting the rest of it.
+    """
+    index: Path = UMU_CACHE.joinpath(f"{archive.name}.index.json")
+    tmp: Path = index.with_suffix(".tmp")
+
+    try:
+        cached: Path = Path(move(archive, UMU_CACHE.joinpath(archive.name)))
+        stats: os.stat_result = cached.stat()
+        with tmp.open("w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "root": root,
+                    "size": stats.st_size,
+                    "mtime_ns": stats.st_mtime_ns,
+                    "members": {
+                        member.name.removeprefix(f"{root}/"): member.offset
+                        for member in members
+                        if member.name.startswith(f"{root}/")
+                    },
+                },
+                file,
+            )
+        tmp.replace(index)
+        log.debug("Cached: %s (%s members)", cached, len(members))
+    except OSError as e:
+        log.exception(e)
+        tmp.unlink(missing_ok=True)
+        index.unlink(missing_ok=True)
+
+
+def _read_runtime_index(
+    local: Path, runtime_ver: RuntimeVersion
+) -> tuple[Path, dict] | None:
+    """Return the cached runtime archive and its index when it matches the install."""
+    codename, _, _ = runtime_ver
+    _codename: str = codename.removesuffix("-arm64")
+    archive: Path = UMU_CACHE.joinpath(_runtime_archive(codename))
+    index: dict
+
+    try:
+        with UMU_CACHE.joinpath(f"{archive.name}.index.json").open(
+            encoding="utf-8"
+        ) as file:
+            index = json.load(file)
+        stats: os.stat_result = archive.stat()
+        if (stats.st_size, stats.st_mtime_ns) != (index["size"], index["mtime_ns"]):
+            log.debug("Cached archive '%s' changed since indexing, skipping", archive)
+            return None
+        tops: set[str] = {name.split("/", 1)[0] for name in index["members"]}
+    except (OSError, ValueError, KeyError) as e:
+        log.debug("Unable to read index of cached archive '%s': %s", archive, e)
+        return None
+
+    # Do not mix an older cached runtime with the current platform
+    if any(file.name not in tops for file in local.glob(f"{_codename}_platform_*")):
+        log.debug("Cached archive '%s' does not match '%s', skipping", archive, local)
+        return None
+
+    return archive, index
+
+
+def _repair_umu(
+    local: Path, runtime_ver: RuntimeVersion, patterns: tuple[str, ...]
+) -> bool:
+    """Restore the top-level entries of the runtime matching patterns from the cache.
+
+    Only the members of the cached archive within the matched subtrees will be
+    read. Returns False when the cached archive is missing, does not match the
+    installed runtime or when the members could not be extracted.
+    """
+    _, variant, _ = runtime_ver
+    cached: tuple[Path, dict] | None = _read_runtime_index(local, runtime_ver)
+    offsets: list[int]
+
+    if not cached:
+        return False
+
+    archive, index = cached
+    offsets = [
+        offset
+        for name, offset in index["members"].items()
+        if any(fnmatch(name.split("/", 1)[0], pattern) for pattern in patterns)
+    ]
+    if not offsets:
+        return False
+
+    log.info("Restoring %s from '%s'...", ", ".join(patterns), archive)
     with TemporaryDirectory(dir=local.parent, prefix=".") as tempdir:
         log.debug("Created: %s", tempdir)
-        log.debug("Moving: %s -> %s", parts, tempdir)
-        move(parts, tempdir)
+        if not extract_tarmembers(archive, Path(tempdir), offsets):
+            return False
+        for file in Path(tempdir, index["root"]).iterdir():
+            dest: Path = local.joinpath(file.name)
+            if dest.exists() or dest.is_symlink():
+                log.debug("Exchanging: %s <-> %s", file, dest)
+                exchange(file, dest)
+                continue
+            log.debug("Moving: %s -> %s", file, dest)
+            file.rename(dest)
 
-        extract_tarfile(Path(tempdir, archive), Path(tempdir))
+    log.info("%s: restored %s members", variant, len(offsets))
 
-        steamrt, *_ = archive.split(".tar.xz")
-        log.debug("Exchanging: %s <-> %s", Path(tempdir, steamrt), local)
-        exchange(Path(tempdir, steamrt), local)
+    return True
 
-        # Validate and post-install
-        try:
-            ret = check_runtime(local, runtime_ver)
-            if not ret:
-                write_install_marker(local)
-        finally:
-            log.debug("Linking: umu -> _v2-entry-point")
-            local.joinpath("umu").symlink_to("_v2-entry-point")
+
+def _read_mtree(path: Path) -> Generator[MtreeEntry, Any, None]:
+    """Read the entries of a gzip compressed mtree(5) file in the full path format.
+
+    Entries are yielded as they are read. Keywords set with '/set' are applied to
+    each subsequent entry and keywords that umu does not verify are ignored.
+    """
+    defaults: dict[str, str] = {}
+
+    with gzip_open(path, "rt", encoding="utf-8", errors="surrogateescape") as file:
+        line: str = ""
+        for text in file:
+            line += text.rstrip("\n")
+            # Entries may span multiple lines
+            if line.endswith("\\"):
+                line = line.removesuffix("\\")
+                continue
+            if not line.strip():
+                continue
+            name, *fields = line.split()
+            line = ""
+            if name.startswith("#"):
+                continue
+            keywords: dict[str, str] = dict(
+                field.split("=", 1) if "=" in field else (field, "") for field in fields
+            )
+            if name == "/set":
+                defaults.update(keywords)
+                continue
+            if name == "/unset":
+                for key in keywords:
+                    defaults.pop(key, None)
+                continue
+            if name == "..":
+                continue
+            keywords = defaults | keywords
+            yield MtreeEntry(
+                name=_mtree_unescape(name).removeprefix("./"),
+                type=keywords.get("type", FileType.File.value),
+                mode=int(keywords["mode"], 8) if "mode" in keywords else None,
+                size=int(keywords["size"]) if "size" in keywords else None,
+                sha256=keywords.get("sha256digest", keywords.get("sha256")),
+                link=_mtree_unescape(keywords["link"]) if "link" in keywords else None,
+            )
+
+
+def _mtree_unescape(text: str) -> str:
+    # mtree(5) encodes whitespace and non-printable bytes as octal escapes
+    raw: bytes = resub(
+        rb"\\([0-7]{3})",
+        lambda match: bytes([int(match.group(1), 8)]),
+        text.encode("utf-8", errors="surrogateescape"),
+    )
+    return raw.decode("utf-8", errors="surrogateescape")
+
+
+def _verify_mtree_entry(root: Path, entry: MtreeEntry) -> str:
+    """Verify an mtree entry against the file system, returning the reason on failure.
+
+    Files are checked for their size, executable bits and sha256 digest, links for
+    their target and directories for their existence.
+    """
+    path: Path = root.joinpath(entry.name)
+
+    try:
+        stats: os.stat_result = path.lstat()
+    except FileNotFoundError:
+        return "missing"
+    except OSError as e:
+        return str(e)
+
+    if entry.type == FileType.Dir.value:
+        return "" if S_ISDIR(stats.st_mode) else "not a directory"
+
+    if entry.type == FileType.Link.value:
+        if not S_ISLNK(stats.st_mode):
+            return "not a symbolic link"
+        if entry.link is not None and str(path.readlink()) != entry.link:
+            return f"expected target '{entry.link}'"
+        return ""
+
+    if entry.type != FileType.File.value:
+        return ""
+
+    if not S_ISREG(stats.st_mode):
+        return "not a regular file"
+    if entry.size is not None and entry.size != stats.st_size:
+        return f"expected size {entry.size}, received {stats.st_size}"
+    if entry.mode is not None and (entry.mode & 0o111) != (stats.st_mode & 0o111):
+        return f"expected mode {entry.mode:o}, received {S_IMODE(stats.st_mode):o}"
+    if entry.sha256 is not None:
+        with path.open("rb") as fp:
+            digest: str = file_digest(fp, "sha256").hexdigest()
+        if digest != entry.sha256:
+            return f"expected sha256 {entry.sha256}, received {digest}"
+
+    return ""
+
+
+def _verify_mtree_batch(
+    root: Path, entries: list[MtreeEntry], *, minimized: bool
+) -> list[tuple[MtreeEntry, str]]:
+    failed: list[tuple[MtreeEntry, str]] = []
+
+    for entry in entries:
+        reason: str = _verify_mtree_entry(root, entry)
+        if not reason:
+            continue
+        # Minimized runtimes only ship ./usr, the rest is created when launched
+        if (
+            minimized
+            and reason == "missing"
+            and not (entry.name == "usr" or entry.name.startswith("usr/"))
+        ):
+            continue
+        failed.append((entry, reason))
+
+    return failed
+
+
+def verify_mtree(
+    root: Path,
+    mtree: Path,
+    thread_pool: ThreadPoolExecutor,
+    *,
+    minimized: bool = False,
+) -> list[tuple[MtreeEntry, str]]:
+    """Verify a directory against an mtree, returning each failed entry and reason.
+
+    The mtree is streamed and its entries are verified in batches across the
+    thread pool, where large files are hashed in their own task. Intended to
+    match the semantics of pv-verify, including --minimized-runtime, without
+    depending on pressure-vessel.
+
+    On rotational storage, the mtree is read in full and its entries are verified
+    by their location on disk instead, see get_io_order.
+    """
+    failed: list[tuple[MtreeEntry, str]] = []
+    pending: set[Future] = set()
+    batch: list[MtreeEntry] = []
+    order: IOOrder = get_io_order(root)
+    entries: Iterable[MtreeEntry] = _read_mtree(mtree)
+
+    if order != IOOrder.Off:
+        entries = sorted(
+            entries, key=lambda entry: get_layout_key(root.joinpath(entry.name), order)
+        )
+
+    def _submit(entries: list[MtreeEntry]) -> None:
+        nonlocal pending
+        pending.add(
+            thread_pool.submit(_verify_mtree_batch, root, entries, minimized=minimized)
+        )
+        # Bound the entries held in memory while the mtree is read
+        if len(pending) >= MTREE_PENDING_MAX:
+            done, pending = futures_wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                failed.extend(future.result())
+
+    for entry in entries:
+        if (entry.size or 0) >= MTREE_BATCH_BYTES:
+            _submit([entry])
+            continue
+        batch.append(entry)
+        if len(batch) >= MTREE_BATCH_SIZE:
+            _submit(batch)
+            batch = []
+
+    if batch:
+        _submit(batch)
+
+    for future in futures_wait(pending, return_when=ALL_COMPLETED).done:
+        failed.extend(future.result())
+
+    failed.sort(key=lambda item: item[0].name)
+
+    return failed
+
+
+def _verify_runtime(runtime: Path) -> int:
+    """Validate the runtime platform with umu's mtree verifier."""
+    mtree: Path = runtime.joinpath("usr-mtree.txt.gz")
+
+    if not mtree.is_file():
+        log.warning("File does not exist: '%s'", mtree)
+        return 1
+
+    with ThreadPoolExecutor() as thread_pool:
+        failed = verify_mtree(
+            runtime.joinpath("files"), mtree, thread_pool, minimized=True
+        )
+
+    for entry, reason in failed:
+        log.debug("%s: %s", entry.name, reason)
+
+    return 1 if failed else 0
+
+
+def repair_runtime(local: Path, runtime_ver: RuntimeVersion) -> int:
+    """Repair the runtime's files that failed validation with its mtree.
+
+    The runtime's mtree will be used to find the entries with the wrong type,
+    size, mode or digest, then only those entries will be restored from the
+    cached runtime archive and verified again. Returns 0 on success.
+    """
+    _, variant, _ = runtime_ver
+    mtree: Path = local.joinpath("mtree.txt.gz")
+    lock: str = get_lock_path(local.parent, FileLock.Runtime, local.name)
+    failed: list[MtreeEntry]
+    offsets: list[int]
+
+    if not mtree.is_file():
+        log.debug("File does not exist: '%s'", mtree)
+        return 1
+
+    with unix_flock(lock):
+        cached: tuple[Path, dict] | None = _read_runtime_index(local, runtime_ver)
+        if not cached:
+            return 1
+
+        archive, index = cached
+        with ThreadPoolExecutor() as thread_pool:
+            failed = [entry for entry, _ in verify_mtree(local, mtree, thread_pool)]
+
+        if not failed:
+            log.debug("No entries failed validation in '%s'", mtree)
+            return 1
+
+        # Entries are sorted, so parents will be restored first
+        if any(entry.name not in index["members"] for entry in failed):
+            log.debug("Failed entries are not members of '%s'", archive)
+            return 1
+
+        offsets = [index["members"][entry.name] for entry in failed]
+        log.info("Repairing %s files in %s...", len(failed), variant)
+        with TemporaryDirectory(dir=local.parent, prefix=".") as tempdir:
+            log.debug("Created: %s", tempdir)
+            if not extract_tarmembers(archive, Path(tempdir), offsets):
+                return 1
+            for entry in failed:
+                file: Path = Path(tempdir, index["root"], entry.name)
+                dest: Path = local.joinpath(entry.name)
+                try:
+                    # Directories are created rather than moved, as the failed
+                    # entries within them are moved on their own
+                    if entry.type == FileType.Dir.value:
+                        if dest.is_symlink() or (dest.exists() and not dest.is_dir()):
+                            dest.unlink()
+                        dest.mkdir(parents=True, exist_ok=True)
+                        dest.chmod(S_IMODE(file.stat().st_mode))
+                        continue
+                    if dest.is_dir() and not dest.is_symlink():
+                        rmtree(dest)
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    log.debug("Moving: %s -> %s", file, dest)
+                    file.replace(dest)
+                except OSError as e:
+                    log.exception(e)
+                    return 1
+
+        # Verify only the entries that were repaired
+        for entry in failed:
+            if reason := _verify_mtree_entry(local, entry):
+                log.warning("%s validation failed", variant)
+                log.debug("%s: %s", entry.name, reason)
+                return 1
+
+    log.info("%s: repaired %s files", variant, len(failed))
+
+    return 0
 
 
 def setup_umu(
@@ -268,6 +788,8 @@ def setup_umu(
     # Backfill markers for installs created before markers existed after verifying.
     if not has_runtime_installed(local) and local.is_dir():
         ret = check_runtime(local, runtime_ver)
+        if ret:
+            ret = repair_runtime(local, runtime_ver)
         if not ret:
             write_install_marker(local)
 
@@ -343,6 +865,7 @@ def _update_umu(
                     if file.is_dir()
                 ]
             ),
+            patterns=(f"{_codename}_platform_*",),
         )
         return
 
@@ -356,6 +879,7 @@ def _update_umu(
             version,
             session_pools,
             lambda: local.joinpath("pressure-vessel").is_dir(),
+            patterns=("pressure-vessel",),
         )
         return
 
@@ -369,6 +893,7 @@ def _update_umu(
             version,
             session_pools,
             lambda: local.joinpath("VERSIONS.txt").is_file(),
+            patterns=("VERSIONS.txt",),
         )
         return
 
@@ -378,17 +903,70 @@ def _update_umu(
     log.info("%s is up to date", variant)
 
 
-def check_runtime(src: Path, runtime_ver: RuntimeVersion) -> int:
+def _runtime_fingerprint(path: Path) -> str:
+    """Digest the inode, size and timestamps of each entry within a directory.
+
+    Any modification, replacement or removal of an entry will produce a different
+    digest. Only metadata is read, so the cost is a single lstat of each entry.
+    Paths are relative to the directory, so the digest is kept when it is moved.
+    """
+    hashsum = sha256()
+    dirs: list[Path] = [path]
+    start: int = len(str(path)) + 1
+
+    while dirs:
+        with os.scandir(dirs.pop()) as it:
+            for entry in sorted(it, key=lambda entry: entry.name):
+                stats: os.stat_result = entry.stat(follow_symlinks=False)
+                hashsum.update(
+                    f"{entry.path[start:]}\0{stats.st_ino}\0{stats.st_size}\0"
+                    f"{stats.st_mtime_ns}\0{stats.st_ctime_ns}\n".encode(
+                        errors="surrogateescape"
+                    )
+                )
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(Path(entry.path))
+
+    return hashsum.hexdigest()
+
+
+def _read_verify_stamp(src: Path) -> dict[str, str]:
+    try:
+        with src.joinpath(VERIFY_STAMP).open(encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_verify_stamp(src: Path, runtime: Path, fingerprint: str) -> None:
+    tmp: Path = src.joinpath(f"{VERIFY_STAMP}.tmp")
+    try:
+        with tmp.open("w", encoding="utf-8") as file:
+            json.dump({"runtime": runtime.name, "fingerprint": fingerprint}, file)
+        tmp.replace(src.joinpath(VERIFY_STAMP))
+    except OSError as e:
+        log.exception(e)
+        tmp.unlink(missing_ok=True)
+
+
+def check_runtime(
+    src: Path, runtime_ver: RuntimeVersion, *, force: bool = False
+) -> int:
     """Validate the file hierarchy of the runtime platform.
 
     The mtree file included in the Steam runtime platform will be used to
     validate the integrity of the runtime's metadata after its moved to the
     home directory and used to run games.
+
+    After a successful validation, a stamp of the runtime's file metadata is
+    kept and later validations will be skipped while the runtime's files are
+    unchanged, unless forced or $UMU_RUNTIME_VERIFY is 1.
     """
     runtime: Path
     codename, variant, _ = runtime_ver
     pv_verify: Path = src.joinpath("pressure-vessel", "bin", "pv-verify")
     ret: int = 1
+    fingerprint: str
 
     # Find the runtime directory
     _codename = codename.removesuffix("-arm64")
@@ -401,16 +979,30 @@ def check_runtime(src: Path, runtime_ver: RuntimeVersion) -> int:
         log.critical("Could not find %s_platform_* in '%s'", _codename, src)
         return ret
 
-    if not pv_verify.is_file():
-        log.warning("%s validation failed", variant)
-        log.warning("File does not exist: '%s'", pv_verify)
-        return ret
+    try:
+        fingerprint = _runtime_fingerprint(runtime / "files")
+    except OSError as e:
+        # Let pv-verify report the error
+        log.debug("Unable to read metadata of '%s': %s", runtime, e)
+        fingerprint = ""
+
+    force = force or os.environ.get("UMU_RUNTIME_VERIFY") == "1"
+    stamp: dict[str, str] = {"runtime": runtime.name, "fingerprint": fingerprint}
+    if not force and fingerprint and _read_verify_stamp(src) == stamp:
+        log.debug("%s is unchanged since its last validation", runtime.name)
+        log.info("%s: mtree is OK", runtime.name)
+        return 0
 
     log.info("Verifying integrity of %s...", runtime.name)
-    pv = Path(pv_verify).expanduser().resolve(strict=True)
-    ret = run(  # nosec B603
-        [str(pv), "--quiet", "--minimized-runtime", str(runtime / "files")], check=False
-    ).returncode
+    if pv_verify.is_file():
+        pv = Path(pv_verify).expanduser().resolve(strict=True)
+        ret = run(  # nosec B603
+            [str(pv), "--quiet", "--minimized-runtime", str(runtime / "files")],
+            check=False,
+        ).returncode
+    else:
+        log.debug("File does not exist: '%s', using mtree verifier", pv_verify)
+        ret = _verify_runtime(runtime)
 
     if ret:
         log.warning("%s validation failed", variant)
@@ -418,6 +1010,9 @@ def check_runtime(src: Path, runtime_ver: RuntimeVersion) -> int:
         return ret
     log.info("%s: mtree is OK", runtime.name)
 
+    if fingerprint:
+        _write_verify_stamp(src, runtime, fingerprint)
+
     return ret
 
 
@@ -427,16 +1022,19 @@ def _restore_umu(
     version: str,
     session_pools: SessionPools,
     callback_fn: Callable[[], bool],
+    *,
+    patterns: tuple[str, ...] = (),
 ) -> None:
-    lock: str = f"{local.parent}/{FileLock.Runtime.value}"
+    lock: str = get_lock_path(local.parent, FileLock.Runtime, local.name)
     with unix_flock(lock):
-        log.debug("Acquired file lock '%s'...", lock)
         if callback_fn():
-            log.debug("Released file lock '%s'", lock)
+            log.info("%s was restored", runtime_ver[1])
+            return
+        # Prefer restoring the missing entries from the cache over a new download
+        if patterns and _repair_umu(local, runtime_ver, patterns) and callback_fn():
             log.info("%s was restored", runtime_ver[1])
             return
         _install_umu(local, runtime_ver, version, session_pools)
-        log.debug("Released file lock '%s'", lock)
 
 
 def _versions_dict(lines: list[str]) -> dict:
@@ -463,26 +1061,173 @@ def _update_umu_platform(
     session_pools: SessionPools,
 ) -> None:
     name, variant, _ = runtime_ver
-    lock: str = f"{local.parent}/{FileLock.Runtime.value}"
-    text: list[str]  # VERSIONS.txt
+    lock: str = get_lock_path(local.parent, FileLock.Runtime, local.name)
+    local_ver: str
 
     # Update to the latest platform by checking if the VERSION.txt value
-    # exists in VERSIONS.txt
-    log.debug("Acquiring file lock '%s'...", lock)
+    # exists in VERSIONS.txt. Launches only read it, so they share the lock
+    try:
+        with unix_flock(lock, shared=True, timeout=RUNTIME_LOCK_TIMEOUT):
+            local_ver = _get_local_version(local, name)
+    except TimeoutError as e:
+        log.warning("%s, using the installed %s", e, variant)
+        return
+
+    if _version_tuple(remote_ver) <= _version_tuple(local_ver):
+        return
+
     with unix_flock(lock):
-        log.debug("Acquired file lock '%s'", lock)
         # Once another process acquires the lock, check if the latest
         # runtime has already been downloaded
-        with local.joinpath("VERSIONS.txt").open() as fd:
-            text = fd.readlines()
-        versions = _versions_dict(text)
-        local_ver = versions[name]
+        local_ver = _get_local_version(local, name)
         if _version_tuple(remote_ver) <= _version_tuple(local_ver):
-            log.debug("Released file lock '%s'", lock)
             return
         log.info("Updating %s to %s...", variant, remote_ver)
-        _install_umu(local, runtime_ver, remote_ver, session_pools)
-        log.debug("Released file lock '%s'", lock)
+        if not _update_umu_delta(
+            local, runtime_ver, local_ver, remote_ver, session_pools
+        ):
+            _install_umu(local, runtime_ver, remote_ver, session_pools)
+
+
+def _get_local_version(local: Path, name: str) -> str:
+    # Version of the installed runtime platform, by its VERSIONS.txt
+    with local.joinpath("VERSIONS.txt").open() as fd:
+        return _versions_dict(fd.readlines())[name]
+
+
+def _update_umu_delta(
+    local: Path,
+    runtime_ver: RuntimeVersion,
+    local_ver: str,
+    version: str,
+    session_pools: SessionPools,
+) -> bool:
+    """Update the runtime platform by applying a signed patch to the runtime.
+
+    Patches are resolved by the build ID of the latest runtime and are applied to
+    a copy of the runtime, which replaces the runtime once verified. Returns False
+    when no patch updates the installed runtime or when the patched runtime failed
+    verification, leaving the installed runtime untouched.
+    """
+    thread_pool, _ = session_pools
+    codename, variant, _ = runtime_ver
+    _codename: str = codename.removesuffix("-arm64")
+    build: tuple[str, str] = (
+        f"{_codename}_platform_{local_ver}",
+        f"{_codename}_platform_{version}",
+    )
+    journal: InstallJournal = InstallJournal(
+        local.parent.joinpath(f".{local.name}.journal")
+    )
+    patched: Path = local.parent.joinpath(f".{local.name}.patched")
+    retired: Path = local.parent.joinpath(f".{local.name}.retired")
+    patch: Path | None
+
+    # Skip if the opt dependencies are not installed
+    if not all(map(find_spec, ("cbor2", "pyzstd", "xxhash", "umu.umu_delta"))):
+        return False
+
+    # Prefer resuming an interrupted install, which shares the staging directory
+    if journal.step is not None:
+        return False
+
+    UMU_CACHE.mkdir(parents=True, exist_ok=True)
+    with TemporaryDirectory(dir=UMU_CACHE) as tmp:
+        try:
+            patch = _fetch_runtime_patch(runtime_ver, version, session_pools, Path(tmp))
+            if not patch:
+                log.debug("Found no patch for %s (%s), skipping", variant, version)
+                return False
+            with PatchFile(patch) as cbor, delta_process_pool() as process_pool:
+                builds: set[tuple[str, str]] = {
+                    (content["source"], content["target"])
+                    for content in cbor.contents
+                    if "_platform_" in content["source"]
+                }
+                if builds != {build}:
+                    log.debug("Patch does not update %s to %s, skipping", *build)
+                    return False
+                if not is_valid_patch(cbor):
+                    return False
+                # A previous update may have been interrupted before retiring
+                if patched.exists():
+                    retire_tree(patched, retired)
+                if not apply_delta_chain(
+                    local,
+                    [cbor],
+                    _get_runtime_content_root,
+                    thread_pool,
+                    process_pool,
+                    verify=lambda path: (
+                        not check_runtime(path, runtime_ver, force=True)
+                    ),
+                    budget=delta_memory_budget(),
+                    target=patched,
+                ):
+                    return False
+                # Sessions may still run the previous runtime, so retire it
+                log.debug("Exchanging: %s <-> %s", patched, local)
+                exchange(patched, local)
+                retire_tree(patched, retired)
+                return True
+        except (HTTPError, OSError, ValueError, IndexError, KeyError) as e:
+            log.exception(e)
+
+    return False
+
+
+def _fetch_runtime_patch(
+    runtime_ver: RuntimeVersion, version: str, session_pools: SessionPools, cache: Path
+) -> Path | None:
+    resp: BaseHTTPResponse
+    thread_pool, http_pool = session_pools
+    _, variant, _ = runtime_ver
+    host: str = "repo.steampowered.com"
+    endpoint: str = f"/{variant.removesuffix('-arm64')}/images/{version}"
+    url: str = "https://api.github.com"
+    repo: str = (
+        "/repos/Open-Wine-Components/umu-mkpatch/releases"
+        f"?per_page={RUNTIME_PATCH_RELEASES}"
+    )
+    headers: dict[str, str] = {
+        "Accept": "application/vnd.github+json",
+        "X-GitHub-Api-Version": "2022-11-28",
+        "User-Agent": "",
+    }
+
+    # Patches are named by the build ID of the runtime they update to
+    resp = http_pool.request(
+        HTTPMethod.GET.value, f"https://{host}{endpoint}/BUILD_ID.txt"
+    )
+    if resp.status != HTTPStatus.OK:
+        return None
+    name: str = f"{variant}-{resp.data.decode(encoding='utf-8').strip()}.cbor"
+
+    resp = http_pool.request(HTTPMethod.GET.value, f"{url}{repo}", headers=headers)
+    if resp.status != HTTPStatus.OK:
+        return None
+
+    for release in resp.json():
+        durl: str = find_patch_asset(release["assets"], name.removesuffix("cbor"))
+        if durl:
+            return download_patch(
+                http_pool,
+                durl,
+                headers,
+                cache.joinpath(name),
+                thread_pool=thread_pool,
+            )
+
+    return None
+
+
+def _get_runtime_content_root(path: Path, content: Content) -> Path | None:
+    # The platform is patched within its versioned directory (e.g.,
+    # sniper_platform_0.20240530.90143). Otherwise, relative to the runtime
+    if "_platform_" not in content["source"]:
+        return path
+    root: Path = path.joinpath(content["source"])
+    return root if root.is_dir() else None
 
 
 @dataclass
@@ -1,5 +1,9 @@
 import argparse
+import errno
+import gzip
 import hashlib
+import io
+import json
 import os
 import re
 import sys
@@ -8,13 +12,17 @@ import unittest
 from argparse import Namespace
 from array import array
 from collections.abc import Generator
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from importlib.util import find_spec
+from multiprocessing import get_context
 from pathlib import Path
 from pwd import getpwuid
-from shutil import copy, copytree, move, rmtree
-from subprocess import CompletedProcess  # nosec B404
+from shutil import copy, copytree, move, rmtree, which
+from subprocess import CompletedProcess, run  # nosec B404
 from tempfile import NamedTemporaryFile, TemporaryDirectory, TemporaryFile, gettempdir
+from threading import Event as ThreadingEvent
+from threading import Lock, Thread
+from time import sleep
 from unittest.mock import MagicMock, Mock, patch
 
 from Xlib.display import Display
@@ -25,7 +33,18 @@ from Xlib.xobject.drawable import Window
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from umu import __main__, umu_proton, umu_run, umu_runtime, umu_util, vdf
+from umu import (
+    __main__,
+    umu_bspatch,
+    umu_index,
+    umu_mkpatch,
+    umu_plan,
+    umu_proton,
+    umu_run,
+    umu_runtime,
+    umu_util,
+    vdf,
+)
 
 
 class TestGameLauncher(unittest.TestCase):
@@ -827,6 +846,35 @@ class TestGameLauncher(unittest.TestCase):
                 f"Expected {Path(file1, 'bar')} to not exist.",
             )
 
+    def test_link_file(self):
+        """Test link_file."""
+        with TemporaryDirectory() as file:
+            Path(file, "foo").write_text("foo")
+
+            result = umu_util.link_file(str(Path(file, "foo")), str(Path(file, "bar")))
+
+            self.assertEqual(result, str(Path(file, "bar")))
+            self.assertTrue(
+                Path(file, "foo").samefile(Path(file, "bar")),
+                "Expected the file to be linked",
+            )
+
+    def test_link_file_xdev(self):
+        """Test link_file when the file cannot be linked."""
+        with (
+            TemporaryDirectory() as file,
+            patch.object(os, "link", side_effect=OSError(errno.EXDEV, "foo")),
+        ):
+            Path(file, "foo").write_text("foo")
+
+            umu_util.link_file(str(Path(file, "foo")), str(Path(file, "bar")))
+
+            self.assertEqual(Path(file, "bar").read_text(), "foo")
+            self.assertFalse(
+                Path(file, "foo").samefile(Path(file, "bar")),
+                "Expected the file to be copied",
+            )
+
     def test_renameat2(self):
         """Test renameat2."""
         with TemporaryDirectory() as file1, TemporaryDirectory() as file2:
@@ -948,10 +996,63 @@ class TestGameLauncher(unittest.TestCase):
         result = umu_util.get_tempdir(Path(gettempdir()))
         self.assertTrue(isinstance(result, Path), f"Expected '{result}' to be a Path")
 
+    def test_get_io_order(self):
+        """Test get_io_order by the storage of a path and UMU_IO_ORDER.
+
+        Expects files to be read by their extents only on rotational storage, unless
+        an order is set.
+        """
+        path = Path(gettempdir())
+
+        with patch.object(umu_util, "_is_rotational", return_value=True):
+            result = umu_util.get_io_order(path)
+            self.assertEqual(result, umu_util.IOOrder.Extent, "Expected extents")
+            result = umu_util.get_io_order(path.joinpath("foo"))
+            self.assertEqual(result, umu_util.IOOrder.Off, "Expected no order")
+            with patch.dict(os.environ, {"UMU_IO_ORDER": "off"}):
+                result = umu_util.get_io_order(path)
+                self.assertEqual(result, umu_util.IOOrder.Off, "Expected no order")
+            with patch.dict(os.environ, {"UMU_IO_ORDER": "foo"}):
+                result = umu_util.get_io_order(path)
+                self.assertEqual(result, umu_util.IOOrder.Extent, "Expected auto")
+
+        with (
+            patch.object(umu_util, "_is_rotational", return_value=False),
+            patch.dict(os.environ, {"UMU_IO_ORDER": "inode"}),
+        ):
+            result = umu_util.get_io_order(path)
+            self.assertEqual(result, umu_util.IOOrder.Inode, "Expected inodes")
+            with patch.dict(os.environ, {"UMU_IO_ORDER": "auto"}):
+                result = umu_util.get_io_order(path)
+                self.assertEqual(result, umu_util.IOOrder.Off, "Expected no order")
+
+    def test_get_layout_key(self):
+        """Test get_layout_key when FIEMAP is unsupported and for links.
+
+        Expects the inode number of the file, without following links, and 0 for a
+        file that does not exist.
+        """
+        with TemporaryDirectory() as file:
+            foo = Path(file, "foo")
+            foo.write_bytes(b"foo")
+            Path(file, "bar").symlink_to(foo)
+
+            with patch.object(umu_util, "ioctl", side_effect=OSError):
+                result = umu_util.get_layout_key(foo, umu_util.IOOrder.Extent)
+            self.assertEqual(result, foo.stat().st_ino, "Expected the inode number")
+
+            result = umu_util.get_layout_key(Path(file, "bar"), umu_util.IOOrder.Extent)
+            self.assertEqual(
+                result, Path(file, "bar").lstat().st_ino, "Expected the link's inode"
+            )
+
+            result = umu_util.get_layout_key(Path(file, "baz"), umu_util.IOOrder.Inode)
+            self.assertEqual(result, 0, "Expected 0 for a missing file")
+
     def test_fetch_patch_url_req(self):
         """Test _fetch_patch when the second request fails.
 
-        Expects an empty byte string.
+        Expects None.
         """
         result = None
         expected = "bar"
@@ -987,8 +1088,8 @@ class TestGameLauncher(unittest.TestCase):
         mock_hp = MagicMock()
         mock_hp.request.side_effect = [mock_resp, mock_resp2]
 
-        result = umu_proton._fetch_patch((mock_tp, mock_hp))
-        self.assertEqual(b"", result, f"Expected {expected}, receieved {result}")
+        result = umu_proton._fetch_patch((mock_tp, mock_hp), self.test_cache)
+        self.assertIsNone(result, f"Expected None, received {result}")
 
         # UMU-Latest codename
         result = None
@@ -1009,17 +1110,17 @@ class TestGameLauncher(unittest.TestCase):
         mock_hp = MagicMock()
         mock_hp.request.side_effect = [mock_resp, mock_resp2]
 
-        result = umu_proton._fetch_patch((mock_tp, mock_hp))
-        self.assertEqual(b"", result, f"Expected {expected}, receieved {result}")
+        result = umu_proton._fetch_patch((mock_tp, mock_hp), self.test_cache)
+        self.assertIsNone(result, f"Expected None, received {result}")
 
     def test_fetch_patch(self):
         """Test _fetch_patch on success.
 
-        Expects a non-empty byte string to be returned. In practice, the return
-        value is the CBOR data.
+        Expects the path to the downloaded patch to be returned. In practice, the
+        file contains the CBOR data.
         """
         result = None
-        expected = "bar"
+        expected = b"bar"
         mock_gh_release = {
             "assets": [
                 {"name": "GE-Latest.cbor", "browser_download_url": "foo"},
@@ -1031,35 +1132,42 @@ class TestGameLauncher(unittest.TestCase):
             err = "delta dependencies not installed"
             self.skipTest(err)
 
-        os.environ["PROTONPATH"] = "GE-Latest"
-
-        # Mock the response
-        mock_resp = MagicMock()
-        mock_resp.status = 200
-        mock_resp.json.return_value = mock_gh_release
-        mock_resp.data = expected
+        for codename in ("GE-Latest", "UMU-Latest"):
+            os.environ["PROTONPATH"] = codename
 
-        # Mock the thread pool
-        mock_tp = MagicMock()
+            # Mock the response
+            mock_resp = MagicMock()
+            mock_resp.status = 200
+            mock_resp.json.return_value = mock_gh_release
 
-        # Mock the call to http pool
-        mock_hp = MagicMock()
-        mock_hp.request.return_value = mock_resp
+            # Mock the patch's streamed response
+            mock_resp2 = MagicMock()
+            mock_resp2.status = 200
+            mock_resp2.readinto = io.BytesIO(expected).readinto
 
-        result = umu_proton._fetch_patch((mock_tp, mock_hp))
-        self.assertEqual(expected, result, f"Expected {expected}, receieved {result}")
+            # Mock the thread pool
+            mock_tp = MagicMock()
 
-        # UMU-Latest codename
-        result = None
-        os.environ["PROTONPATH"] = "UMU-Latest"
+            # Mock the call to http pool
+            mock_hp = MagicMock()
+            mock_hp.request.side_effect = [mock_resp, mock_resp2]
 
-        result = umu_proton._fetch_patch((mock_tp, mock_hp))
-        self.assertEqual(expected, result, f"Expected {expected}, receieved {result}")
+            result = umu_proton._fetch_patch((mock_tp, mock_hp), self.test_cache)
+            self.assertEqual(
+                self.test_cache.joinpath(f"{codename}.cbor"),
+                result,
+                f"Expected the patch in the cache, received {result}",
+            )
+            self.assertEqual(
+                expected,
+                result.read_bytes(),
+                f"Expected {expected}, receieved {result.read_bytes()}",
+            )
 
     def test_fetch_patch_no_names(self):
         """Test _fetch_patch for invalid GitHub assets.
 
-        Expects empty byte string to be returned when unable to find
+        Expects None to be returned when unable to find
         assets that do not have a .cbor suffix or do not begin with a
         codename (e.g., GE-Latest).
         """
@@ -1089,20 +1197,20 @@ class TestGameLauncher(unittest.TestCase):
         mock_hp = MagicMock()
         mock_hp.request.return_value = mock_resp
 
-        result = umu_proton._fetch_patch((mock_tp, mock_hp))
-        self.assertEqual(b"", result, f"Expected empty bytes, receieved {result}")
+        result = umu_proton._fetch_patch((mock_tp, mock_hp), self.test_cache)
+        self.assertIsNone(result, f"Expected None, received {result}")
 
         # UMU-Latest codename
         result = None
         os.environ["PROTONPATH"] = "UMU-Latest"
 
-        result = umu_proton._fetch_patch((mock_tp, mock_hp))
-        self.assertEqual(b"", result, f"Expected empty bytes, receieved {result}")
+        result = umu_proton._fetch_patch((mock_tp, mock_hp), self.test_cache)
+        self.assertIsNone(result, f"Expected None, received {result}")
 
     def test_fetch_patch_none(self):
         """Test _fetch_patch on request failure.
 
-        Expects an empty byte string.
+        Expects None.
         """
         result = None
         mock_gh_release = {
@@ -1130,20 +1238,20 @@ class TestGameLauncher(unittest.TestCase):
         mock_hp = MagicMock()
         mock_hp.request.return_value = mock_resp
 
-        result = umu_proton._fetch_patch((mock_tp, mock_hp))
-        self.assertEqual(b"", result, f"Expected empty bytes, receieved {result}")
+        result = umu_proton._fetch_patch((mock_tp, mock_hp), self.test_cache)
+        self.assertIsNone(result, f"Expected None, received {result}")
 
         # UMU-Latest codename
         result = None
         os.environ["PROTONPATH"] = "UMU-Latest"
 
-        result = umu_proton._fetch_patch((mock_tp, mock_hp))
-        self.assertEqual(b"", result, f"Expected empty bytes, receieved {result}")
+        result = umu_proton._fetch_patch((mock_tp, mock_hp), self.test_cache)
+        self.assertIsNone(result, f"Expected None, received {result}")
 
     def test_fetch_patch_missing_deps(self):
         """Test _fetch_patch when optional deps are missing.
 
-        Expects an empty byte string.
+        Expects None.
         """
         result = None
         os.environ["PROTONPATH"] = "GE-Latest"
@@ -1153,21 +1261,21 @@ class TestGameLauncher(unittest.TestCase):
             self.skipTest(err)
 
         with patch.object(umu_proton, "find_spec", return_value=False):
-            result = umu_proton._fetch_patch(self.test_session_pools)
-        self.assertEqual(b"", result, f"Expected empty bytes, receieved {result}")
+            result = umu_proton._fetch_patch(self.test_session_pools, self.test_cache)
+        self.assertIsNone(result, f"Expected None, received {result}")
 
         # UMU-Latest codename
         result = None
         os.environ["PROTONPATH"] = "UMU-Latest"
 
         with patch.object(umu_proton, "find_spec", return_value=False):
-            result = umu_proton._fetch_patch(self.test_session_pools)
-        self.assertEqual(b"", result, f"Expected empty bytes, receieved {result}")
+            result = umu_proton._fetch_patch(self.test_session_pools, self.test_cache)
+        self.assertIsNone(result, f"Expected None, received {result}")
 
     def test_fetch_patch_no_latest(self):
         """Test _fetch_patch when PROTONPATH is not set or invalid.
 
-        Expects an empty byte string.
+        Expects None.
         """
         result = None
 
@@ -1175,14 +1283,14 @@ class TestGameLauncher(unittest.TestCase):
         if find_spec("cbor2") is None or find_spec("xxhash") is None:
             err = "delta dependencies not installed"
             self.skipTest(err)
-        result = umu_proton._fetch_patch(self.test_session_pools)
-        self.assertEqual(b"", result, f"Expected empty bytes, receieved {result}")
+        result = umu_proton._fetch_patch(self.test_session_pools, self.test_cache)
+        self.assertIsNone(result, f"Expected None, received {result}")
 
         # PROTONPATH set
         result = None
         os.environ["PROTONPATH"] = "foo-Latest"
-        result = umu_proton._fetch_patch(self.test_session_pools)
-        self.assertEqual(b"", result, f"Expected empty bytes, receieved {result}")
+        result = umu_proton._fetch_patch(self.test_session_pools, self.test_cache)
+        self.assertIsNone(result, f"Expected None, received {result}")
 
     def test_get_delta_invalid_sig(self):
         """Test get_delta when patch signature is invalid."""
@@ -1201,12 +1309,15 @@ class TestGameLauncher(unittest.TestCase):
             err = "umu_delta module not compiled"
             self.skipTest(err)
 
-        mock_patch = dumps(
-            {
-                "public_key": ["foo", "bar"],
-                "signature": [b"bar", b"foo"],
-                "contents": ["baz"],
-            }
+        mock_patch = self.test_cache.joinpath("UMU-Latest.cbor")
+        mock_patch.write_bytes(
+            dumps(
+                {
+                    "public_key": ["foo", "bar"],
+                    "signature": [b"bar", b"foo"],
+                    "contents": ["baz"],
+                }
+            )
         )
         mock_ctx = MagicMock()
         mock_ctx.__enter__ = MagicMock(return_value=None)
@@ -1254,7 +1365,8 @@ class TestGameLauncher(unittest.TestCase):
             err = "umu_delta module not compiled"
             self.skipTest(err)
 
-        mock_patch = dumps({"public_key": ["foo", "bar"]})
+        mock_patch = self.test_cache.joinpath("UMU-Latest.cbor")
+        mock_patch.write_bytes(dumps({"public_key": ["foo", "bar"]}))
         mock_ctx = MagicMock()
         mock_ctx.__enter__ = MagicMock(return_value=None)
         mock_ctx.__exit__ = MagicMock(return_value=None)
@@ -1301,7 +1413,8 @@ class TestGameLauncher(unittest.TestCase):
             err = "umu_delta module not compiled"
             self.skipTest(err)
 
-        mock_patch = dumps({"foo": "foo"})
+        mock_patch = self.test_cache.joinpath("UMU-Latest.cbor")
+        mock_patch.write_bytes(dumps({"foo": "foo"}))
         mock_ctx = MagicMock()
         mock_ctx.__enter__ = MagicMock(return_value=None)
         mock_ctx.__exit__ = MagicMock(return_value=None)
@@ -1359,7 +1472,8 @@ class TestGameLauncher(unittest.TestCase):
             err = "umu_delta module not compiled"
             self.skipTest(err)
 
-        mock_patch = dumps({"foo": "foo"})
+        mock_patch = self.test_cache.joinpath("UMU-Latest.cbor")
+        mock_patch.write_bytes(dumps({"foo": "foo"}))
         mock_ctx = MagicMock()
         mock_ctx.__enter__ = MagicMock(return_value=None)
         mock_ctx.__exit__ = MagicMock(return_value=None)
@@ -1380,7 +1494,8 @@ class TestGameLauncher(unittest.TestCase):
 
     def test_get_delta_cbor_err(self):
         """Test get_delta when parsing invalid CBOR."""
-        mock_patch = b"foo"
+        mock_patch = self.test_cache.joinpath("UMU-Latest.cbor")
+        mock_patch.write_bytes(b"foo")
         mock_assets = (("foo", "foo"), ("foo", "foo"))
         os.environ["PROTONPATH"] = umu_proton.ProtonVersion.UMULatest.value
 
@@ -1403,7 +1518,8 @@ class TestGameLauncher(unittest.TestCase):
 
     def test_get_delta_no_latest(self):
         """Test get_delta when parsing invalid CBOR."""
-        mock_patch = b"foo"
+        mock_patch = self.test_cache.joinpath("UMU-Latest.cbor")
+        mock_patch.write_bytes(b"foo")
         mock_assets = (("foo", "foo"), ("foo", "foo"))
         # Empty string is not a valid code name
         os.environ["PROTONPATH"] = ""
@@ -1419,7 +1535,7 @@ class TestGameLauncher(unittest.TestCase):
 
     def test_get_delta_no_patch(self):
         """Test get_delta for empty or absent patch data."""
-        mock_patch = b""
+        mock_patch = None
         mock_assets = (("foo", "foo"), ("foo", "foo"))
         os.environ["PROTONPATH"] = umu_proton.ProtonVersion.UMULatest.value
 
@@ -1434,7 +1550,7 @@ class TestGameLauncher(unittest.TestCase):
 
     def test_get_delta_no_assets(self):
         """Test get_delta when no GH assets are returned."""
-        mock_patch = b""
+        mock_patch = None
         mock_assets = ()
 
         result = umu_proton._get_delta(
@@ -1446,75 +1562,2050 @@ class TestGameLauncher(unittest.TestCase):
         )
         self.assertTrue(result is None, f"Expected None, received {result}")
 
-    def test_main_nomusl(self):
-        """Test __main__.main to ensure an exit when on a musl-based system."""
-        os.environ["LD_LIBRARY_PATH"] = f"{os.environ['LD_LIBRARY_PATH']}:musl"
+    def test_patch_file(self):
+        """Test PatchFile when decoding the sections of a patch lazily."""
+        try:
+            from cbor2 import dumps
+        except ModuleNotFoundError:
+            err = "python3-cbor2 not installed"
+            self.skipTest(err)
+
+        contents = [
+            {
+                "manifest": [
+                    {"name": "foo", "mode": 33188, "xxhash": 1, "size": 3, "time": 0.0}
+                ],
+                "add": [
+                    {
+                        "name": "bar",
+                        "data": b"baz" * 1024,
+                        "type": "file",
+                        "mode": 33188,
+                        "xxhash": 2,
+                        "time": 0.0,
+                        "size": 3072,
+                    }
+                ],
+                "update": [],
+                "delete": [{"name": "qux", "type": "link"}],
+                "source": "UMU-Proton-9.0-3",
+                "target": "UMU-Proton-9.0-4",
+            }
+        ]
+        mock_patch = self.test_cache.joinpath("UMU-Latest.cbor")
+        mock_patch.write_bytes(
+            dumps(
+                {
+                    "public_key": ["foo", "bar"],
+                    "contents": contents,
+                    "signature": [b"bar", b"foo"],
+                }
+            )
+        )
+
+        with umu_bspatch.PatchFile(mock_patch) as cbor:
+            self.assertEqual(cbor.public_key, ["foo", "bar"])
+            self.assertEqual(cbor.signature, [b"bar", b"foo"])
+            self.assertEqual(
+                cbor.raw_contents,
+                dumps(contents),
+                "Expected the contents as encoded in the patch",
+            )
+            self.assertEqual(
+                cbor.canonical_contents,
+                dumps(contents, canonical=True),
+                "Expected the contents in canonical encoding",
+            )
+            for result, content in zip(cbor.contents, contents):
+                for section in ("manifest", "add", "update", "delete"):
+                    self.assertEqual(
+                        list(result[section]),
+                        content[section],
+                        f"Expected the entries of section '{section}'",
+                    )
+                self.assertEqual(result["source"], content["source"])
+                self.assertEqual(result["target"], content["target"])
+
+    def test_patch_file_indefinite(self):
+        """Test PatchFile when the patch has indefinite-length items."""
+        # {"contents": [_ [_ 1, (_ h'61')]], "public_key": 1000(2)}
+        mock_patch = self.test_cache.joinpath("UMU-Latest.cbor")
+        mock_patch.write_bytes(
+            b"\xa2\x68contents\x9f\x9f\x01\x5f\x41\x61\xff\xff\xff"
+            b"\x6apublic_key\xd9\x03\xe8\x02"
+        )
+
+        if find_spec("cbor2") is None:
+            err = "python3-cbor2 not installed"
+            self.skipTest(err)
+
+        with umu_bspatch.PatchFile(mock_patch) as cbor:
+            self.assertEqual(
+                cbor.raw_contents,
+                b"\x9f\x9f\x01\x5f\x41\x61\xff\xff\xff",
+                "Expected the contents to end after their 'break' stop code",
+            )
+            self.assertEqual(cbor.public_key.tag, 1000, "Expected the tagged value")
+
+    def test_patch_file_truncated(self):
+        """Test PatchFile when the patch is truncated."""
+        mock_patch = self.test_cache.joinpath("UMU-Latest.cbor")
+        mock_patch.write_bytes(b"\xa1\x68contents\x59\xff\xff")
+
+        with self.assertRaises(ValueError):
+            umu_bspatch.PatchFile(mock_patch)
+
+    def test_digest_cache(self):
+        """Test DigestCache when recording and reloading digests of files."""
+        path = self.test_cache.joinpath("xxh3.json")
+        file = self.test_cache.joinpath("foo")
+        file.write_text("foo")
+        key = umu_bspatch._digest_key(file.stat())
+
+        with umu_bspatch.DigestCache(path) as cache:
+            self.assertIsNone(cache.get(key), "Expected no digest")
+            future = Future()
+            future.set_result((key, 1))
+            cache.record(future)
+            self.assertEqual(cache.get(key), 1, "Expected the digest")
+
+        self.assertTrue(path.is_file(), "Expected the cache to be saved")
+        self.assertFalse(
+            list(path.parent.glob(f".{path.name}.*")), "Expected no temporary file"
+        )
+        cache = umu_bspatch.DigestCache(path)
+        self.assertEqual(cache.get(key), 1, "Expected the digest to be persisted")
+
+        # Any change to the metadata invalidates the digest
+        file.write_text("bar")
+        self.assertIsNone(
+            cache.get(umu_bspatch._digest_key(file.stat())),
+            "Expected no digest for a modified file",
+        )
+
+    def test_digest_cache_keep(self):
+        """Test DigestCache when removing links to cached files.
+
+        Expects the digests of unchanged files to be kept.
+        """
+        root = self.test_cache.joinpath("UMU-Proton-9.0-4")
+        root.mkdir()
+        root.joinpath("foo").write_text("foo")
+        root.joinpath("bar").write_text("bar")
+        self.test_cache.joinpath("UMU-Proton-9.0-3").mkdir()
+        for name in ("foo", "bar"):
+            os.link(root / name, self.test_cache.joinpath("UMU-Proton-9.0-3", name))
+        cache = umu_bspatch.DigestCache(self.test_cache.joinpath("xxh3.json"))
+        cache.set(umu_bspatch._digest_key(root.joinpath("foo").stat()), 1)
+        cache.set(umu_bspatch._digest_key(root.joinpath("bar").stat()), 2)
+
+        with cache.keep(root):
+            rmtree(self.test_cache.joinpath("UMU-Proton-9.0-3"))
+            root.joinpath("bar").write_text("barbaz")
+
+        self.assertEqual(
+            cache.get(umu_bspatch._digest_key(root.joinpath("foo").stat())),
+            1,
+            "Expected the digest of the unchanged file",
+        )
+        self.assertIsNone(
+            cache.get(umu_bspatch._digest_key(root.joinpath("bar").stat())),
+            "Expected no digest for a modified file",
+        )
+
+    def test_digest_cache_invalid(self):
+        """Test DigestCache when the cache is not a JSON object."""
+        path = self.test_cache.joinpath("xxh3.json")
+        path.write_text("[]")
+
+        cache = umu_bspatch.DigestCache(path)
+
+        self.assertIsNone(cache.get((0, 0, 0, 0, 0)), "Expected an empty cache")
+
+    def test_write_proton_file_windows(self):
+        """Test CustomPatcher when writing a file in windows.
+
+        Expects the file to be decompressed in windows and replaced only when
+        its data is valid.
+        """
+        try:
+            from pyzstd import compress
+            from xxhash import xxh3_64_intdigest
+        except ModuleNotFoundError:
+            err = "delta dependencies not installed"
+            self.skipTest(err)
+
+        data = bytes(range(256)) * 64
+        path = self.test_umu_compat.joinpath("foo")
+        path.write_bytes(b"foo")
+        item = {
+            "name": "foo",
+            "data": compress(data),
+            "type": "file",
+            "mode": 0o100755,
+            "xxhash": xxh3_64_intdigest(data),
+            "time": 0.0,
+            "size": len(data),
+        }
+
+        with patch.object(umu_bspatch, "DECOMPRESS_WINDOW", 1000):
+            key, xxhash = umu_bspatch.CustomPatcher._write_proton_file(path, item)
+
+        self.assertEqual(path.read_bytes(), data, "Expected the decompressed data")
+        self.assertEqual(xxhash, item["xxhash"], "Expected the digest of the file")
+        self.assertEqual(key, umu_bspatch._digest_key(path.stat()))
+        self.assertEqual(path.stat().st_mode, item["mode"], "Expected the mode")
+
+        # Truncated data
+        item["data"] = item["data"][:-8]
+        with self.assertRaises(ValueError):
+            umu_bspatch.CustomPatcher._write_proton_file(path, item)
+        self.assertEqual(path.read_bytes(), data, "Expected the file unchanged")
+        self.assertEqual(
+            list(self.test_umu_compat.glob(".foo.*")), [], "Expected no temp file"
+        )
+
+    def test_custom_patcher_cached(self):
+        """Test CustomPatcher when verifying files with a digest cache.
+
+        Expects only the files without a digest in the cache to be read, and their
+        digests to be recorded.
+        """
+        try:
+            from xxhash import xxh3_64_intdigest
+        except ModuleNotFoundError:
+            err = "python3-xxhash not installed"
+            self.skipTest(err)
+
+        proton = self.test_umu_compat.joinpath("UMU-Latest")
+        proton.mkdir()
+        manifest = []
+        for name in ("foo", "bar"):
+            proton.joinpath(name).write_text(name)
+            manifest.append(
+                {
+                    "name": name,
+                    "mode": proton.joinpath(name).stat().st_mode,
+                    "xxhash": xxh3_64_intdigest(name.encode()),
+                    "size": 3,
+                    "time": 0.0,
+                }
+            )
+        content = {
+            "manifest": manifest,
+            "add": [],
+            "update": [],
+            "delete": [],
+            "source": "UMU-Proton-9.0-3",
+            "target": "UMU-Proton-9.0-4",
+        }
+        cache = umu_bspatch.DigestCache(self.test_cache.joinpath("xxh3.json"))
+        cache.set(
+            umu_bspatch._digest_key(proton.joinpath("foo").stat()),
+            manifest[0]["xxhash"],
+        )
+
         with (
+            ThreadPoolExecutor() as thread_pool,
             patch.object(
-                __main__,
-                "parse_args",
-                return_value=["foo", "foo"],
+                umu_bspatch.CustomPatcher,
+                "_check_binaries",
+                wraps=umu_bspatch.CustomPatcher._check_binaries,
+            ) as mock_check,
+        ):
+            patcher = umu_bspatch.CustomPatcher(
+                content, proton, thread_pool, cache=cache
+            )
+            patcher.verify_integrity()
+            self.assertTrue(umu_bspatch.wait_patcher(patcher))
+
+        mock_check.assert_called_once_with(proton, manifest[1])
+        self.assertEqual(
+            cache.get(umu_bspatch._digest_key(proton.joinpath("bar").stat())),
+            manifest[1]["xxhash"],
+            "Expected the digest of the read file to be recorded",
+        )
+
+    def test_task_graph(self):
+        """Test TaskGraph when running tasks with dependencies.
+
+        Expects the most costly tasks to run first, after their dependencies.
+        """
+        order = []
+
+        with ThreadPoolExecutor(max_workers=1) as thread_pool:
+            graph = umu_bspatch.TaskGraph(thread_pool, pending_max=1)
+            first = graph.add("foo: 0", order.append, 0)
+            for i in range(1, 4):
+                graph.add(f"bar: {i}", order.append, i, cost=i, deps=(first,))
+            graph.add("baz: 4", order.append, 4, cost=100)
+            result = graph.run()
+
+        self.assertTrue(result, "Expected every task to complete")
+        self.assertEqual(order, [4, 0, 3, 2, 1], "Expected the costly tasks first")
+        self.assertEqual(
+            [name for name, _ in graph.timings],
+            ["foo: 0", "bar: 1", "bar: 2", "bar: 3", "baz: 4"],
+            "Expected the timing of each task",
+        )
+
+    def test_task_graph_failed(self):
+        """Test TaskGraph when a task fails.
+
+        Expects the tasks depending on it to not run.
+        """
+        mock_fn = MagicMock()
+
+        with ThreadPoolExecutor() as thread_pool:
+            graph = umu_bspatch.TaskGraph(thread_pool)
+            failed = graph.add("foo", MagicMock(side_effect=OSError))
+            graph.add("bar", mock_fn, deps=(failed,))
+            result = graph.run()
+
+        self.assertFalse(result, "Expected the graph to fail")
+        mock_fn.assert_not_called()
+
+    def test_task_graph_error(self):
+        """Test TaskGraph when a task raises an error other than OSError.
+
+        Expects the graph to fail, and the tasks still pending to be cancelled.
+        """
+        mock_fn = MagicMock()
+        release = ThreadingEvent()
+
+        with (
+            ThreadPoolExecutor() as thread_pool,
+            ThreadPoolExecutor(max_workers=1) as busy_pool,
+        ):
+            graph = umu_bspatch.TaskGraph(thread_pool)
+            # Occupy the only worker, so the next task is pending
+            graph.add("bar", release.wait, 0.2, cost=3, executor=busy_pool)
+            graph.add("baz", mock_fn, cost=2, executor=busy_pool)
+            graph.add("foo", MagicMock(side_effect=KeyError("xxhash")), cost=1)
+            result = graph.run()
+
+        self.assertFalse(result, "Expected the graph to fail")
+        mock_fn.assert_not_called()
+
+    def test_task_graph_budget(self):
+        """Test TaskGraph when running tasks within a byte budget.
+
+        Expects the tasks to hold no more bytes at once than the budget.
+        """
+        budget = umu_bspatch.ByteBudget(10)
+        lock = Lock()
+        running = []
+        held = []
+
+        def fn(size):
+            with lock:
+                running.append(size)
+                held.append(sum(running))
+            sleep(0.01)
+            with lock:
+                running.remove(size)
+
+        with ThreadPoolExecutor(max_workers=4) as thread_pool:
+            graph = umu_bspatch.TaskGraph(thread_pool, budget=budget)
+            for i in range(8):
+                graph.add(f"foo: {i}", fn, 6, memory=6)
+            graph.add("bar", fn, 100, memory=100)
+            result = graph.run()
+
+        self.assertTrue(result, "Expected every task to complete")
+        self.assertEqual(len(held), 9, "Expected every task to run")
+        self.assertEqual(max(held[:-1]), 6, "Expected one task at a time")
+        self.assertEqual(held[-1], 100, "Expected the large task to run alone")
+        self.assertEqual(budget.peak, 10, "Expected the peak to be the budget")
+
+    def test_task_graph_ordered(self):
+        """Test TaskGraph when running tasks by the location of their files.
+
+        Expects the tasks reading files to run by their key once ready, regardless
+        of their cost, and tasks without files to run first.
+        """
+        order = []
+        keys = {"foo": 3, "bar": 1, "baz": 2}
+
+        with (
+            ThreadPoolExecutor(max_workers=1) as thread_pool,
+            patch.object(
+                umu_bspatch,
+                "get_layout_key",
+                side_effect=lambda path, _: keys[path.name],
             ),
-            self.assertRaises(SystemExit),
         ):
-            __main__.main()
+            graph = umu_bspatch.TaskGraph(
+                thread_pool, pending_max=1, order=umu_util.IOOrder.Inode
+            )
+            first = graph.add("qux", order.append, "qux")
+            for i, name in enumerate(keys):
+                graph.add(
+                    f"check: {name}",
+                    order.append,
+                    name,
+                    cost=i,
+                    deps=(first,),
+                    path=Path(name),
+                )
+            graph.add("quux", order.append, "quux", cost=100, path=Path("foo"))
+            graph.add("corge", order.append, "corge")
+            result = graph.run()
+
+        self.assertTrue(result, "Expected every task to complete")
+        self.assertEqual(
+            order,
+            ["qux", "corge", "bar", "baz", "quux", "foo"],
+            "Expected the tasks by the location of their files",
+        )
+
+    def test_byte_budget(self):
+        """Test ByteBudget when admitting and releasing bytes."""
+        budget = umu_bspatch.ByteBudget(10)
+
+        self.assertTrue(budget.acquire(4), "Expected 4 bytes to be admitted")
+        self.assertFalse(
+            budget.acquire(7, blocking=False), "Expected 7 bytes to exceed the budget"
+        )
+        self.assertTrue(budget.acquire(6, blocking=False), "Expected 6 bytes")
+        budget.release(4)
+        budget.release(6)
+        self.assertTrue(
+            budget.acquire(1 << 20, blocking=False),
+            "Expected more bytes than the budget to be admitted alone",
+        )
+        self.assertEqual(budget.peak, 10, "Expected the peak to be the budget")
+
+    def test_delta_memory_budget(self):
+        """Test delta_memory_budget when set by the user."""
+        with patch.dict(os.environ, {"UMU_DELTA_MEMORY": "0"}):
+            self.assertIsNone(umu_bspatch.delta_memory_budget(), "Expected no budget")
+        with patch.dict(os.environ, {"UMU_DELTA_MEMORY": "1"}):
+            budget = umu_bspatch.delta_memory_budget()
+            self.assertTrue(budget.acquire(1 << 20, blocking=False))
+            self.assertFalse(budget.acquire(1, blocking=False), "Expected 1 MiB")
+        for value in ("1G", "-1"):
+            with patch.dict(os.environ, {"UMU_DELTA_MEMORY": value}):
+                budget = umu_bspatch.delta_memory_budget()
+                self.assertTrue(
+                    budget.acquire(umu_bspatch.DELTA_MEMORY_MAX << 20, blocking=False)
+                )
+                self.assertFalse(
+                    budget.acquire(1, blocking=False), "Expected the default"
+                )
+
+    def test_custom_patcher_add(self):
+        """Test CustomPatcher when adding files from a patch decoded lazily."""
+        try:
+            from cbor2 import dumps
+            from pyzstd import compress
+            from xxhash import xxh3_64_intdigest
+        except ModuleNotFoundError:
+            err = "delta dependencies not installed"
+            self.skipTest(err)
+
+        entries = [
+            {
+                "name": f"foo{i}",
+                "data": compress(bytes([i]) * 4096),
+                "type": "file",
+                "mode": 0o100644,
+                "xxhash": xxh3_64_intdigest(bytes([i]) * 4096),
+                "time": 0.0,
+                "size": 4096,
+            }
+            for i in range(umu_bspatch.PATCH_PENDING_MAX * 2)
+        ]
+        contents = [
+            {
+                "manifest": [],
+                "add": entries,
+                "update": [],
+                "delete": [],
+                "source": "UMU-Proton-9.0-3",
+                "target": "UMU-Proton-9.0-4",
+            }
+        ]
+        mock_patch = self.test_cache.joinpath("UMU-Latest.cbor")
+        mock_patch.write_bytes(dumps({"contents": contents}))
+        self.test_umu_compat.joinpath("UMU-Latest").mkdir(parents=True, exist_ok=True)
+
+        with (
+            umu_bspatch.PatchFile(mock_patch) as cbor,
+            ThreadPoolExecutor() as thread_pool,
+        ):
+            patcher = umu_bspatch.CustomPatcher(
+                cbor.contents[0],
+                self.test_umu_compat.joinpath("UMU-Latest"),
+                thread_pool,
+            )
+            patcher.add_binaries()
+            _, futures, *_ = patcher.result()
+            for future in futures:
+                future.result()
+
+        for i, entry in enumerate(entries):
+            self.assertEqual(
+                self.test_umu_compat.joinpath("UMU-Latest", entry["name"]).read_bytes(),
+                bytes([i]) * 4096,
+                f"Expected '{entry['name']}' to be written",
+            )
+
+    def test_custom_patcher_process(self):
+        """Test CustomPatcher when applying a patch file within a process pool.
+
+        Expects the same result as when applied within a thread pool.
+        """
+        try:
+            from cbor2 import dumps
+            from pyzstd import ZstdDict, compress
+            from xxhash import xxh3_64_intdigest
+        except ModuleNotFoundError:
+            err = "delta dependencies not installed"
+            self.skipTest(err)
+
+        source = bytes(range(256)) * 64
+        target = source[:8192] + b"foo" + source[8192:]
+        # Write the file to apply the binary patch against
+        self.test_umu_compat.joinpath("foo").write_bytes(source)
+        self.test_umu_compat.joinpath("foo").chmod(0o644)
+        contents = [
+            {
+                "manifest": [
+                    {
+                        "name": "foo",
+                        "mode": self.test_umu_compat.joinpath("foo").stat().st_mode,
+                        "xxhash": xxh3_64_intdigest(source),
+                        "size": len(source),
+                        "time": 0.0,
+                    }
+                ],
+                "add": [
+                    {
+                        "name": "bar",
+                        "data": compress(b"bar" * 1024),
+                        "type": "file",
+                        "mode": 0o100644,
+                        "xxhash": xxh3_64_intdigest(b"bar" * 1024),
+                        "time": 0.0,
+                        "size": 3072,
+                    },
+                    {"name": "baz", "data": "bar", "type": "link"},
+                ],
+                "update": [
+                    {
+                        "name": "foo",
+                        "data": compress(
+                            target, zstd_dict=ZstdDict(source, is_raw=True).as_prefix
+                        ),
+                        "type": "file",
+                        "mode": 0o100755,
+                        "xxhash": xxh3_64_intdigest(target),
+                        "time": 0.0,
+                        "size": len(target),
+                    }
+                ],
+                "delete": [],
+                "source": "UMU-Proton-9.0-3",
+                "target": "UMU-Proton-9.0-4",
+            }
+        ]
+        mock_patch = self.test_cache.joinpath("UMU-Latest.cbor")
+        mock_patch.write_bytes(dumps({"contents": contents}))
+
+        with (
+            umu_bspatch.PatchFile(mock_patch) as cbor,
+            ThreadPoolExecutor() as thread_pool,
+            ProcessPoolExecutor(
+                max_workers=2, mp_context=get_context("forkserver")
+            ) as process_pool,
+        ):
+            patcher = umu_bspatch.CustomPatcher(
+                cbor.contents[0], self.test_umu_compat, thread_pool, process_pool
+            )
+            patcher.verify_integrity()
+            verify, *_ = patcher.result()
+            for future in verify:
+                future.result()
+            patcher.update_binaries()
+            patcher.add_binaries()
+            _, add, update, _ = patcher.result()
+            for future in (*add, *update):
+                future.result()
+
+        self.assertEqual(
+            self.test_umu_compat.joinpath("foo").read_bytes(),
+            target,
+            "Expected 'foo' to be patched",
+        )
+        self.assertEqual(
+            self.test_umu_compat.joinpath("foo").stat().st_mode,
+            0o100755,
+            "Expected the mode of 'foo' to be updated",
+        )
+        self.assertEqual(
+            self.test_umu_compat.joinpath("bar").read_bytes(),
+            b"bar" * 1024,
+            "Expected 'bar' to be written",
+        )
+        self.assertEqual(
+            self.test_umu_compat.joinpath("baz").readlink(),
+            Path("bar"),
+            "Expected 'baz' to be linked by the parent",
+        )
+
+    def test_apply_delta_chain(self):
+        """Test apply_delta_chain when updating a build through consecutive patches."""
+        try:
+            from cbor2 import dumps
+            from pyzstd import ZstdDict, compress
+            from xxhash import xxh3_64_intdigest
+        except ModuleNotFoundError:
+            err = "delta dependencies not installed"
+            self.skipTest(err)
+
+        builds = [b"foo" * 1024, b"foo" * 1024 + b"bar", b"baz" + b"foo" * 1024]
+        proton = self.test_umu_compat.joinpath("UMU-Latest")
+        proton.mkdir()
+        proton.joinpath("foo").write_bytes(builds[0])
+        proton.joinpath("foo").chmod(0o644)
+        proton.joinpath("qux").write_bytes(b"qux")
+        proton.joinpath("qux").chmod(0o644)
+        proton.joinpath("baz").write_bytes(b"baz")
+        mode = proton.joinpath("foo").stat().st_mode
+        ino = proton.joinpath("baz").stat().st_ino
+        cache = umu_bspatch.DigestCache(self.test_cache.joinpath("xxh3.json"))
+        patches = []
+
+        for i, (source, target) in enumerate(zip(builds, builds[1:])):
+            contents = [
+                {
+                    "manifest": [
+                        {
+                            "name": "foo",
+                            "mode": mode,
+                            "xxhash": xxh3_64_intdigest(source),
+                            "size": len(source),
+                            "time": 0.0,
+                        }
+                    ],
+                    "add": [],
+                    "update": [
+                        {
+                            "name": "foo",
+                            "data": compress(
+                                target,
+                                zstd_dict=ZstdDict(source, is_raw=True).as_prefix,
+                            ),
+                            "type": "file",
+                            "mode": mode,
+                            "xxhash": xxh3_64_intdigest(target),
+                            "time": 0.0,
+                            "size": len(target),
+                        }
+                    ],
+                    # Delete a file only in the last patch
+                    "delete": [{"name": "qux", "type": "file"}] if i else [],
+                    "source": f"UMU-Proton-9.0-{i}",
+                    "target": f"UMU-Proton-9.0-{i + 1}",
+                }
+            ]
+            path = self.test_cache.joinpath(f"UMU-Latest.{i}.cbor")
+            path.write_bytes(dumps({"contents": contents}))
+            patches.append(umu_bspatch.PatchFile(path))
+
+        # Mock a running game, holding a file of the build open during the update
+        with (
+            proton.joinpath("foo").open("rb") as file,
+            ThreadPoolExecutor() as thread_pool,
+        ):
+            result = umu_bspatch.apply_delta_chain(
+                proton,
+                patches,
+                umu_proton._get_content_root,
+                thread_pool,
+                cache=cache,
+            )
+            self.assertEqual(
+                file.read(), builds[0], "Expected the open file to be untouched"
+            )
+
+        for patch_file in patches:
+            patch_file.close()
+
+        self.assertTrue(result, "Expected the chain to be applied")
+        self.assertEqual(
+            proton.joinpath("foo").read_bytes(),
+            builds[-1],
+            "Expected the latest build",
+        )
+        self.assertFalse(proton.joinpath("qux").exists(), "Expected 'qux' deleted")
+        self.assertEqual(
+            proton.joinpath("baz").stat().st_ino,
+            ino,
+            "Expected the unchanged file to be linked",
+        )
+        self.assertEqual(
+            cache.get(umu_bspatch._digest_key(proton.joinpath("foo").stat())),
+            xxh3_64_intdigest(builds[-1]),
+            "Expected the digest of the latest build to be cached",
+        )
+        self.assertFalse(
+            self.test_umu_compat.joinpath(".UMU-Latest.staging").exists(),
+            "Expected the staging directory to be removed",
+        )
+
+    def test_diff_trees(self):
+        """Test diff_trees when creating a patch between two builds.
+
+        Expects the patched build to be identical to the target build.
+        """
+        try:
+            from cbor2 import dumps
+        except ModuleNotFoundError:
+            err = "delta dependencies not installed"
+            self.skipTest(err)
+
+        source = self.test_cache.joinpath("UMU-Proton-9.0-3")
+        target = self.test_cache.joinpath("UMU-Proton-9.0-4")
+        proton = self.test_umu_compat.joinpath("UMU-Latest")
+        source.joinpath("baz").mkdir(parents=True)
+        source.joinpath("foo").write_bytes(b"foo" * 1024)
+        source.joinpath("bar").write_bytes(b"bar")
+        source.joinpath("baz", "qux").write_bytes(b"qux")
+        source.joinpath("lib").symlink_to("foo")
+        copytree(source, target, symlinks=True)
+        copytree(source, proton, symlinks=True)
+        # Update, add, delete and change the mode of files, links and directories
+        target.joinpath("foo").write_bytes(b"foo" * 1024 + b"bar")
+        target.joinpath("bar").chmod(0o700)
+        rmtree(target.joinpath("baz"))
+        target.joinpath("quux").mkdir(mode=0o700)
+        target.joinpath("quux", "foo").write_bytes(b"foo")
+        target.joinpath("lib").unlink()
+        target.joinpath("lib").symlink_to("bar")
+        target.joinpath("libfoo").symlink_to("foo")
+
+        with ThreadPoolExecutor() as thread_pool:
+            content = umu_mkpatch.diff_trees(source, target, thread_pool)
+            path = self.test_cache.joinpath("UMU-Latest.cbor")
+            path.write_bytes(dumps({"contents": [content]}))
+            with umu_bspatch.PatchFile(path) as cbor:
+                result = umu_bspatch.apply_delta_chain(
+                    proton, [cbor], umu_proton._get_content_root, thread_pool
+                )
+
+        self.assertTrue(result, "Expected the patch to be applied")
+        self.assertEqual(
+            [item["name"] for item in content["delete"]],
+            ["baz"],
+            "Expected only the directory to be deleted",
+        )
+        for file in target.rglob("*"):
+            name = file.relative_to(target)
+            stats = proton.joinpath(name).lstat()
+            self.assertEqual(stats.st_mode, file.lstat().st_mode, name)
+            if file.is_symlink():
+                self.assertEqual(proton.joinpath(name).readlink(), file.readlink())
+            elif file.is_file():
+                self.assertEqual(proton.joinpath(name).read_bytes(), file.read_bytes())
+        self.assertEqual(
+            sorted(proton.rglob("*")),
+            sorted(
+                proton.joinpath(file.relative_to(target)) for file in target.rglob("*")
+            ),
+            "Expected the files of the target build",
+        )
+
+    def test_diff_trees_dir(self):
+        """Test diff_trees when a directory is replaced by a file."""
+        source = self.test_cache.joinpath("UMU-Proton-9.0-3")
+        target = self.test_cache.joinpath("UMU-Proton-9.0-4")
+        source.joinpath("foo").mkdir(parents=True)
+        target.mkdir()
+        target.joinpath("foo").write_bytes(b"foo")
+
+        with ThreadPoolExecutor() as thread_pool, self.assertRaises(ValueError):
+            umu_mkpatch.diff_trees(source, target, thread_pool)
+
+    def test_make_patch(self):
+        """Test make_patch when signing a patch with an OpenSSH key.
+
+        Expects the signature of the contents to be verified by ssh-keygen.
+        """
+        try:
+            from cbor2 import loads
+        except ModuleNotFoundError:
+            err = "delta dependencies not installed"
+            self.skipTest(err)
+
+        ssh_keygen = which("ssh-keygen")
+        if not ssh_keygen:
+            err = "ssh-keygen not installed"
+            self.skipTest(err)
+
+        key = self.test_cache.joinpath("key")
+        source = self.test_cache.joinpath("UMU-Proton-9.0-3")
+        target = self.test_cache.joinpath("UMU-Proton-9.0-4")
+        source.mkdir()
+        target.mkdir()
+        target.joinpath("foo").write_bytes(b"foo")
+        run(
+            (ssh_keygen, "-q", "-t", "ed25519", "-N", "", "-f", key),
+            check=True,
+        )
+
+        with ThreadPoolExecutor() as thread_pool:
+            patch_file = umu_mkpatch.make_patch([(source, target)], key, thread_pool)
+
+        self.test_cache.joinpath("patch.cbor").write_bytes(patch_file)
+        with umu_bspatch.PatchFile(self.test_cache.joinpath("patch.cbor")) as cbor:
+            public_key, key_type = cbor.public_key
+            signature, _ = cbor.signature
+            contents = cbor.raw_contents
+            self.assertEqual(contents, cbor.canonical_contents)
+
+        self.assertEqual(public_key, key.with_suffix(".pub").read_text().strip())
+        self.assertEqual(key_type, b"ssh-ed25519", "Expected the key type")
+        self.assertEqual([item["name"] for item in loads(contents)[0]["add"]], ["foo"])
+        self.test_cache.joinpath("allowed_signers").write_text(f"umu {public_key}\n")
+        self.test_cache.joinpath("patch.sig").write_bytes(signature)
+        ret = run(
+            (
+                ssh_keygen,
+                "-Y",
+                "verify",
+                "-f",
+                self.test_cache.joinpath("allowed_signers"),
+                "-I",
+                "umu",
+                "-n",
+                umu_mkpatch.SIGNATURE_NAMESPACE,
+                "-s",
+                self.test_cache.joinpath("patch.sig"),
+            ),
+            input=contents,
+            capture_output=True,
+            check=False,
+        )
+        self.assertEqual(ret.returncode, 0, ret.stderr)
+
+    def test_make_patch_indexed(self):
+        """Test make_patch when creating an indexed patch file.
+
+        Expects the index to be signed, and the patch file to update the source
+        tree to the target tree.
+        """
+        try:
+            from cbor2 import loads
+        except ModuleNotFoundError:
+            err = "delta dependencies not installed"
+            self.skipTest(err)
+
+        ssh_keygen = which("ssh-keygen")
+        if not ssh_keygen:
+            err = "ssh-keygen not installed"
+            self.skipTest(err)
+
+        key = self.test_cache.joinpath("key")
+        source = self.test_cache.joinpath("UMU-Proton-9.0-3")
+        target = self.test_cache.joinpath("UMU-Proton-9.0-4")
+        source.mkdir()
+        target.mkdir()
+        source.joinpath("foo").write_bytes(bytes(range(256)) * 64)
+        target.joinpath("foo").write_bytes(bytes(range(256)) * 64 + b"foo")
+        target.joinpath("bar").write_bytes(b"bar" * 1024)
+        target.joinpath("baz").symlink_to("bar")
+        run(
+            (ssh_keygen, "-q", "-t", "ed25519", "-N", "", "-f", key),
+            check=True,
+        )
+
+        with ThreadPoolExecutor() as thread_pool:
+            patch_file = umu_mkpatch.make_patch(
+                [(source, target)], key, thread_pool, version=2
+            )
+
+        self.assertTrue(patch_file.startswith(umu_bspatch.PATCH_MAGIC))
+        self.test_cache.joinpath("patch.umupatch").write_bytes(patch_file)
+        proton = self.test_umu_compat.joinpath("UMU-Latest")
+        copytree(source, proton)
+        with (
+            umu_bspatch.PatchFile(self.test_cache.joinpath("patch.umupatch")) as cbor,
+            ThreadPoolExecutor() as thread_pool,
+        ):
+            public_key, _ = cbor.public_key
+            signature, _ = cbor.signature
+            contents = cbor.raw_contents
+            self.assertTrue(cbor.is_indexed, "Expected an indexed patch file")
+            self.assertTrue(cbor.verify_payloads(), "Expected valid payloads")
+            self.assertEqual(len(cbor.payloads()), 2, "Expected a payload per file")
+            result = umu_bspatch.apply_delta_chain(
+                proton, [cbor], lambda path, _: path, thread_pool
+            )
+
+        self.assertTrue(result, "Expected the patch to be applied")
+        self.assertEqual(
+            umu_bspatch._map_patch.cache_info().currsize,
+            0,
+            "Expected the patch file to be unmapped",
+        )
+        for name in ("foo", "bar"):
+            self.assertEqual(
+                proton.joinpath(name).read_bytes(),
+                target.joinpath(name).read_bytes(),
+                f"Expected '{name}' to be updated",
+            )
+        self.assertEqual(proton.joinpath("baz").readlink(), Path("bar"))
+        self.assertNotIn(
+            "data",
+            loads(contents)[0]["add"][0],
+            "Expected the data of files out of the index",
+        )
+        self.test_cache.joinpath("allowed_signers").write_text(f"umu {public_key}\n")
+        self.test_cache.joinpath("patch.sig").write_bytes(signature)
+        ret = run(
+            (
+                ssh_keygen,
+                "-Y",
+                "verify",
+                "-f",
+                self.test_cache.joinpath("allowed_signers"),
+                "-I",
+                "umu",
+                "-n",
+                umu_mkpatch.SIGNATURE_NAMESPACE,
+                "-s",
+                self.test_cache.joinpath("patch.sig"),
+            ),
+            input=contents,
+            capture_output=True,
+            check=False,
+        )
+        self.assertEqual(ret.returncode, 0, ret.stderr)
+
+    def test_download_patch_indexed(self):
+        """Test download_patch when fetching an indexed patch file by range.
+
+        Expects the header to be fetched first, then only the selected payloads
+        within as few range requests as possible.
+        """
+        try:
+            from pyzstd import compress
+            from xxhash import xxh3_64_intdigest
+        except ModuleNotFoundError:
+            err = "delta dependencies not installed"
+            self.skipTest(err)
+
+        entries = [
+            {
+                "name": f"foo{i}",
+                "data": compress(bytes([i]) * 4096),
+                "type": "file",
+                "mode": 0o100644,
+                "xxhash": xxh3_64_intdigest(bytes([i]) * 4096),
+                "time": 0.0,
+                "size": 4096,
+            }
+            for i in range(4)
+        ]
+        contents = [
+            {
+                "manifest": [],
+                "add": entries,
+                "update": [],
+                "delete": [],
+                "source": "UMU-Proton-9.0-3",
+                "target": "UMU-Proton-9.0-4",
+            }
+        ]
+        index, payloads = umu_mkpatch.index_contents(contents)
+        data = umu_mkpatch.pack_patch(
+            {"contents": index, "signature": (b"", b""), "public_key": ("", b"")},
+            payloads,
+        )
+        ranges = []
+
+        def request(*_, headers, **__):
+            start, end = headers["Range"].removeprefix("bytes=").split("-")
+            end = min(int(end) + 1 if end else len(data), len(data))
+            ranges.append((int(start), end))
+            mock_resp = MagicMock()
+            mock_resp.status = 206
+            mock_resp.headers = {
+                "Content-Range": f"bytes {start}-{end - 1}/{len(data)}"
+            }
+            mock_resp.data = data[int(start) : end]
+            mock_resp.read.return_value = data[int(start) : end]
+            mock_resp.readinto = io.BytesIO(data[int(start) : end]).readinto
+            return mock_resp
+
+        mock_hp = MagicMock()
+        mock_hp.request.side_effect = request
+        path = self.test_cache.joinpath("UMU-Latest.cbor")
+
+        with patch.object(umu_bspatch, "PATCH_HEAD_SIZE", 64):
+            result = umu_bspatch.download_patch(
+                mock_hp, "foo", {}, path, select=lambda _: False
+            )
+        self.assertEqual(result, path, "Expected the header to be fetched")
+        self.assertEqual(len(ranges), 2, "Expected only the header to be fetched")
+        self.assertEqual(path.stat().st_size, len(data), "Expected the full size")
+
+        path.unlink()
+        ranges.clear()
+        with (
+            patch.object(umu_bspatch, "PATCH_HEAD_SIZE", 64),
+            ThreadPoolExecutor() as thread_pool,
+        ):
+            result = umu_bspatch.download_patch(
+                mock_hp, "foo", {}, path, thread_pool=thread_pool
+            )
+        self.assertEqual(result, path, "Expected the payloads to be fetched")
+        self.assertEqual(len(ranges), 3, "Expected the payloads within one range")
+        self.assertEqual(path.read_bytes(), data, "Expected the patch file")
+        with umu_bspatch.PatchFile(path) as cbor:
+            self.assertEqual(list(cbor.contents[0]["add"]), entries)
+
+        # A payload that does not match its digest
+        path.unlink()
+        data = data[:-1] + b"\x00"
+        with patch.object(umu_bspatch, "PATCH_HEAD_SIZE", 64):
+            result = umu_bspatch.download_patch(mock_hp, "foo", {}, path)
+        self.assertIsNone(result, "Expected the corrupt payload to be rejected")
+
+        # The server ignores the range
+        path.unlink()
+        mock_resp = MagicMock()
+        mock_resp.status = 200
+        mock_resp.readinto = io.BytesIO(data).readinto
+        mock_hp.request.side_effect = None
+        mock_hp.request.return_value = mock_resp
+        result = umu_bspatch.download_patch(mock_hp, "foo", {}, path)
+        self.assertIsNone(result, "Expected the corrupt payload to be rejected")
+
+    def test_find_patch_asset(self):
+        """Test find_patch_asset when a release has both patch file formats."""
+        assets = [
+            {"name": "GE-Latest.cbor", "browser_download_url": "foo"},
+            {"name": "UMU-Latest.cbor", "browser_download_url": "bar"},
+            {"name": "UMU-Latest.umupatch", "browser_download_url": "baz"},
+        ]
+
+        self.assertEqual(umu_bspatch.find_patch_asset(assets, "UMU-Latest"), "baz")
+        self.assertEqual(umu_bspatch.find_patch_asset(assets, "GE-Latest"), "foo")
+        self.assertEqual(umu_bspatch.find_patch_asset(assets, "foo"), "")
+
+    def test_apply_delta_chain_broken(self):
+        """Test apply_delta_chain when a patch fails to apply.
+
+        Expects the installed build to be left untouched.
+        """
+        try:
+            from cbor2 import dumps
+            from pyzstd import compress
+            from xxhash import xxh3_64_intdigest
+        except ModuleNotFoundError:
+            err = "delta dependencies not installed"
+            self.skipTest(err)
+
+        proton = self.test_umu_compat.joinpath("UMU-Latest")
+        proton.mkdir()
+        proton.joinpath("foo").write_bytes(b"foo")
+        contents = [
+            {
+                "manifest": [
+                    {
+                        "name": "foo",
+                        "mode": proton.joinpath("foo").stat().st_mode,
+                        "xxhash": xxh3_64_intdigest(b"foo"),
+                        "size": 3,
+                        "time": 0.0,
+                    }
+                ],
+                "add": [
+                    {
+                        "name": "bar",
+                        "data": compress(b"bar"),
+                        "type": "file",
+                        "mode": 0o100644,
+                        # Mock a corrupted file
+                        "xxhash": xxh3_64_intdigest(b"baz"),
+                        "time": 0.0,
+                        "size": 3,
+                    }
+                ],
+                "update": [],
+                "delete": [{"name": "foo", "type": "file"}],
+                "source": "UMU-Proton-9.0-1",
+                "target": "UMU-Proton-9.0-2",
+            }
+        ]
+        path = self.test_cache.joinpath("UMU-Latest.cbor")
+        path.write_bytes(dumps({"contents": contents}))
+
+        with (
+            umu_bspatch.PatchFile(path) as cbor,
+            ThreadPoolExecutor() as thread_pool,
+        ):
+            result = umu_bspatch.apply_delta_chain(
+                proton, [cbor], umu_proton._get_content_root, thread_pool
+            )
+
+        self.assertFalse(result, "Expected the chain to fail")
+        self.assertEqual(
+            sorted(file.name for file in proton.iterdir()),
+            ["foo"],
+            "Expected the installed build to be untouched",
+        )
+        self.assertFalse(
+            self.test_umu_compat.joinpath(".UMU-Latest.staging").exists(),
+            "Expected the staging directory to be removed",
+        )
+
+    def test_fetch_patch_chain(self):
+        """Test _fetch_patch_chain when linking patches to the installed build."""
+        try:
+            from cbor2 import dumps
+        except ModuleNotFoundError:
+            err = "python3-cbor2 not installed"
+            self.skipTest(err)
+
+        os.environ["PROTONPATH"] = "UMU-Latest"
+        releases = []
+        resps = []
+
+        # Releases are listed from the latest
+        for i in range(4, 0, -1):
+            contents = [
+                {
+                    "manifest": [],
+                    "add": [],
+                    "update": [],
+                    "delete": [],
+                    "source": f"UMU-Proton-9.0-{i}",
+                    "target": f"UMU-Proton-9.0-{i + 1}",
+                }
+            ]
+            releases.append(
+                {
+                    "id": i,
+                    "assets": [
+                        {"name": "GE-Latest.cbor", "browser_download_url": "foo"},
+                        {"name": "UMU-Latest.cbor", "browser_download_url": "bar"},
+                    ],
+                }
+            )
+            mock_resp = MagicMock()
+            mock_resp.status = 200
+            mock_resp.readinto = io.BytesIO(dumps({"contents": contents})).readinto
+            resps.append(mock_resp)
+
+        mock_resp = MagicMock()
+        mock_resp.status = 200
+        mock_resp.json.return_value = releases
+        mock_hp = MagicMock()
+        mock_hp.request.side_effect = [mock_resp, *resps]
+
+        with (
+            ThreadPoolExecutor() as thread_pool,
+            patch.object(umu_proton, "is_valid_patch", return_value=True),
+        ):
+            result = umu_proton._fetch_patch_chain(
+                (thread_pool, mock_hp),
+                self.test_cache,
+                '"display_name" "UMU-Proton-9.0-2"',
+                "UMU-Proton-9.0-4",
+            )
+
+        builds = [umu_proton._get_patch_build(patch_file) for patch_file in result]
+        for patch_file in result:
+            patch_file.close()
+
+        self.assertEqual(
+            builds,
+            [
+                ("UMU-Proton-9.0-2", "UMU-Proton-9.0-3"),
+                ("UMU-Proton-9.0-3", "UMU-Proton-9.0-4"),
+            ],
+            "Expected the patches from the installed build, oldest first",
+        )
+
+    def test_fetch_patch_chain_invalid(self):
+        """Test _fetch_patch_chain when a patch of the chain is not authentic.
+
+        Expects no patches, without searching past the patch.
+        """
+        try:
+            from cbor2 import dumps
+        except ModuleNotFoundError:
+            err = "python3-cbor2 not installed"
+            self.skipTest(err)
+
+        os.environ["PROTONPATH"] = "UMU-Latest"
+        releases = []
+        resps = []
+
+        for i in range(3, 1, -1):
+            contents = [
+                {
+                    "manifest": [],
+                    "add": [],
+                    "update": [],
+                    "delete": [],
+                    "source": f"UMU-Proton-9.0-{i}",
+                    "target": f"UMU-Proton-9.0-{i + 1}",
+                }
+            ]
+            releases.append(
+                {
+                    "id": i,
+                    "assets": [
+                        {"name": "UMU-Latest.cbor", "browser_download_url": "foo"}
+                    ],
+                }
+            )
+            mock_resp = MagicMock()
+            mock_resp.status = 200
+            mock_resp.readinto = io.BytesIO(dumps({"contents": contents})).readinto
+            resps.append(mock_resp)
+
+        mock_resp = MagicMock()
+        mock_resp.status = 200
+        mock_resp.json.return_value = releases
+        mock_hp = MagicMock()
+        mock_hp.request.side_effect = [mock_resp, *resps]
+
+        with (
+            ThreadPoolExecutor() as thread_pool,
+            patch.object(
+                umu_proton, "is_valid_patch", side_effect=[False, True]
+            ) as mock_valid,
+        ):
+            result = umu_proton._fetch_patch_chain(
+                (thread_pool, mock_hp),
+                self.test_cache,
+                '"display_name" "UMU-Proton-9.0-2"',
+                "UMU-Proton-9.0-4",
+            )
+
+        self.assertEqual(result, [], "Expected no patches")
+        self.assertEqual(mock_valid.call_count, 1, "Expected one patch verified")
+
+    def test_fetch_patch_chain_none(self):
+        """Test _fetch_patch_chain when the installed build cannot be reached."""
+        mock_resp = MagicMock()
+        mock_resp.status = 200
+        mock_resp.json.return_value = []
+        mock_hp = MagicMock()
+        mock_hp.request.return_value = mock_resp
+        os.environ["PROTONPATH"] = "UMU-Latest"
+
+        result = umu_proton._fetch_patch_chain(
+            (MagicMock(), mock_hp), self.test_cache, "", "UMU-Proton-9.0-4"
+        )
+        self.assertEqual(result, [], "Expected no patches")
+
+    def test_main_nomusl(self):
+        """Test __main__.main to ensure an exit when on a musl-based system."""
+        os.environ["LD_LIBRARY_PATH"] = f"{os.environ['LD_LIBRARY_PATH']}:musl"
+        with (
+            patch.object(
+                __main__,
+                "parse_args",
+                return_value=["foo", "foo"],
+            ),
+            self.assertRaises(SystemExit),
+        ):
+            __main__.main()
+
+    def test_main_noroot(self):
+        """Test __main__.main to ensure an exit when run as a privileged user."""
+        with (
+            patch.object(
+                __main__,
+                "parse_args",
+                return_value=["foo", "foo"],
+            ),
+            self.assertRaises(SystemExit),
+            patch.object(os, "geteuid", return_value=0),
+        ):
+            __main__.main()
+
+    def test_restore_umu_cb_false(self):
+        """Test _restore_umu when the callback evaluates to False."""
+        mock_cb = Mock(return_value=False)
+        result = MagicMock()
+
+        with (
+            TemporaryDirectory() as file,
+            patch.object(umu_runtime, "_install_umu"),
+        ):
+            mock_subdir = Path(file).joinpath("steamrt3")
+            mock_subdir.mkdir(parents=True, exist_ok=True)
+            mock_runtime_ver = ("sniper", "steamrt3", "1628350")
+            mock_version = "3.0.20260415.224995"
+            mock_session_pools = (MagicMock(), MagicMock())
+            result = umu_runtime._restore_umu(
+                mock_subdir, mock_runtime_ver, mock_version, mock_session_pools, mock_cb
+            )
+            self.assertTrue(result is None, f"Expected None, received {result}")
+            self.assertTrue(
+                mock_cb.mock_calls,
+                "Expected callback to be called",
+            )
+
+    def test_restore_umu(self):
+        """Test _restore_umu."""
+        mock_cb = Mock(return_value=True)
+        result = MagicMock()
+
+        with TemporaryDirectory() as file:
+            mock_subdir = Path(file).joinpath("steamrt3")
+            mock_subdir.mkdir(parents=True, exist_ok=True)
+            mock_runtime_ver = ("sniper", "steamrt3", "1628350")
+            mock_version = "3.0.20260415.224995"
+            mock_session_pools = (MagicMock(), MagicMock())
+            result = umu_runtime._restore_umu(
+                mock_subdir, mock_runtime_ver, mock_version, mock_session_pools, mock_cb
+            )
+            self.assertTrue(result is None, f"Expected None, received {result}")
+            self.assertTrue(
+                mock_cb.mock_calls,
+                "Expected callback to be called",
+            )
+
+    def test_restore_umu_repair(self):
+        """Test _restore_umu when the missing entries are restored from the cache."""
+        mock_cb = Mock(side_effect=[False, True])
+
+        with (
+            TemporaryDirectory() as file,
+            patch.object(umu_runtime, "_repair_umu", return_value=True) as mock_repair,
+            patch.object(umu_runtime, "_install_umu") as mock_install,
+        ):
+            mock_subdir = Path(file).joinpath("steamrt3")
+            mock_subdir.mkdir(parents=True, exist_ok=True)
+            mock_runtime_ver = ("sniper", "steamrt3", "1628350")
+            mock_version = "3.0.20260415.224995"
+            mock_session_pools = (MagicMock(), MagicMock())
+            umu_runtime._restore_umu(
+                mock_subdir,
+                mock_runtime_ver,
+                mock_version,
+                mock_session_pools,
+                mock_cb,
+                patterns=("pressure-vessel",),
+            )
+            mock_repair.assert_called_once()
+            mock_install.assert_not_called()
+
+    def test_install_journal(self):
+        """Test InstallJournal when recording the steps of an install."""
+        with TemporaryDirectory() as file:
+            journal = umu_util.InstallJournal(Path(file, ".steamrt3.journal"))
+            self.assertIsNone(journal.step, "Expected no step without a journal")
+            journal.record(umu_util.InstallStep.Staged, version="foo")
+            journal.record(umu_util.InstallStep.Extracted)
+            self.assertEqual(
+                journal.step,
+                umu_util.InstallStep.Extracted,
+                "Expected the last recorded step",
+            )
+            self.assertEqual(
+                journal.read().get("version"),
+                "foo",
+                "Expected the state of the previous records to be kept",
+            )
+            Path(file, ".steamrt3.journal").write_text("{")
+            self.assertEqual(
+                journal.read(), {}, "Expected a corrupt journal to be ignored"
+            )
+            journal.clear()
+            self.assertFalse(
+                Path(file, ".steamrt3.journal").exists(), "Expected the journal removed"
+            )
+
+    def test_swap_current(self):
+        """Test swap_current when the pointer is a link to a previous version."""
+        with TemporaryDirectory() as file:
+            versions = Path(file, ".UMU-Latest.versions")
+            versions.joinpath("UMU-Proton-9.0-3").mkdir(parents=True)
+            versions.joinpath("UMU-Proton-9.0-4").mkdir()
+            pointer = Path(file, "UMU-Latest")
+            pointer.symlink_to(".UMU-Latest.versions/UMU-Proton-9.0-3")
+
+            umu_util.swap_current(pointer, versions.joinpath("UMU-Proton-9.0-4"))
+
+            self.assertEqual(
+                pointer.readlink(),
+                Path(".UMU-Latest.versions", "UMU-Proton-9.0-4"),
+                "Expected a relative link to the new version",
+            )
+            self.assertTrue(
+                versions.joinpath("UMU-Proton-9.0-3").is_dir(),
+                "Expected the previous version to be left intact",
+            )
+            self.assertEqual(
+                sorted(path.name for path in Path(file).iterdir()),
+                [".UMU-Latest.versions", "UMU-Latest"],
+                "Expected no temporary link",
+            )
+
+    def test_swap_current_dir(self):
+        """Test swap_current when the pointer is a directory of a previous release."""
+        with TemporaryDirectory() as file:
+            versions = Path(file, ".UMU-Latest.versions")
+            versions.joinpath("UMU-Proton-9.0-4").mkdir(parents=True)
+            pointer = Path(file, "UMU-Latest")
+            pointer.mkdir()
+            pointer.joinpath("foo").touch()
+
+            umu_util.swap_current(pointer, versions.joinpath("UMU-Proton-9.0-4"))
+
+            self.assertTrue(pointer.is_symlink(), "Expected the pointer to be a link")
+            self.assertTrue(
+                pointer.samefile(versions.joinpath("UMU-Proton-9.0-4")),
+                "Expected the pointer to resolve to the new version",
+            )
+            moved = [
+                path
+                for path in versions.iterdir()
+                if path.name.startswith("UMU-Latest.")
+            ]
+            self.assertEqual(len(moved), 1, "Expected the directory to be moved")
+            self.assertTrue(moved[0].joinpath("foo").is_file())
+
+    def test_prune_trees(self):
+        """Test prune_trees skips the kept and held directories."""
+        with TemporaryDirectory() as file:
+            versions = Path(file)
+            for name in ("foo", "bar", "baz", ".qux"):
+                versions.joinpath(name).mkdir()
+
+            with umu_util.hold_tree(versions.joinpath("bar")):
+                umu_util.prune_trees(versions, keep=versions.joinpath("foo"))
+                self.assertEqual(
+                    sorted(path.name for path in versions.iterdir()),
+                    [".qux", "bar", "foo"],
+                    "Expected only the unused directory to be removed",
+                )
+
+            umu_util.prune_trees(versions, keep=versions.joinpath("foo"))
+            self.assertEqual(
+                sorted(path.name for path in versions.iterdir()),
+                [".qux", "foo"],
+                "Expected the released directory to be removed",
+            )
+
+    def test_get_lock_path(self):
+        """Test get_lock_path returns a lock for each tool."""
+        result = umu_util.get_lock_path(
+            Path("/foo"), umu_util.FileLock.Compat, "UMU-Latest"
+        )
+        self.assertEqual(result, "/foo/UMU-Latest.compatibilitytools.d.lock")
+
+    def test_unix_flock_shared(self):
+        """Test unix_flock shares the lock between readers, but not writers."""
+        with TemporaryDirectory() as file:
+            lock = str(Path(file, "foo.lock"))
+
+            with (
+                umu_util.unix_flock(lock, shared=True),
+                umu_util.unix_flock(lock, shared=True, timeout=0),
+            ):
+                self.assertRaises(
+                    TimeoutError,
+                    umu_util.unix_flock(lock, timeout=0.2).__enter__,
+                )
+
+            with umu_util.unix_flock(lock, timeout=0):
+                self.assertRaises(
+                    TimeoutError,
+                    umu_util.unix_flock(lock, shared=True, timeout=0.2).__enter__,
+                )
+
+    def test_unix_flock_wait(self):
+        """Test unix_flock waits for the lock to be released by another process."""
+        with TemporaryDirectory() as file:
+            lock = str(Path(file, "foo.lock"))
+            held = ThreadingEvent()
+
+            def hold():
+                with umu_util.unix_flock(lock):
+                    held.set()
+                    sleep(0.3)
+
+            thread = Thread(target=hold)
+            thread.start()
+            held.wait()
+            with (
+                patch.object(umu_util, "log") as mock_log,
+                umu_util.unix_flock(lock, timeout=5),
+            ):
+                pass
+            thread.join()
+
+            mock_log.info.assert_any_call(
+                "Waiting for '%s', in use by another process...", lock
+            )
+            waited = [
+                call.args[-1]
+                for call in mock_log.debug.call_args_list
+                if call.args[0].startswith("Acquired")
+            ]
+            self.assertEqual(len(waited), 1, "Expected the time waited to be logged")
+            self.assertGreater(waited[0], 0)
+
+    def test_install_proton_versions(self):
+        """Test _install_proton installs UMU-Latest within its own version."""
+        tarball = "UMU-Proton-9.0-4.tar.gz"
+
+        with TemporaryDirectory() as file:
+            cache = Path(file, "cache", "session")
+            cache.mkdir(parents=True)
+            umu_compat = Path(file, "compatibilitytools")
+            steam_compat = Path(file, "steam")
+            umu_compat.joinpath("UMU-Latest").mkdir(parents=True)
+            steam_compat.mkdir()
+            src = Path(file, "src", "UMU-Proton-9.0-4")
+            src.mkdir(parents=True)
+            src.joinpath("compatibilitytool.vdf").write_text("UMU-Proton-9.0-4")
+            with tarfile.open(Path(file, "cache", f"{tarball}.parts"), "w:gz") as tar:
+                tar.add(src, arcname=src.name)
+
+            with (
+                patch.dict(os.environ, {"PROTONPATH": "UMU-Latest"}),
+                patch.object(umu_proton, "UMU_LOCAL", Path(file)),
+                patch.object(umu_proton, "UMU_CACHE", cache.parent),
+            ):
+                umu_proton._install_proton(
+                    tarball, (Path(file), cache), (umu_compat, steam_compat)
+                )
+
+            latest = umu_compat.joinpath("UMU-Latest")
+            self.assertTrue(latest.is_symlink(), "Expected UMU-Latest to be a link")
+            self.assertEqual(
+                latest.resolve(),
+                umu_compat.joinpath(".UMU-Latest.versions", "UMU-Proton-9.0-4"),
+                "Expected UMU-Latest to point to the new build",
+            )
+            self.assertEqual(
+                [
+                    path.name
+                    for path in latest.parent.joinpath(".UMU-Latest.versions").iterdir()
+                ],
+                ["UMU-Proton-9.0-4"],
+                "Expected the previous build to be removed",
+            )
+
+    def test_use_build(self):
+        """Test _use_build when removing a build that shares files with the build.
+
+        Expects the cached digests of the build to be kept.
+        """
+        versions = self.test_umu_compat.joinpath(".UMU-Latest.versions")
+        prev = versions.joinpath("UMU-Proton-9.0-3")
+        build = versions.joinpath("UMU-Proton-9.0-4")
+        pointer = self.test_umu_compat.joinpath("UMU-Latest")
+        prev.mkdir(parents=True)
+        prev.joinpath("foo").write_text("foo")
+        copytree(prev, build, copy_function=os.link)
+        pointer.symlink_to(prev.absolute())
+        cache = umu_bspatch.DigestCache(self.test_cache.joinpath("xxh3.json"))
+        cache.set(umu_bspatch._digest_key(build.joinpath("foo").stat()), 1)
+
+        umu_proton._use_build(pointer, versions, build, cache)
+
+        self.assertEqual(pointer.resolve(), build.resolve(), "Expected the new build")
+        self.assertFalse(prev.exists(), "Expected the previous build to be removed")
+        self.assertEqual(
+            cache.get(umu_bspatch._digest_key(build.joinpath("foo").stat())),
+            1,
+            "Expected the digest of the shared file",
+        )
+
+    def test_install_umu(self):
+        """Test _install_umu when committing a new runtime through its journal."""
+        mock_runtime_ver = ("sniper", "steamrt3", "1628350")
+        archive = umu_runtime._runtime_archive(mock_runtime_ver[0])
+        root = archive.removesuffix(".tar.xz")
+
+        with TemporaryDirectory() as file:
+            cache = Path(file, "cache")
+            cache.mkdir()
+            src = Path(file, "src", root)
+            src.joinpath("sniper_platform_0.20240125.75305", "files").mkdir(
+                parents=True
+            )
+            src.joinpath("VERSIONS.txt").write_text("bar")
+            with tarfile.open(Path(file, archive), "w:xz") as tar:
+                tar.add(src, arcname=root)
+            local = Path(file, "local", "steamrt3")
+            local.mkdir(parents=True)
+            local.joinpath("VERSIONS.txt").write_text("foo")
+            with (
+                patch.object(umu_runtime, "UMU_CACHE", cache),
+                patch.object(
+                    umu_runtime, "_download_umu", return_value=Path(file, archive)
+                ),
+                patch.object(umu_runtime, "check_runtime", return_value=0),
+                patch.object(umu_runtime, "syncfs") as mock_syncfs,
+            ):
+                umu_runtime._install_umu(local, mock_runtime_ver, "bar", MagicMock())
+
+            self.assertEqual(
+                local.joinpath("VERSIONS.txt").read_text(),
+                "bar",
+                "Expected the new runtime to be committed",
+            )
+            self.assertTrue(
+                umu_util.read_install_marker(local), "Expected a generation marker"
+            )
+            self.assertTrue(local.joinpath("umu").is_symlink(), "Expected umu link")
+            mock_syncfs.assert_called_once()
+            self.assertFalse(
+                Path(file, "local", ".steamrt3.staging").exists(),
+                "Expected the staging directory to be removed",
+            )
+            self.assertFalse(
+                any(Path(file, "local", ".steamrt3.retired").iterdir()),
+                "Expected the unused previous runtime to be removed",
+            )
+            self.assertFalse(
+                Path(file, "local", ".steamrt3.journal").exists(),
+                "Expected the journal to be removed",
+            )
+            self.assertTrue(
+                cache.joinpath(f"{archive}.index.json").is_file(),
+                "Expected the archive to be cached",
+            )
+
+    def test_install_umu_invalid(self):
+        """Test _install_umu when the new runtime fails validation."""
+        mock_runtime_ver = ("sniper", "steamrt3", "1628350")
+        archive = umu_runtime._runtime_archive(mock_runtime_ver[0])
+        root = archive.removesuffix(".tar.xz")
+
+        with TemporaryDirectory() as file:
+            src = Path(file, "src", root)
+            src.mkdir(parents=True)
+            src.joinpath("VERSIONS.txt").write_text("bar")
+            with tarfile.open(Path(file, archive), "w:xz") as tar:
+                tar.add(src, arcname=root)
+            local = Path(file, "local", "steamrt3")
+            local.mkdir(parents=True)
+            local.joinpath("VERSIONS.txt").write_text("foo")
+            umu_util.write_install_marker(local)
+            with (
+                patch.object(
+                    umu_runtime, "_download_umu", return_value=Path(file, archive)
+                ),
+                patch.object(umu_runtime, "check_runtime", return_value=1),
+            ):
+                umu_runtime._install_umu(local, mock_runtime_ver, "bar", MagicMock())
+
+            self.assertEqual(
+                local.joinpath("VERSIONS.txt").read_text(),
+                "foo",
+                "Expected the existing runtime to be kept",
+            )
+            self.assertTrue(
+                umu_util.has_runtime_installed(local), "Expected the marker to be kept"
+            )
+            self.assertEqual(
+                list(Path(file, "local").iterdir()),
+                [local],
+                "Expected the install's state to be removed",
+            )
+
+    def test_install_umu_resume(self):
+        """Test _install_umu when resuming an install interrupted before commit."""
+        mock_runtime_ver = ("sniper", "steamrt3", "1628350")
+        archive = umu_runtime._runtime_archive(mock_runtime_ver[0])
+        root = archive.removesuffix(".tar.xz")
+
+        with TemporaryDirectory() as file:
+            local = Path(file, "steamrt3")
+            local.mkdir()
+            local.joinpath("VERSIONS.txt").write_text("foo")
+            # Mock a verified, but uncommitted runtime
+            staging = Path(file, ".steamrt3.staging")
+            staging.joinpath(root).mkdir(parents=True)
+            staging.joinpath(root, "VERSIONS.txt").write_text("bar")
+            umu_util.write_install_marker(staging.joinpath(root), "baz")
+            journal = umu_util.InstallJournal(Path(file, ".steamrt3.journal"))
+            journal.record(
+                umu_util.InstallStep.Verified, version="bar", generation="baz"
+            )
+            with (
+                patch.object(umu_runtime, "_download_umu") as mock_download,
+                patch.object(umu_runtime, "check_runtime") as mock_check,
+            ):
+                umu_runtime._install_umu(local, mock_runtime_ver, "bar", MagicMock())
+                # Resuming again after the commit must not undo the exchange
+                staging.joinpath(root).mkdir(parents=True)
+                journal.record(
+                    umu_util.InstallStep.Verified, version="bar", generation="baz"
+                )
+                umu_runtime._install_umu(local, mock_runtime_ver, "bar", MagicMock())
+
+            mock_download.assert_not_called()
+            mock_check.assert_not_called()
+            self.assertEqual(
+                local.joinpath("VERSIONS.txt").read_text(),
+                "bar",
+                "Expected the verified runtime to be committed",
+            )
+            self.assertEqual(umu_util.read_install_marker(local), "baz")
+            self.assertIsNone(journal.step, "Expected the journal to be removed")
+
+    def _make_runtime_patch(self, local, source, target):
+        """Create a patch updating VERSIONS.txt and a file of a runtime platform."""
+        from cbor2 import dumps
+        from pyzstd import compress
+        from xxhash import xxh3_64_intdigest
+
+        platform = local.joinpath(source, "files")
+        mode = platform.joinpath("foo").stat().st_mode
+        contents = [
+            {
+                "manifest": [
+                    {
+                        "name": "VERSIONS.txt",
+                        "mode": mode,
+                        "xxhash": xxh3_64_intdigest(b"foo" * 8),
+                        "size": 24,
+                        "time": 0.0,
+                    }
+                ],
+                "add": [],
+                "update": [
+                    {
+                        "name": "VERSIONS.txt",
+                        # Small files are replaced with their raw data
+                        "data": b"bar" * 8,
+                        "type": "file",
+                        "mode": mode,
+                        "xxhash": xxh3_64_intdigest(b"bar" * 8),
+                        "time": 0.0,
+                        "size": 24,
+                    }
+                ],
+                "delete": [],
+                "source": "steamrt3-0.20240125.75305",
+                "target": "steamrt3-0.20240530.90143",
+            },
+            {
+                "manifest": [
+                    {
+                        "name": "files/foo",
+                        "mode": mode,
+                        "xxhash": xxh3_64_intdigest(b"foo"),
+                        "size": 3,
+                        "time": 0.0,
+                    }
+                ],
+                "add": [
+                    {
+                        "name": "files/bar",
+                        "data": compress(b"bar"),
+                        "type": "file",
+                        "mode": mode,
+                        "xxhash": xxh3_64_intdigest(b"bar"),
+                        "time": 0.0,
+                        "size": 3,
+                    }
+                ],
+                "update": [],
+                "delete": [],
+                "source": source,
+                "target": target,
+            },
+        ]
+        path = local.parent.joinpath("steamrt3.cbor")
+        path.write_bytes(dumps({"contents": contents}))
+        return path
+
+    def test_update_umu_delta(self):
+        """Test _update_umu_delta when patching the installed runtime."""
+        mock_runtime_ver = ("sniper", "steamrt3", "1628350")
+        result = False
 
-    def test_main_noroot(self):
-        """Test __main__.main to ensure an exit when run as a privileged user."""
-        with (
-            patch.object(
-                __main__,
-                "parse_args",
-                return_value=["foo", "foo"],
-            ),
-            self.assertRaises(SystemExit),
-            patch.object(os, "geteuid", return_value=0),
-        ):
-            __main__.main()
+        if not all(map(find_spec, ("cbor2", "pyzstd", "xxhash"))):
+            err = "delta dependencies not installed"
+            self.skipTest(err)
 
-    def test_restore_umu_cb_false(self):
-        """Test _restore_umu when the callback evaluates to False."""
-        mock_cb = Mock(return_value=False)
-        result = MagicMock()
+        with TemporaryDirectory() as file:
+            local = Path(file, "steamrt3")
+            local.joinpath("sniper_platform_0.20240125.75305", "files").mkdir(
+                parents=True
+            )
+            local.joinpath(
+                "sniper_platform_0.20240125.75305", "files", "foo"
+            ).write_text("foo")
+            local.joinpath("VERSIONS.txt").write_text("foo" * 8)
+            local.joinpath("umu").symlink_to("_v2-entry-point")
+            mock_patch = self._make_runtime_patch(
+                local,
+                "sniper_platform_0.20240125.75305",
+                "sniper_platform_0.20240530.90143",
+            )
+            with (
+                patch.object(umu_runtime, "UMU_CACHE", Path(file)),
+                patch.object(umu_runtime, "find_spec", return_value=True),
+                patch.object(
+                    umu_runtime, "_fetch_runtime_patch", return_value=mock_patch
+                ),
+                patch.object(umu_runtime, "is_valid_patch", return_value=True),
+                patch.object(
+                    umu_runtime, "check_runtime", return_value=0
+                ) as mock_check,
+                ThreadPoolExecutor() as thread_pool,
+            ):
+                result = umu_runtime._update_umu_delta(
+                    local,
+                    mock_runtime_ver,
+                    "0.20240125.75305",
+                    "0.20240530.90143",
+                    (thread_pool, MagicMock()),
+                )
 
-        with (
-            TemporaryDirectory() as file,
-            patch.object(umu_runtime, "_install_umu"),
-        ):
-            mock_subdir = Path(file).joinpath("steamrt3")
-            mock_subdir.mkdir(parents=True, exist_ok=True)
-            mock_runtime_ver = ("sniper", "steamrt3", "1628350")
-            mock_version = "3.0.20260415.224995"
-            mock_session_pools = (MagicMock(), MagicMock())
-            result = umu_runtime._restore_umu(
-                mock_subdir, mock_runtime_ver, mock_version, mock_session_pools, mock_cb
+            self.assertTrue(result, "Expected the runtime to be patched")
+            self.assertEqual(
+                local.joinpath("VERSIONS.txt").read_text(),
+                "bar" * 8,
+                "Expected VERSIONS.txt to be updated",
             )
-            self.assertTrue(result is None, f"Expected None, received {result}")
-            self.assertTrue(
-                mock_cb.mock_calls,
-                "Expected callback to be called",
+            self.assertEqual(
+                local.joinpath(
+                    "sniper_platform_0.20240530.90143", "files", "bar"
+                ).read_text(),
+                "bar",
+                "Expected the platform to be renamed and updated",
+            )
+            self.assertTrue(local.joinpath("umu").is_symlink(), "Expected umu link")
+            mock_check.assert_called_once()
+            self.assertFalse(
+                Path(file, ".steamrt3.staging").exists(),
+                "Expected the staging directory to be removed",
             )
 
-    def test_restore_umu(self):
-        """Test _restore_umu."""
-        mock_cb = Mock(return_value=True)
-        result = MagicMock()
+    def test_update_umu_delta_mismatch(self):
+        """Test _update_umu_delta when the patch is for a different runtime.
+
+        Expects the installed runtime to be left untouched and the full runtime to
+        be downloaded instead.
+        """
+        mock_runtime_ver = ("sniper", "steamrt3", "1628350")
+        result = True
+
+        if not all(map(find_spec, ("cbor2", "pyzstd", "xxhash"))):
+            err = "delta dependencies not installed"
+            self.skipTest(err)
 
         with TemporaryDirectory() as file:
-            mock_subdir = Path(file).joinpath("steamrt3")
-            mock_subdir.mkdir(parents=True, exist_ok=True)
-            mock_runtime_ver = ("sniper", "steamrt3", "1628350")
-            mock_version = "3.0.20260415.224995"
-            mock_session_pools = (MagicMock(), MagicMock())
-            result = umu_runtime._restore_umu(
-                mock_subdir, mock_runtime_ver, mock_version, mock_session_pools, mock_cb
+            local = Path(file, "steamrt3")
+            local.joinpath("sniper_platform_0.20240125.75305", "files").mkdir(
+                parents=True
+            )
+            local.joinpath(
+                "sniper_platform_0.20240125.75305", "files", "foo"
+            ).write_text("foo")
+            local.joinpath("VERSIONS.txt").write_text("foo" * 8)
+            mock_patch = self._make_runtime_patch(
+                local,
+                "sniper_platform_0.20240125.75305",
+                "sniper_platform_0.20240601.91000",
             )
-            self.assertTrue(result is None, f"Expected None, received {result}")
-            self.assertTrue(
-                mock_cb.mock_calls,
-                "Expected callback to be called",
+            with (
+                patch.object(umu_runtime, "UMU_CACHE", Path(file)),
+                patch.object(umu_runtime, "find_spec", return_value=True),
+                patch.object(
+                    umu_runtime, "_fetch_runtime_patch", return_value=mock_patch
+                ),
+                patch.object(umu_runtime, "is_valid_patch") as mock_valid,
+                ThreadPoolExecutor() as thread_pool,
+            ):
+                result = umu_runtime._update_umu_delta(
+                    local,
+                    mock_runtime_ver,
+                    "0.20240125.75305",
+                    "0.20240530.90143",
+                    (thread_pool, MagicMock()),
+                )
+
+            self.assertFalse(result, "Expected the patch to be skipped")
+            mock_valid.assert_not_called()
+            self.assertEqual(
+                local.joinpath("VERSIONS.txt").read_text(),
+                "foo" * 8,
+                "Expected the installed runtime to be untouched",
+            )
+
+    def test_repair_umu(self):
+        """Test _repair_umu when restoring a deleted subtree from the cached archive."""
+        mock_runtime_ver = ("sniper", "steamrt3", "1628350")
+        archive = umu_runtime._runtime_archive(mock_runtime_ver[0])
+        root = archive.removesuffix(".tar.xz")
+
+        with TemporaryDirectory() as file:
+            cache = Path(file, "cache")
+            cache.mkdir()
+            # Mock the runtime archive
+            src = Path(file, "src", root)
+            src.joinpath("pressure-vessel", "bin").mkdir(parents=True)
+            src.joinpath("pressure-vessel", "bin", "pv-verify").write_text("foo")
+            src.joinpath("sniper_platform_0.20240125.75305", "files").mkdir(
+                parents=True
+            )
+            src.joinpath("VERSIONS.txt").write_text("bar")
+            with tarfile.open(Path(file, archive), "w:xz") as tar:
+                tar.add(src, arcname=root)
+            # Mock the install
+            members = []
+            umu_util.extract_tarfile(
+                Path(file, archive), Path(file, "local"), members=members
+            )
+            local = Path(file, "local", root)
+            with patch.object(umu_runtime, "UMU_CACHE", cache):
+                umu_runtime._cache_runtime(Path(file, archive), root, members)
+                self.assertTrue(
+                    cache.joinpath(f"{archive}.index.json").is_file(),
+                    "Expected the archive's index to be cached",
+                )
+                rmtree(local.joinpath("pressure-vessel"))
+                result = umu_runtime._repair_umu(
+                    local, mock_runtime_ver, ("pressure-vessel",)
+                )
+
+            self.assertTrue(result, "Expected the runtime to be repaired")
+            self.assertEqual(
+                local.joinpath("pressure-vessel", "bin", "pv-verify").read_text(),
+                "foo",
+                "Expected pv-verify to be restored",
             )
 
+    def test_repair_umu_nocache(self):
+        """Test _repair_umu when the runtime archive was not cached."""
+        with TemporaryDirectory() as file:
+            with patch.object(umu_runtime, "UMU_CACHE", Path(file)):
+                result = umu_runtime._repair_umu(
+                    Path(file), ("sniper", "steamrt3", "1628350"), ("VERSIONS.txt",)
+                )
+            self.assertFalse(result, "Expected False when the cache is empty")
+
+    def test_read_mtree(self):
+        """Test _read_mtree when reading keywords, escapes and continued lines."""
+        mtree = (
+            "#mtree\n"
+            "/set type=file mode=644\n"
+            ". type=dir mode=755\n"
+            "./foo\\040bar size=3 \\\n"
+            "    sha256=abc\n"
+            "./baz type=link link=foo\\040bar\n"
+            "/unset mode\n"
+            "./qux size=0\n"
+        )
+
+        with TemporaryDirectory() as file:
+            path = Path(file, "mtree.txt.gz")
+            with gzip.open(path, "wt") as fp:
+                fp.write(mtree)
+            entries = list(umu_runtime._read_mtree(path))
+
+        self.assertEqual(len(entries), 4, f"Expected 4 entries, received {entries}")
+        self.assertEqual(entries[1].name, "foo bar", "Expected escapes to be decoded")
+        self.assertEqual(entries[1].mode, 0o644, "Expected /set mode to be applied")
+        self.assertEqual(entries[1].sha256, "abc", "Expected continued line")
+        self.assertEqual(entries[2].link, "foo bar", "Expected link target")
+        self.assertIsNone(entries[3].mode, "Expected /unset mode to be applied")
+
+    def test_repair_runtime(self):
+        """Test repair_runtime when a file was corrupted after an install."""
+        mock_runtime_ver = ("sniper", "steamrt3", "1628350")
+        archive = umu_runtime._runtime_archive(mock_runtime_ver[0])
+        root = archive.removesuffix(".tar.xz")
+        data = b"foo"
+        digest = hashlib.sha256(data).hexdigest()
+
+        with TemporaryDirectory() as file:
+            cache = Path(file, "cache")
+            cache.mkdir()
+            # Mock the runtime archive and its mtree
+            src = Path(file, "src", root)
+            lib = src.joinpath("sniper_platform_0.20240125.75305", "files", "lib")
+            lib.mkdir(parents=True)
+            lib.joinpath("libfoo.so").write_bytes(data)
+            with gzip.open(src.joinpath("mtree.txt.gz"), "wt") as fp:
+                fp.write(
+                    "#mtree\n"
+                    "./sniper_platform_0.20240125.75305/files/lib type=dir\n"
+                    "./sniper_platform_0.20240125.75305/files/lib/libfoo.so "
+                    f"type=file mode=644 size={len(data)} sha256={digest}\n"
+                )
+            with tarfile.open(Path(file, archive), "w:xz") as tar:
+                tar.add(src, arcname=root)
+            members = []
+            umu_util.extract_tarfile(
+                Path(file, archive), Path(file, "local"), members=members
+            )
+            local = Path(file, "local", root)
+            so = local.joinpath(lib.relative_to(src), "libfoo.so")
+            with patch.object(umu_runtime, "UMU_CACHE", cache):
+                umu_runtime._cache_runtime(Path(file, archive), root, members)
+                # Mock a corrupted library
+                so.write_bytes(b"bar")
+                result = umu_runtime.repair_runtime(local, mock_runtime_ver)
+
+            self.assertEqual(result, 0, "Expected the runtime to be repaired")
+            self.assertEqual(so.read_bytes(), data, "Expected libfoo.so repaired")
+
+    def test_repair_runtime_dir(self):
+        """Test repair_runtime when a directory was deleted after an install."""
+        mock_runtime_ver = ("sniper", "steamrt3", "1628350")
+        archive = umu_runtime._runtime_archive(mock_runtime_ver[0])
+        root = archive.removesuffix(".tar.xz")
+        data = b"foo"
+        digest = hashlib.sha256(data).hexdigest()
+
+        with TemporaryDirectory() as file:
+            cache = Path(file, "cache")
+            cache.mkdir()
+            # Mock the runtime archive and its mtree
+            src = Path(file, "src", root)
+            files = src.joinpath("sniper_platform_0.20240125.75305", "files")
+            files.joinpath("a", "c").mkdir(parents=True)
+            files.joinpath("a", "b.txt").write_bytes(data)
+            files.joinpath("a", "c", "d.txt").write_bytes(data)
+            with gzip.open(src.joinpath("mtree.txt.gz"), "wt") as fp:
+                fp.write(
+                    "#mtree\n"
+                    "./sniper_platform_0.20240125.75305/files/a type=dir\n"
+                    "./sniper_platform_0.20240125.75305/files/a/b.txt "
+                    f"type=file mode=644 size={len(data)} sha256={digest}\n"
+                    "./sniper_platform_0.20240125.75305/files/a/c type=dir\n"
+                    "./sniper_platform_0.20240125.75305/files/a/c/d.txt "
+                    f"type=file mode=644 size={len(data)} sha256={digest}\n"
+                )
+            with tarfile.open(Path(file, archive), "w:xz") as tar:
+                tar.add(src, arcname=root)
+            members = []
+            umu_util.extract_tarfile(
+                Path(file, archive), Path(file, "local"), members=members
+            )
+            local = Path(file, "local", root)
+            a = local.joinpath(files.relative_to(src), "a")
+            with patch.object(umu_runtime, "UMU_CACHE", cache):
+                umu_runtime._cache_runtime(Path(file, archive), root, members)
+                # Mock a deleted directory
+                rmtree(a)
+                result = umu_runtime.repair_runtime(local, mock_runtime_ver)
+
+            self.assertEqual(result, 0, "Expected the runtime to be repaired")
+            self.assertEqual(a.joinpath("b.txt").read_bytes(), data)
+            self.assertEqual(a.joinpath("c", "d.txt").read_bytes(), data)
+
     def test_setup_umu_update(self):
         """Test setup_umu when updating the runtime."""
         result = MagicMock()
@@ -1912,6 +4003,102 @@ class TestGameLauncher(unittest.TestCase):
             )
             self.assertEqual(result, 0, "Expected the exit code 0")
 
+    def test_check_runtime_stamp(self):
+        """Test check_runtime when the runtime is unchanged since its validation."""
+        runtime = Path(self.test_user_share, "sniper_platform_0.20240125.75305")
+        runtime.joinpath("files").mkdir()
+        runtime.joinpath("files", "foo").touch()
+        mock = CompletedProcess(["foo"], 0)
+
+        with patch.object(umu_runtime, "run", return_value=mock) as mock_run:
+            result = umu_runtime.check_runtime(
+                self.test_user_share, self.test_runtime_default
+            )
+            self.assertEqual(result, 0, "Expected the exit code 0")
+            result = umu_runtime.check_runtime(
+                self.test_user_share, self.test_runtime_default
+            )
+            self.assertEqual(result, 0, "Expected the exit code 0")
+            self.assertEqual(mock_run.call_count, 1, "Expected pv-verify to be skipped")
+
+            # Any change to the files must be verified again
+            runtime.joinpath("files", "foo").write_text("bar")
+            umu_runtime.check_runtime(self.test_user_share, self.test_runtime_default)
+            self.assertEqual(mock_run.call_count, 2, "Expected pv-verify to run")
+
+            umu_runtime.check_runtime(
+                self.test_user_share, self.test_runtime_default, force=True
+            )
+            self.assertEqual(mock_run.call_count, 3, "Expected a forced validation")
+
+    def test_check_runtime_mtree(self):
+        """Test check_runtime when pv-verify does not exist, but the mtree does."""
+        runtime = Path(self.test_user_share, "sniper_platform_0.20240125.75305")
+        runtime.joinpath("files", "usr").mkdir(parents=True)
+        runtime.joinpath("files", "usr", "foo").write_bytes(b"foo")
+        with gzip.open(runtime.joinpath("usr-mtree.txt.gz"), "wt") as fp:
+            fp.write(
+                "#mtree\n"
+                "./usr type=dir\n"
+                "./usr/foo type=file size=3 "
+                f"sha256={hashlib.sha256(b'foo').hexdigest()}\n"
+            )
+        self.test_user_share.joinpath("pressure-vessel", "bin", "pv-verify").unlink()
+
+        result = umu_runtime.check_runtime(
+            self.test_user_share, self.test_runtime_default
+        )
+        self.assertEqual(result, 0, "Expected the exit code 0")
+
+    def test_verify_mtree(self):
+        """Test verify_mtree reports each entry that failed validation."""
+        data = b"foo"
+        digest = hashlib.sha256(data).hexdigest()
+
+        with TemporaryDirectory() as file, ThreadPoolExecutor() as thread_pool:
+            root = Path(file, "files")
+            root.joinpath("usr", "lib").mkdir(parents=True)
+            root.joinpath("usr", "lib", "ok.so").write_bytes(data)
+            root.joinpath("usr", "lib", "bad.so").write_bytes(b"bar")
+            root.joinpath("usr", "lib", "exe").write_bytes(data)
+            root.joinpath("usr", "lib", "link").symlink_to("bad.so")
+            mtree = Path(file, "usr-mtree.txt.gz")
+            with gzip.open(mtree, "wt") as fp:
+                fp.write(
+                    "#mtree\n"
+                    "/set type=file mode=644\n"
+                    "./usr type=dir mode=755\n"
+                    "./usr/lib type=dir mode=755\n"
+                    f"./usr/lib/ok.so size=3 sha256={digest}\n"
+                    f"./usr/lib/bad.so size=3 sha256={digest}\n"
+                    f"./usr/lib/exe size=3 mode=755 sha256={digest}\n"
+                    f"./usr/lib/missing.so size=3 sha256={digest}\n"
+                    "./usr/lib/link type=link link=ok.so\n"
+                    "./etc type=dir mode=755\n"
+                )
+
+            failed = umu_runtime.verify_mtree(root, mtree, thread_pool)
+            names = [entry.name for entry, _ in failed]
+            self.assertEqual(
+                names,
+                [
+                    "etc",
+                    "usr/lib/bad.so",
+                    "usr/lib/exe",
+                    "usr/lib/link",
+                    "usr/lib/missing.so",
+                ],
+                f"Expected failed entries, received {failed}",
+            )
+
+            # Only ./usr is shipped for minimized runtimes
+            failed = umu_runtime.verify_mtree(root, mtree, thread_pool, minimized=True)
+            self.assertNotIn(
+                "etc",
+                [entry.name for entry, _ in failed],
+                "Expected missing entries outside ./usr to be skipped",
+            )
+
     def test_check_runtime_dir(self):
         """Test check_runtime when passed a BUILD_ID that does not exist."""
         runtime = Path(self.test_user_share, "sniper_platform_0.20240125.75305")
@@ -2078,6 +4265,255 @@ class TestGameLauncher(unittest.TestCase):
             "Expected the x86_64 proton asset, received the aarch64 one",
         )
 
+    def test_fetch_releases_archives(self):
+        """Test _fetch_releases when a release ships multiple archive formats.
+
+        Expects every archive for the host to be listed with its size.
+        """
+        mock_gh_release = {
+            "assets": [
+                {"name": "UMU-Proton-9.0-4.sha512sum", "browser_download_url": ""},
+                {
+                    "name": "UMU-Proton-9.0-4.tar.gz",
+                    "browser_download_url": "foo",
+                    "size": 2,
+                },
+                {
+                    "name": "UMU-Proton-9.0-4.tar.xz",
+                    "browser_download_url": "bar",
+                    "size": 1,
+                },
+            ]
+        }
+        mock_resp = MagicMock()
+        mock_resp.status = 200
+        mock_resp.json.return_value = mock_gh_release
+        mock_hp = MagicMock()
+        mock_hp.request.return_value = mock_resp
+        archives = []
+        os.environ["PROTONPATH"] = ""
+
+        with patch.object(umu_proton.platform, "machine", return_value="x86_64"):
+            result = umu_proton._fetch_releases((MagicMock(), mock_hp), archives)
+
+        self.assertEqual(result[1], ("UMU-Proton-9.0-4.tar.gz", "foo"))
+        self.assertEqual(
+            archives,
+            [
+                ("UMU-Proton-9.0-4.tar.gz", "foo", 2),
+                ("UMU-Proton-9.0-4.tar.xz", "bar", 1),
+            ],
+            "Expected every archive with its size",
+        )
+
+    def test_get_routes(self):
+        """Test _get_routes when UMU-Latest can be patched or downloaded.
+
+        Expects a route to patch the build and a route for each archive, and the
+        patch to be planned first when it is smaller.
+        """
+        os.environ["PROTONPATH"] = "UMU-Latest"
+        proton = self.test_umu_compat.joinpath("UMU-Latest")
+        proton.mkdir()
+        proton.joinpath("foo").write_bytes(b"foo" * 1024)
+        assets = (
+            ("UMU-Proton-9.0-4.sha512sum", "foo"),
+            ("UMU-Proton-9.0-4.tar.gz", "bar"),
+        )
+        archives = [
+            ("UMU-Proton-9.0-4.tar.gz", "bar", 500 << 20),
+            ("UMU-Proton-9.0-4.tar.xz", "baz", 400 << 20),
+        ]
+        patch_asset = {"name": "UMU-Latest.cbor", "browser_download_url": "qux"}
+        patch_asset["size"] = 1 << 20
+        throughput = umu_plan.Throughput(self.test_cache.joinpath("throughput.json"))
+
+        routes = umu_proton._get_routes(
+            self.env,
+            (self.test_umu_compat, self.test_compat),
+            (self.test_cache, self.test_cache),
+            (assets, archives, patch_asset),
+            self.test_session_pools,
+            throughput,
+        )
+
+        self.assertEqual(
+            [route.name for route in routes],
+            [
+                "delta",
+                "archive: UMU-Proton-9.0-4.tar.gz",
+                "archive: UMU-Proton-9.0-4.tar.xz",
+            ],
+        )
+        self.assertEqual(routes[0].work[umu_plan.Resource.Patch], 3072)
+        self.assertEqual(routes[2].work[umu_plan.Resource.Xz], 400 << 20)
+        with patch.object(umu_plan, "free_space", return_value=1 << 40):
+            plan = umu_plan.plan_routes(routes, throughput)
+        self.assertEqual(plan[0].name, "delta", "Expected the patch first")
+
+    def test_get_routes_chain(self):
+        """Test _get_routes when UMU-Latest is behind by several patches.
+
+        Expects the delta route to be costed by every patch published since the
+        build was installed, and the archive to be planned first when it is smaller.
+        """
+        os.environ["PROTONPATH"] = "UMU-Latest"
+        proton = self.test_umu_compat.joinpath("UMU-Latest")
+        proton.mkdir()
+        proton.joinpath("compatibilitytool.vdf").write_text("foo")
+        assets = (
+            ("UMU-Proton-9.0-4.sha512sum", "foo"),
+            ("UMU-Proton-9.0-4.tar.gz", "bar"),
+        )
+        archives = [("UMU-Proton-9.0-4.tar.xz", "baz", 400 << 20)]
+        patch_asset = {"name": "UMU-Latest.cbor", "browser_download_url": "qux"}
+        patch_asset["size"] = 300 << 20
+        throughput = umu_plan.Throughput(self.test_cache.joinpath("throughput.json"))
+        releases = [
+            {
+                "published_at": published_at,
+                "assets": [
+                    {
+                        "name": "UMU-Latest.cbor",
+                        "browser_download_url": durl,
+                        "size": size,
+                    }
+                ],
+            }
+            for published_at, durl, size in (
+                ("2099-01-02T00:00:00Z", "qux", 300 << 20),
+                ("2099-01-01T00:00:00Z", "quux", 200 << 20),
+                ("2000-01-01T00:00:00Z", "corge", 1 << 20),
+            )
+        ]
+        mock_resp = MagicMock()
+        mock_resp.status = 200
+        mock_resp.json.return_value = releases
+        self.test_session_pools[1].request.return_value = mock_resp
+
+        routes = umu_proton._get_routes(
+            self.env,
+            (self.test_umu_compat, self.test_compat),
+            (self.test_cache, self.test_cache),
+            (assets, archives, patch_asset),
+            self.test_session_pools,
+            throughput,
+        )
+
+        self.assertEqual(routes[0].name, "delta")
+        self.assertEqual(
+            routes[0].work[umu_plan.Resource.Network],
+            500 << 20,
+            "Expected the size of the patches since the build was installed",
+        )
+        with patch.object(umu_plan, "free_space", return_value=1 << 40):
+            plan = umu_plan.plan_routes(routes, throughput)
+        self.assertEqual(
+            plan[0].name, "archive: UMU-Proton-9.0-4.tar.xz", "Expected the archive"
+        )
+
+    def test_plan_routes(self):
+        """Test plan_routes when ranking routes by their expected time.
+
+        Expects the fastest route first, and routes without enough free space to
+        be dropped.
+        """
+        throughput = umu_plan.Throughput(self.test_cache.joinpath("throughput.json"))
+        routes = [
+            umu_plan.Route("foo", MagicMock(), {umu_plan.Resource.Network: 8 << 20}),
+            umu_plan.Route(
+                "bar",
+                MagicMock(),
+                {umu_plan.Resource.Network: 1 << 20, umu_plan.Resource.Xz: 8 << 20},
+            ),
+            umu_plan.Route(
+                "baz",
+                MagicMock(),
+                {umu_plan.Resource.Network: 0},
+                space=1 << 62,
+                path=self.test_cache,
+            ),
+        ]
+
+        plan = umu_plan.plan_routes(routes, throughput)
+        self.assertEqual([route.name for route in plan], ["bar", "foo"])
+
+        # Once the network is measured to be faster, downloading more is faster
+        throughput.record(umu_plan.Resource.Network, 1 << 30, 1_000_000_000)
+        plan = umu_plan.plan_routes(routes, throughput)
+        self.assertEqual([route.name for route in plan], ["foo", "bar"])
+
+    def test_run_routes(self):
+        """Test run_routes when the fastest route fails.
+
+        Expects the next route to be run.
+        """
+        throughput = umu_plan.Throughput(self.test_cache.joinpath("throughput.json"))
+        mock_foo = MagicMock(return_value=False)
+        mock_bar = MagicMock(return_value=True)
+        routes = [
+            umu_plan.Route("bar", mock_bar, {umu_plan.Resource.Network: 2 << 20}),
+            umu_plan.Route("foo", mock_foo, {umu_plan.Resource.Network: 1 << 20}),
+        ]
+
+        result = umu_plan.run_routes(routes, throughput)
+
+        self.assertIs(result, routes[0], "Expected the second route to succeed")
+        mock_foo.assert_called_once()
+        mock_bar.assert_called_once()
+        self.assertIsNone(umu_plan.run_routes([], throughput), "Expected no route")
+
+    def test_throughput(self):
+        """Test Throughput when recording and reloading measurements."""
+        path = self.test_cache.joinpath("throughput.json")
+
+        with umu_plan.Throughput(path) as throughput:
+            default = throughput.get(umu_plan.Resource.Gzip)
+            throughput.record(umu_plan.Resource.Gzip, 1024, 1)
+            self.assertEqual(
+                throughput.get(umu_plan.Resource.Gzip),
+                default,
+                "Expected small measurements to be ignored",
+            )
+            throughput.record(umu_plan.Resource.Gzip, 100 << 20, 1_000_000_000)
+            throughput.record(umu_plan.Resource.Gzip, 200 << 20, 1_000_000_000)
+
+        rate = umu_plan.Throughput(path).get(umu_plan.Resource.Gzip)
+        self.assertEqual(rate, (100 << 20) * 1.3, "Expected the moving average")
+        self.assertFalse(
+            list(path.parent.glob(f".{path.name}.*")), "Expected no temporary file"
+        )
+
+        path.write_text("[]")
+        self.assertEqual(
+            umu_plan.Throughput(path).get(umu_plan.Resource.Gzip),
+            default,
+            "Expected the default for an invalid file",
+        )
+
+    def test_get_installed(self):
+        """Test _get_installed when UMU-Latest is the latest build."""
+        os.environ["PROTONPATH"] = "UMU-Latest"
+        assets = (
+            ("UMU-Proton-9.0-4.sha512sum", "foo"),
+            ("UMU-Proton-9.0-4.tar.gz", "bar"),
+        )
+        proton = self.test_umu_compat.joinpath("UMU-Latest")
+        proton.mkdir()
+        proton.joinpath("compatibilitytool.vdf").write_text(
+            '"display_name" "UMU-Proton-9.0-3"'
+        )
+
+        result = umu_proton._get_installed(self.env, self.test_umu_compat, assets)
+        self.assertIsNone(result, "Expected the outdated build to be skipped")
+
+        proton.joinpath("compatibilitytool.vdf").write_text(
+            '"display_name" "UMU-Proton-9.0-4"'
+        )
+        result = umu_proton._get_installed(self.env, self.test_umu_compat, assets)
+        self.assertIs(result, self.env, "Expected the latest build to be used")
+        self.assertEqual(self.env["PROTONPATH"], str(proton))
+
     def test_ge_proton(self):
         """Test check_env when the code name GE-Proton is set for PROTONPATH.
 
@@ -2187,6 +4623,44 @@ class TestGameLauncher(unittest.TestCase):
             self.assertFalse(self.env["PROTONPATH"], "Expected PROTONPATH to be empty")
             self.assertFalse(result, "Expected None on KeyboardInterrupt")
 
+    def test_latest_lock(self):
+        """Test _get_latest locks UMU-Latest and UMU-Proton downloads together.
+
+        Both download the same archive, and resume from the same file.
+        """
+        files = (("", ""), (self.test_archive.name, ""))
+        tmpdirs = (self.test_cache, self.test_cache_home)
+        compats = (self.test_umu_compat, self.test_compat)
+        locks = []
+
+        # Mock the context manager object that creates the file lock
+        mock_ctx = MagicMock()
+        mock_ctx.__enter__ = MagicMock(return_value=None)
+        mock_ctx.__exit__ = MagicMock(return_value=None)
+
+        for codename in ("UMU-Latest", "UMU-Proton", "GE-Latest", "GE-Proton"):
+            with (
+                patch.dict(os.environ, {"PROTONPATH": codename}),
+                patch("umu.umu_proton._fetch_proton", side_effect=ValueError),
+                patch.object(
+                    umu_proton, "unix_flock", return_value=mock_ctx
+                ) as mock_flock,
+            ):
+                umu_proton._get_latest(
+                    self.env, compats, tmpdirs, files, self.test_session_pools
+                )
+            locks.append(Path(mock_flock.call_args.args[0]).name)
+
+        self.assertEqual(
+            locks,
+            [
+                "UMU-Proton.compatibilitytools.d.lock",
+                "UMU-Proton.compatibilitytools.d.lock",
+                "GE-Proton.compatibilitytools.d.lock",
+                "GE-Proton.compatibilitytools.d.lock",
+            ],
+        )
+
     def test_latest_val_err(self):
         """Test _get_latest when something goes wrong when downloading Proton.
 
@@ -2374,6 +4848,129 @@ class TestGameLauncher(unittest.TestCase):
             "Expected PROTONPATH to be proton dir in compat",
         )
 
+    def test_steamcompat_index(self):
+        """Test _get_from_compat when builds are found by the index.
+
+        Expects the latest build by its natural order, and the index to be written
+        to UMU_LOCAL.
+        """
+        for name in ("GE-Proton9-9", "GE-Proton9-10", "UMU-Proton-9.0-4"):
+            self.test_compat.joinpath(name).mkdir()
+        os.environ["PROTONPATH"] = "GE-Proton"
+
+        with patch.object(umu_proton, "UMU_LOCAL", self.test_local_share_parent):
+            result = umu_proton._get_from_compat(
+                self.env, (self.test_umu_compat, self.test_compat)
+            )
+
+        self.assertTrue(result is self.env, "Expected the same reference")
+        self.assertEqual(
+            self.env["PROTONPATH"],
+            str(self.test_compat.joinpath("GE-Proton9-10")),
+            "Expected the latest GE-Proton",
+        )
+        self.assertTrue(
+            self.test_local_share_parent.joinpath(umu_index.COMPAT_INDEX).is_file(),
+            "Expected the index to be written",
+        )
+
+    def test_compat_index(self):
+        """Test CompatIndex when revalidating a compat directory by its mtime.
+
+        Expects the tools to be read once, until the directory changes, and each
+        tool to be resolved by its manifest.
+        """
+        mock_manifest = (
+            '"manifest"\n'
+            "{\n"
+            '  "commandline" "/proton %verb%"\n'
+            '  "require_tool_appid" "1628350"\n'
+            '  "compatmanager_layer_name" "proton"\n'
+            "}"
+        )
+        index_path = self.test_local_share_parent.joinpath(umu_index.COMPAT_INDEX)
+        proton = self.test_compat.joinpath("GE-Proton9-1")
+        proton.mkdir()
+        proton.joinpath("toolmanifest.vdf").write_text(mock_manifest)
+        self.test_compat.joinpath("foo").touch()
+        # Not recently modified, so its mtime is trusted
+        os.utime(self.test_compat, ns=(10**18, 10**18))
+
+        with umu_index.CompatIndex(index_path, (self.test_compat,)) as index:
+            tool = index.get(proton)
+        self.assertEqual(tool["layer"], "proton", "Expected the layer name")
+        self.assertEqual(tool["appid"], "1628350", "Expected the required appid")
+        self.assertEqual(list(index.tools(self.test_compat)), ["GE-Proton9-1"])
+        self.assertIsNone(
+            index.get(self.test_umu_compat.joinpath("foo")),
+            "Expected no tool outside of the indexed directories",
+        )
+
+        with (
+            patch.object(umu_index, "_read_tool", wraps=umu_index._read_tool) as mock,
+            umu_index.CompatIndex(index_path, (self.test_compat,)) as index,
+        ):
+            self.assertEqual(index.get(proton), tool, "Expected the indexed tool")
+            mock.assert_not_called()
+            self.test_compat.joinpath("GE-Proton9-2").mkdir()
+            tool = index.latest(self.test_compat, "GE-Proton")
+            self.assertEqual(tool["name"], "GE-Proton9-2", "Expected the new tool")
+            self.assertIsNone(tool["layer"], "Expected no manifest")
+            self.assertEqual(mock.call_count, 2, "Expected the directory to be read")
+
+    def test_compat_index_save(self):
+        """Test CompatIndex when concurrent sessions save the index.
+
+        Expects each session to write its own temporary file, so the index is
+        never interleaved.
+        """
+        index_path = self.test_local_share_parent.joinpath(umu_index.COMPAT_INDEX)
+        self.test_compat.joinpath("GE-Proton9-1").mkdir()
+        os.utime(self.test_compat, ns=(10**18, 10**18))
+        indexes = [
+            umu_index.CompatIndex(index_path, (self.test_compat,)) for _ in range(8)
+        ]
+        for index in indexes:
+            index.tools(self.test_compat)
+
+        with ThreadPoolExecutor() as thread_pool:
+            for future in [thread_pool.submit(index.save) for index in indexes]:
+                future.result()
+
+        with index_path.open(encoding="utf-8") as file:
+            self.assertIn(str(self.test_compat.absolute()), json.load(file))
+        self.assertFalse(
+            list(index_path.parent.glob(f".{umu_index.COMPAT_INDEX}.*")),
+            "Expected no temporary file",
+        )
+
+    def test_resolve_runtime_index(self):
+        """Test resolve_runtime when the tool is within the index.
+
+        Expects the required runtime without parsing its manifest.
+        """
+        proton = self.test_compat.joinpath("GE-Proton9-1")
+        proton.mkdir()
+        tool = {
+            "name": proton.name,
+            "version": umu_index.version_key(proton.name),
+            "layer": "proton",
+            "appid": "1628350",
+            "mtime": 0,
+        }
+        os.environ["PROTONPATH"] = proton.name
+
+        with (
+            patch.object(umu_run, "STEAM_COMPAT", self.test_compat.absolute()),
+            patch.object(umu_run, "UMU_LOCAL", self.test_local_share_parent),
+            patch.object(umu_index.CompatIndex, "get", return_value=tool),
+            patch.object(umu_run, "CompatLayer") as mock_layer,
+        ):
+            result = umu_run.resolve_runtime()
+
+        self.assertEqual(result.name, "sniper", "Expected the required runtime")
+        mock_layer.assert_not_called()
+
     def test_extract_tarfile_err(self):
         """Test extract_tarfile when passed a non-gzip compressed archive.
 
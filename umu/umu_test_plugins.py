@@ -181,6 +181,9 @@ class TestGameLauncherPlugins(unittest.TestCase):
         if self.test_local_share.exists():
             rmtree(self.test_local_share.as_posix())
 
+        if self.test_local_share_parent.exists():
+            rmtree(self.test_local_share_parent)
+
     def test_build_command_entry(self):
         """Test build_command.
 
@@ -1,4 +1,5 @@
 import errno
+import json
 import os
 import platform
 import sys
@@ -6,29 +7,54 @@ from collections.abc import Generator
 from contextlib import contextmanager, redirect_stdout
 from ctypes import CDLL, get_errno
 from ctypes.util import find_library
-from enum import IntFlag
-from fcntl import LOCK_EX, LOCK_UN, flock
+from enum import Enum, IntFlag
+from fcntl import LOCK_EX, LOCK_NB, LOCK_SH, LOCK_UN, flock, ioctl
 from functools import cache
 from hashlib import new as hashnew
 from io import BufferedIOBase, BufferedRandom
 from pathlib import Path
 from re import Pattern
 from re import compile as re_compile
-from shutil import which
+from secrets import token_hex
+from shutil import copy2, copystat, rmtree, which
+from struct import pack_into, unpack_from
 from subprocess import PIPE, STDOUT, Popen, TimeoutExpired  # nosec B404
+from tarfile import TarFile, TarInfo
 from tarfile import open as taropen
 from tempfile import gettempdir, mkdtemp
+from time import monotonic, sleep
 from typing import Any
 
 from urllib3.response import BaseHTTPResponse
 from Xlib import display
 
-from umu.umu_consts import TMPFS_MIN, UMU_CACHE, WINETRICKS_SETTINGS_VERBS
+from umu.umu_consts import (
+    TMPFS_MIN,
+    UMU_CACHE,
+    WINETRICKS_SETTINGS_VERBS,
+    FileLock,
+)
 from umu.umu_log import log
 
 INSTALL_MARKER = ".installed.ok"
 INSTALL_MARKER_TMP = ".installed.ok.tmp"
 
+# Seconds between attempts to acquire a lock held by another process
+LOCK_POLL_INTERVAL = 0.1
+
+# Seconds between the messages of a process waiting for a lock
+LOCK_PROGRESS_INTERVAL = 5
+
+# ioctl(2) request to share the extents of a file. See ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+# ioctl(2) request to map the extents of a file. See linux/fiemap.h
+FS_IOC_FIEMAP = 0xC020660B
+
+# Size of struct fiemap and of each struct fiemap_extent following it
+FIEMAP_SIZE = 32
+FIEMAP_EXTENT_SIZE = 56
+
 
 class Renameat2(IntFlag):
     """Represent a supported bit mask flag for renameat2.
@@ -46,20 +72,65 @@ class Renameat2(IntFlag):
     RENAME_WHITEOUT = 4
 
 
+def get_lock_path(parent: Path, lock: FileLock, name: str) -> str:
+    """Return the path of the lock of a single compatibility tool or runtime.
+
+    Each tool or runtime has its own lock (e.g., UMU-Latest.compatibilitytools.d.lock
+    or steamrt3.umu.lock), so updating one does not block launching another.
+    """
+    return f"{parent}/{name}.{lock.value}"
+
+
 @contextmanager
-def unix_flock(path: str):
-    """Create a file and configure it to be locking."""
+def unix_flock(path: str, *, shared: bool = False, timeout: float | None = None):
+    """Create a file and configure it to be locking.
+
+    The lock is exclusive, unless shared is set for processes that only read what
+    it protects. While another process holds the lock, the wait is reported every
+    few seconds and TimeoutError is raised once timeout seconds elapsed. The time
+    spent waiting for the lock is logged.
+    """
     fd: int | None = None
+    kind: str = "shared" if shared else "exclusive"
 
     try:
-        fd = os.open(path, os.O_CREAT | os.O_WRONLY, 0o644)
-        # See https://man7.org/linux/man-pages/man2/flock.2.html
-        flock(fd, LOCK_EX)
+        fd = os.open(path, os.O_CREAT | os.O_WRONLY | os.O_CLOEXEC, 0o644)
+        log.debug("Acquiring %s lock '%s'...", kind, path)
+        waited: float = _wait_flock(fd, LOCK_SH if shared else LOCK_EX, path, timeout)
+        log.debug("Acquired %s lock '%s' after %.3fs", kind, path, waited)
         yield fd
     finally:
         if fd is not None:
             flock(fd, LOCK_UN)
             os.close(fd)
+            log.debug("Released %s lock '%s'", kind, path)
+
+
+def _wait_flock(fd: int, operation: int, path: str, timeout: float | None) -> float:
+    # Acquire a lock, polling while it is contended. Returns the seconds waited
+    start: float = monotonic()
+    reported: float = start
+
+    # See https://man7.org/linux/man-pages/man2/flock.2.html
+    try:
+        flock(fd, operation | LOCK_NB)
+        return 0.0
+    except BlockingIOError:
+        log.info("Waiting for '%s', in use by another process...", path)
+
+    while True:
+        sleep(LOCK_POLL_INTERVAL)
+        try:
+            flock(fd, operation | LOCK_NB)
+            return monotonic() - start
+        except BlockingIOError:
+            now: float = monotonic()
+            if timeout is not None and now - start >= timeout:
+                err: str = f"Timed out after {now - start:.0f}s waiting for '{path}'"
+                raise TimeoutError(err) from None
+            if now - reported >= LOCK_PROGRESS_INTERVAL:
+                log.info("Still waiting for '%s' (%.0fs)...", path, now - start)
+                reported = now
 
 
 @contextmanager
@@ -349,12 +420,31 @@ def get_tempdir(cache: Path = UMU_CACHE) -> Path:
     return Path(mkdtemp()) if has_tmpfs_min else Path(mkdtemp(prefix=".", dir=cache))
 
 
-def extract_tarfile(path: Path, dest: Path) -> Path | None:
+def _set_extraction_filter(tar: TarFile) -> None:
+    try:
+        # We require Python 3.10+ and extraction filters require 3.12+
+        from tarfile import tar_filter  # noqa: PLC0415
+
+        tar.extraction_filter = tar_filter
+        log.debug("Using data filter for archive")
+    except ImportError:
+        # User is on a distro that did not backport extraction filters
+        log.warning("Python: %s", sys.version)
+        log.warning("Using no data filter for archive")
+        log.warning("Archive will be extracted insecurely")
+
+
+def extract_tarfile(
+    path: Path, dest: Path, *, members: list[TarInfo] | None = None
+) -> Path | None:
     """Read and securely extract a compressed TAR archive to path.
 
     Warns the user if unable to extract the archive securely, falling
     back to unsafe extraction. The filter used is 'tar_filter'.
 
+    When passed a list of members, it will be extended with the members read
+    from the archive, including their offsets, without requiring another pass.
+
     See https://docs.python.org/3/library/tarfile.html#tarfile.tar_filter
     """
     if not path.is_file():
@@ -363,24 +453,45 @@ def extract_tarfile(path: Path, dest: Path) -> Path | None:
     # Note: r:tar is a valid mode in cpython.
     # See https://github.com/python/cpython/blob/b83be9c9718aac42d0d8fc689a829d6594192afa/Lib/tarfile.py#L1871
     with taropen(path, f"r:{path.suffix.removeprefix('.')}") as tar:  # type: ignore
-        try:
-            # We require Python 3.10+ and extraction filters require 3.12+
-            from tarfile import tar_filter  # noqa: PLC0415
-
-            tar.extraction_filter = tar_filter
-            log.debug("Using data filter for archive")
-        except ImportError:
-            # User is on a distro that did not backport extraction filters
-            log.warning("Python: %s", sys.version)
-            log.warning("Using no data filter for archive")
-            log.warning("Archive will be extracted insecurely")
-
+        _set_extraction_filter(tar)
         log.debug("Extracting: %s -> %s", path, dest)
         tar.extractall(path=dest)  # noqa: S202
+        if members is not None:
+            members.extend(tar.getmembers())
 
     return dest
 
 
+def extract_tarmembers(path: Path, dest: Path, offsets: list[int]) -> bool:
+    """Securely extract the members at the header offsets of a TAR archive to path.
+
+    Members are read by seeking to their headers in ascending order, which
+    avoids reading the members that precede them for uncompressed archives
+    and stops decompressing after the last requested member for compressed
+    ones. Hard links are only extracted when their target is also requested.
+
+    Returns True when all members were extracted.
+    """
+    if not path.is_file() or not offsets:
+        return False
+
+    names: set[str] = set()
+    with taropen(path, f"r:{path.suffix.removeprefix('.')}") as tar:  # type: ignore
+        _set_extraction_filter(tar)
+        log.debug("Extracting %s members: %s -> %s", len(offsets), path, dest)
+        for offset in sorted(offsets):
+            tar.fileobj.seek(offset)  # type: ignore
+            member: TarInfo = TarInfo.fromtarfile(tar)
+            # Avoid falling back to a full scan of the archive in tarfile
+            if member.islnk() and member.linkname not in names:
+                log.debug("Link target not requested: %s", member.linkname)
+                return False
+            tar.extract(member, path=dest)
+            names.add(member.name)
+
+    return True
+
+
 def marker_path(runtime_dir: Path) -> Path:
     """Return install marker path."""
     return runtime_dir / INSTALL_MARKER
@@ -394,14 +505,196 @@ def has_runtime_installed(runtime_dir: Path) -> bool:
         return False
 
 
-def write_install_marker(runtime_dir: Path) -> None:
-    """Write the install marker atomically-ish after successful install."""
+def write_install_marker(runtime_dir: Path, generation: str = "ok") -> None:
+    """Write the install marker atomically-ish after successful install.
+
+    The generation identifies the install that wrote the marker.
+    """
     marker = marker_path(runtime_dir)
     tmp = runtime_dir / INSTALL_MARKER_TMP
-    tmp.write_text("ok\n", encoding="utf-8")
+    tmp.write_text(f"{generation}\n", encoding="utf-8")
     tmp.replace(marker)
 
 
+def read_install_marker(runtime_dir: Path) -> str:
+    """Return the generation of the install marker, or an empty string."""
+    try:
+        return marker_path(runtime_dir).read_text(encoding="utf-8").strip()
+    except (OSError, UnicodeDecodeError):
+        return ""
+
+
+class InstallStep(Enum):
+    """Represent a completed step of an install, in order."""
+
+    Staged = "staged"  # Archive downloaded and its digest verified
+    Extracted = "extracted"
+    Verified = "verified"  # Contents validated and synced to disk
+    Committed = "committed"  # Contents moved in place
+
+
+class InstallJournal:
+    """Record the last completed step of an install of a runtime or tool.
+
+    Each record atomically replaces the journal, but is not synced to disk. A
+    single syncfs of the install's file system is expected before recording
+    that the contents were verified, so any earlier step is safe to repeat
+    after a crash.
+    """
+
+    def __init__(self, path: Path) -> None:  # noqa: D107
+        self._path = path
+
+    def read(self) -> dict[str, str]:
+        """Return the last record, or an empty record if there is none."""
+        try:
+            with self._path.open(encoding="utf-8") as file:
+                state: dict[str, str] = json.load(file)
+            InstallStep(state["step"])
+            return state
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    @property
+    def step(self) -> InstallStep | None:
+        """Return the last completed step."""
+        state: dict[str, str] = self.read()
+        return InstallStep(state["step"]) if state else None
+
+    def record(self, step: InstallStep, **state: str) -> dict[str, str]:
+        """Record a completed step, keeping the state of the previous record."""
+        tmp: Path = self._path.with_name(f"{self._path.name}.tmp")
+        record: dict[str, str] = self.read() | state | {"step": step.value}
+        with tmp.open("w", encoding="utf-8") as file:
+            json.dump(record, file)
+        tmp.replace(self._path)
+        log.debug("Journal '%s': %s", self._path, record)
+        return record
+
+    def clear(self) -> None:
+        """Remove the journal after an install was committed or abandoned."""
+        self._path.unlink(missing_ok=True)
+
+
+def syncfs(path: Path) -> None:
+    """Commit the file system containing path to disk.
+
+    Intended to be a single barrier after writing many files instead of calling
+    fsync on each file. Falls back to sync(2) when syncfs(2) is unsupported.
+    """
+    fd: int = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+
+    try:
+        libc: CDLL = CDLL(get_libc(), use_errno=True)
+        if libc.syncfs(fd) == 0:
+            return
+        err = get_errno()
+        log.debug("syncfs failed for '%s': %s", path, os.strerror(err))
+    except AttributeError:
+        log.debug("syncfs is not supported by libc")
+    finally:
+        os.close(fd)
+
+    os.sync()
+
+
+class IOOrder(Enum):
+    """Represent the order in which many files are read from a file system."""
+
+    # Physical order on rotational storage, otherwise the order of the manifest
+    Auto = "auto"
+    # Physical offset of the first extent of each file, by FIEMAP
+    Extent = "extent"
+    # Inode number of each file, which correlates with its location on disk
+    Inode = "inode"
+    # Order of the manifest
+    Off = "off"
+
+
+@cache
+def _is_rotational(dev: int) -> bool:
+    # Whether the block device of a file system is rotational. Devices without a
+    # queue of their own (e.g., partitions) are checked by their parent
+    sysfs: Path = Path(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+
+    for path in (sysfs, sysfs.resolve().parent):
+        try:
+            return path.joinpath("queue", "rotational").read_text().strip() == "1"
+        except OSError:
+            continue
+
+    return False
+
+
+def get_io_order(path: Path) -> IOOrder:
+    """Return the order to read many files within the file system of path.
+
+    By default, files are only sorted by their location on disk when the file
+    system is on rotational storage, where seeking dominates the time to read
+    many small files. Set UMU_IO_ORDER to override it.
+    """
+    value: str = os.environ.get("UMU_IO_ORDER", IOOrder.Auto.value)
+
+    try:
+        order: IOOrder = IOOrder(value)
+    except ValueError:
+        log.warning("UMU_IO_ORDER is invalid: %s", value)
+        order = IOOrder.Auto
+
+    if order != IOOrder.Auto:
+        return order
+
+    try:
+        dev: int = path.stat().st_dev
+    except OSError:
+        return IOOrder.Off
+
+    return IOOrder.Extent if _is_rotational(dev) else IOOrder.Off
+
+
+def _get_physical_offset(path: Path) -> int | None:
+    # Physical offset of the first extent of a file, or None when the file system
+    # does not support FIEMAP or the file has no extents (e.g., it's empty or a link)
+    buf: bytearray = bytearray(FIEMAP_SIZE + FIEMAP_EXTENT_SIZE)
+
+    try:
+        fd: int = os.open(path, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK)
+    except OSError:
+        return None
+
+    # fm_start, fm_length, fm_flags, fm_mapped_extents, fm_extent_count
+    pack_into("=QQIII", buf, 0, 0, 2**64 - 1, 0, 0, 1)
+    try:
+        ioctl(fd, FS_IOC_FIEMAP, buf)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+    if not unpack_from("=I", buf, 20)[0]:
+        return None
+
+    # fe_logical, fe_physical
+    return unpack_from("=QQ", buf, FIEMAP_SIZE)[1]
+
+
+def get_layout_key(path: Path, order: IOOrder) -> int:
+    """Return the key to sort a file by its location on disk, without following links.
+
+    Falls back to the inode number when the physical offset of the file is unknown,
+    and to 0 when the file does not exist.
+    """
+    offset: int | None = _get_physical_offset(path) if order == IOOrder.Extent else None
+
+    if offset is not None:
+        return offset
+
+    try:
+        return path.lstat().st_ino
+    except OSError:
+        return 0
+
+
 def has_umu_setup(path: Path, machine: str) -> bool:
     """Check if umu has been setup in our runtime directory."""
     if not path.exists():
@@ -559,3 +852,123 @@ def renameat2(src: os.PathLike, dest: os.PathLike, flags: Renameat2) -> None:
 def exchange(src: os.PathLike, dest: os.PathLike) -> None:
     """Atomically exchange paths between two files."""
     renameat2(src, dest, Renameat2.RENAME_EXCHANGE)
+
+
+def swap_current(pointer: Path, target: Path) -> None:
+    """Atomically point a compatibility tool to one of its installed versions.
+
+    The pointer is replaced by a link to target, relative to the parent of the
+    pointer. Sessions that resolved the previous version keep running from it.
+    When the pointer is a directory, as installed by previous releases, it is
+    exchanged with the link then moved next to target, to be retired by
+    prune_trees.
+    """
+    link: Path = pointer.with_name(f".{pointer.name}.{token_hex(4)}")
+    link.symlink_to(target.relative_to(pointer.parent))
+
+    try:
+        if pointer.is_symlink() or not pointer.exists():
+            log.debug("Linking: %s -> %s", pointer, target)
+            link.replace(pointer)
+            return
+        # rename(2) cannot replace a directory with a link, so exchange them
+        log.debug("Exchanging: %s <-> %s", link, pointer)
+        exchange(link, pointer)
+        log.debug("Moving: %s -> %s", link, target.parent)
+        link.rename(target.parent.joinpath(f"{pointer.name}.{token_hex(4)}"))
+    finally:
+        # Of a failed swap, the link is left behind
+        if link.is_symlink():
+            link.unlink()
+
+
+@contextmanager
+def hold_tree(path: Path) -> Generator[None, Any, None]:
+    """Hold a directory of a compatibility tool or runtime while it is in use.
+
+    A shared lock is taken on the directory itself, so it follows the directory
+    when it is renamed or retired. Trees that are held are skipped by prune_trees.
+    """
+    fd: int | None = None
+
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+        flock(fd, LOCK_SH)
+    except OSError as e:
+        log.debug("Unable to hold '%s': %s", path, e)
+
+    try:
+        yield
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def prune_trees(versions: Path, keep: Path | None = None) -> None:
+    """Remove the directories within versions, except keep and those being held.
+
+    Directories held by a session are removed by a later call once released. Hidden
+    names are skipped, as they are in use by an install.
+    """
+    if not versions.is_dir():
+        return
+
+    for path in versions.iterdir():
+        if path.name.startswith(".") or path == keep:
+            continue
+        if path.is_symlink() or not path.is_dir():
+            continue
+        fd: int = os.open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+        try:
+            flock(fd, LOCK_EX | LOCK_NB)
+            log.debug("Removing: %s", path)
+            rmtree(path)
+        except BlockingIOError:
+            log.debug("Directory '%s' is in use, skipping", path)
+        finally:
+            os.close(fd)
+
+
+def retire_tree(path: Path, retired: Path) -> None:
+    """Move a directory within retired, to be removed once no session holds it."""
+    retired.mkdir(parents=True, exist_ok=True)
+    dest: Path = retired.joinpath(f"{path.name}.{token_hex(4)}")
+    log.debug("Moving: %s -> %s", path, dest)
+    path.rename(dest)
+    prune_trees(retired)
+
+
+def clone_file(src: str, dest: str) -> str:
+    """Copy a file by sharing its extents with the source, when supported.
+
+    Copies on write (i.e., reflinks) on file systems like Btrfs and XFS. Otherwise,
+    falls back to copying its data. Intended to be used as the copy function of
+    shutil.copytree.
+    """
+    try:
+        with Path(src).open("rb") as fsrc, Path(dest).open("wb") as fdest:
+            ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+    except OSError as e:
+        if e.errno not in {errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY}:
+            raise
+        return copy2(src, dest)
+
+    copystat(src, dest)
+    return dest
+
+
+def link_file(src: str, dest: str) -> str:
+    """Link a file to the source, falling back to cloning the source.
+
+    The linked file shares its inode with the source, so it must be replaced rather
+    than modified in place. Intended to be used as the copy function of
+    shutil.copytree.
+    """
+    try:
+        os.link(src, dest, follow_symlinks=False)
+    except OSError as e:
+        if e.errno not in {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP}:
+            raise
+        return clone_file(src, dest)
+
+    return dest